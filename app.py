@@ -1,219 +1,581 @@
-from flask import Flask, send_file, jsonify, request
+from flask import Flask, send_file, jsonify, request, Response, stream_with_context, g
 import os
+import sys
+import argparse
+import atexit
+import ipaddress
+import queue
+import json
+import tempfile
+import uuid
 from io import BytesIO
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from itertools import islice
 import webbrowser
 import threading
 import time
 import logging
-import re # For display name generation
+from collections import OrderedDict, deque
 
 # pypdf import
 from pypdf import PdfReader, PdfWriter
-# Import necessary types from pypdf.generic
-from pypdf.generic import DictionaryObject, ArrayObject, NameObject, BooleanObject, TextStringObject, NumberObject, IndirectObject
 
 app = Flask(__name__, static_folder="static")
-FILES_FOLDER = "files" # PDFs to be filled are here
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+FILES_FOLDER = os.path.abspath(os.environ.get("FILES_FOLDER", os.path.join(APP_ROOT, "files"))) # PDFs to be filled are here
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Constants for PDF field flags (values are 2^(bit_position-1))
-PDF_FIELD_FLAG_READ_ONLY = 1 << (1 - 1)
-PDF_FIELD_FLAG_RADIO = 1 << (16 - 1)
-PDF_FIELD_FLAG_PUSHBUTTON = 1 << (17 - 1)
-# Add other flags if needed (e.g., REQUIRED, NO_EXPORT, etc.)
-
-
-# --- Enhanced Helper Function for Display Names ---
-def format_field_name_for_display(name):
-    """Converts internal PDF field names to more readable display names."""
-    if not name:
-        return ""
-    # Specific replacements (case-insensitive pattern matching)
-    specific_replacements = {
-        "Dateofbirth": "Date of Birth", "Date Of Birth": "Date of Birth",
-        "Orunemployed": "Or Unemployed", "Retiredorunemployed": "Retired or Unemployed",
-        "Retiredor": "Retired or", "Accountholder": "Account Holder",
-        "Holderemail": "Holder Email", "Holderdate Ofbirth": "Holder Date of Birth",
-        "Holderdependents": "Holder Dependents", "Holderemployer": "Holder Employer",
-        "Holdermarital": "Holder Marital", "Maritalstatus": "Marital Status",
-        "Employername": "Employer Name", "Priorposition": "Prior Position",
-        "Current Orprior Position": "Current or Prior Position",
-        "Document Andcurrent Supplementalsprovided": "Document And Current Supplementals Provided",
-        "Supplementalsprovided": "Supplementals Provided",
-        "Numberof Yearsexperience": "Number of Years Experience",
-        "Numberof Tradesper Month": "Number of Trades per Month",
-        "Numberof": "Number of", "Tradesper": "Trades per", "Yearsexperience": "Years Experience",
-        "Covered Callsnumbers Ofyears Experience": "Covered Calls Numbers of Years Experience",
-        # Add more specific cases as identified
-    }
-    processed_name = name
-    for pattern, replacement in specific_replacements.items():
-        processed_name = re.sub(r'(?i)' + re.escape(pattern), lambda m: replacement, processed_name)
-    
-    # General CamelCase, number, and separator splitting
-    s1 = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', processed_name)
-    s1 = re.sub(r'([A-Z])([A-Z][a-z])', r'\1 \2', s1)
-    s1 = re.sub(r'([a-zA-Z])([0-9]+)', r'\1 \2', s1)
-    s1 = re.sub(r'([0-9])([a-zA-Z])', r'\1 \2', s1)
-    s2 = re.sub(r'[_\-]+', ' ', s1)
-    s3 = re.sub(r'\s+', ' ', s2).strip()
-    
-    # Capitalization with lowercase small words (of, or, per, and, etc.)
-    words = s3.split(' ')
-    final_words = []
-    small_words = {"of", "or", "per", "and", "the", "a", "an"}
-    for i, word_val in enumerate(words):
-        if not word_val: continue
-        if word_val.lower() in small_words and i != 0 and i != len(words) -1 :
-            final_words.append(word_val.lower())
-        else:
-            final_words.append(word_val[0].upper() + word_val[1:])
-    
-    # Fix leading 'Or' if it was lowercased
-    if final_words and final_words[0].lower() == "or" and name.strip().startswith("Or"):
-        final_words[0] = "Or"
-        
-    return ' '.join(final_words)
+# ------------------------------------------------
+# 1. Field Extraction with Details (see pdf_fields.py)
+# ------------------------------------------------
+from pdf_fields import (PDF_FIELD_FLAG_READ_ONLY, PDF_FIELD_FLAG_RADIO, PDF_FIELD_FLAG_PUSHBUTTON,
+                        format_field_name_for_display, extract_fields_with_details, timed_extract, init_index_worker, WidgetMap, FillPlan, RENDER_MODES, fill_form,
+                        WRITE_MODES, clone_for_fill, prepare_for_write)
+import field_index
+import fill_cache
+import mail_merge
+import metrics
+from metrics import timed_phase, record_phase
 
 # ------------------------------------------------
-# 1. Field Extraction with Details (Includes Widget Count)
+# 2. Template Document Cache (parsed readers, LRU by estimated memory)
 # ------------------------------------------------
-def extract_fields_with_details(pdf_path):
-    """Extracts detailed field info including type, options, value, and widget count."""
-    detailed_fields = []
-    try:
-        reader = PdfReader(pdf_path)
-        form_fields = reader.get_fields()
-        if not form_fields:
-            logger.info(f"No interactive form fields found in {pdf_path}")
-            return []
-            
-        for field_name_fq, field_obj_ref in form_fields.items():
-            try:
-                field_obj = field_obj_ref.get_object()
-                # Prefer /T for field name, fallback to fully qualified name
-                field_name_t = field_obj.get("/T")
-                if field_name_t: field_name = str(field_name_t).strip()
-                else: field_name = str(field_name_fq).strip(); logger.debug(f"Field '{field_name_fq}' missing /T, using FQ name.")
-                
-                # --- Filtering ---
-                lname = field_name.lower()
-                if "signature" in lname or "datesigned" in lname or "print name" in lname or ("title" in lname and "job title" not in lname) :
-                    logger.debug(f"Filtered meta field: {field_name}"); continue
-                ff_val = field_obj.get("/Ff", 0)
-                if isinstance(ff_val, NumberObject): ff_val = int(ff_val)
-                if ff_val & PDF_FIELD_FLAG_READ_ONLY: logger.debug(f"Filtered read-only: {field_name}"); continue
-                if ff_val & PDF_FIELD_FLAG_PUSHBUTTON: logger.debug(f"Ignoring pushbutton: {field_name}"); continue
-                
-                # --- Determine Widget Count ---
-                widget_count = 0
-                kids = field_obj.get(NameObject("/Kids")) # Use NameObject for keys
-                if kids and isinstance(kids, ArrayObject):
-                    widget_count = len(kids)
-                elif NameObject("/Subtype") in field_obj and field_obj[NameObject("/Subtype")] == NameObject("/Widget"):
-                    # If it has /Subtype /Widget and no /Kids, it's likely a single widget field
-                     widget_count = 1
-                else:
-                    # Fallback: Assume 1 if it's a field pypdf returned and not clearly a non-widget parent
-                    widget_count = 1 
-                    logger.debug(f"Field '{field_name}' widget count determination fallback: assuming 1.")
-
-                # --- Get Field Value ---
-                raw_value = field_obj.get("/V")
-                field_info_value = None
-                if isinstance(raw_value, (NameObject, TextStringObject)): field_info_value = str(raw_value)
-                elif raw_value is not None: field_info_value = raw_value 
-
-                # --- Initialize Field Info Dict ---
-                field_info = {
-                    "name": field_name, 
-                    "displayName": format_field_name_for_display(field_name),
-                    "type": "text", # Default type
-                    "options": [], 
-                    "export_value": None, # For checkbox 'On' state
-                    "value": field_info_value, 
-                    "widget_count": widget_count, # Store widget count for this PDF
-                    "usedInPdfs": [] # Populated later in /combined_fields
-                }
-
-                # --- Determine Field Type and Options ---
-                field_type_raw = field_obj.get("/FT")
-                if field_type_raw == NameObject("/Tx"): field_info["type"] = "text"
-                elif field_type_raw == NameObject("/Btn"):
-                    if ff_val & PDF_FIELD_FLAG_RADIO:
-                        field_info["type"] = "radio"
-                        radio_options = set()
-                        kids_for_opts = field_obj.get("/Kids") 
-                        if kids_for_opts:
-                            for kid_ref in kids_for_opts:
-                                kid_obj = kid_ref.get_object(); ap = kid_obj.get("/AP")
-                                if ap and isinstance(ap, DictionaryObject):
-                                    n_dict = ap.get("/N")
-                                    if isinstance(n_dict, DictionaryObject):
-                                        for evo in n_dict: 
-                                            evo_str = str(evo)
-                                            if evo_str.lower() != "/off": radio_options.add(evo_str)
-                        if not radio_options and field_obj.get("/Opt"):
-                            opts_raw = field_obj.get("/Opt")
-                            if opts_raw and isinstance(opts_raw, ArrayObject):
-                                for opt_val_raw in opts_raw:
-                                    if isinstance(opt_val_raw, (NameObject, TextStringObject)): radio_options.add(str(opt_val_raw))
-                        field_info["options"] = sorted(list(radio_options))
-                        if not field_info["options"]: logger.warning(f"Radio '{field_name}' in {pdf_path} has no discernible options.")
-                    else: # Checkbox
-                        field_info["type"] = "checkbox"; on_value = "/Yes" 
-                        ap = field_obj.get("/AP")
-                        if ap and isinstance(ap, DictionaryObject):
-                            n_dict = ap.get("/N")
-                            if isinstance(n_dict, DictionaryObject):
-                                for key_obj in n_dict: 
-                                    key_str = str(key_obj)
-                                    if key_str.lower() != "/off": on_value = key_str; break 
-                        field_info["export_value"] = on_value
-                elif field_type_raw == NameObject("/Ch"): # Choice field
-                    field_info["type"] = "choice"; opts = field_obj.get("/Opt")
-                    choice_options = []
-                    if opts and isinstance(opts, ArrayObject):
-                        for opt_item in opts:
-                            if isinstance(opt_item, ArrayObject) and len(opt_item) == 2: 
-                                val = str(opt_item[0]) if isinstance(opt_item[0],(TextStringObject,NameObject)) else str(opt_item[0])
-                                disp = str(opt_item[1]) if isinstance(opt_item[1],(TextStringObject,NameObject)) else str(opt_item[1])
-                                choice_options.append({"value": val, "display": disp})
-                            elif isinstance(opt_item, (TextStringObject,NameObject)): 
-                                val=str(opt_item); choice_options.append({"value":val,"display":val})
-                    field_info["options"] = choice_options
-                else: # Default to text if type is unknown or unhandled
-                    if field_type_raw: logger.warning(f"Unknown field type '{str(field_type_raw)}' for {field_name}. Defaulting text.")
-                    field_info["type"] = "text"
-                
-                detailed_fields.append(field_info)
-            except Exception as e_inner: 
-                logger.error(f"Error processing field '{str(field_name_fq)}' in {pdf_path}: {e_inner}", exc_info=False) 
-    except Exception as e: 
-        logger.error(f"Critical error extracting fields from {pdf_path}: {e}", exc_info=True)
-    return detailed_fields
+TEMPLATE_CACHE_MAX_BYTES = int(os.environ.get("TEMPLATE_CACHE_MAX_BYTES", 64 * 1024 * 1024)) # estimated memory, not file bytes
+# Retained memory of a parsed template once a fill has resolved all of its objects, measured with tracemalloc on
+# the bundled templates: about the file size again (decoded copies of stream data) plus 3.5-4.5 KB per object.
+TEMPLATE_PARSED_BYTES_PER_OBJECT = 4096
+
+def estimate_template_memory(data, reader):
+    """Approximate bytes a cached template keeps alive: raw bytes, stream copies and the parsed object graph."""
+    object_count = sum(len(ids) for ids in reader.xref.values()) + len(reader.xref_objStm)
+    return 2 * len(data) + TEMPLATE_PARSED_BYTES_PER_OBJECT * object_count
+
+class TemplateChangedError(Exception):
+    """The template file no longer matches the signature of the pdf_data snapshot a request works from."""
+    retry_after = 1 # seconds until a retry should see the reloaded template
+
+class _TemplateEntry:
+    """One cached template: raw bytes, a parsed reader that fills clone from, and its widget layout."""
+    __slots__ = ("key", "data", "reader", "widget_map", "size", "lock")
+
+    def __init__(self, key, data):
+        self.key = key # (mtime_ns, size) of the file when it was read
+        self.data = data
+        self.reader = PdfReader(BytesIO(data))
+        self.widget_map = WidgetMap(self.reader)
+        self.size = estimate_template_memory(data, self.reader) # what the entry counts against the cache budget
+        self.lock = threading.Lock() # PdfReader is not thread-safe; clones are serialized per template
+
+class TemplateCache:
+    """
+    In-memory LRU cache of parsed template PDFs keyed by path plus mtime/size.
+    Callers pass the signature from their pdf_data snapshot, so a fill never pairs the snapshot's
+    FillPlan with bytes from a newer file (TemplateChangedError instead). A fill clones from the already-parsed reader instead of re-reading and re-parsing
+    the file. The budget is measured in estimated retained memory (estimate_template_memory(),
+    roughly 2-20x the file size); least recently used entries are evicted once it is exceeded
+    (the most recent entry is always kept).
+    """
+    def __init__(self, max_bytes=TEMPLATE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # path -> _TemplateEntry
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_entry(self, path, signature=None):
+        """Entry for `path` read at `signature` ((mtime_ns, size); default: the file as it is now)."""
+        if signature is None:
+            st = os.stat(path); signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.key == signature:
+                self._entries.move_to_end(path); self.hits += 1
+                return entry
+            self.misses += 1
+        with timed_phase("fill", "parse", os.path.basename(path)):
+            with open(path, "rb") as fh:
+                st = os.fstat(fh.fileno()); data = fh.read()
+            if (st.st_mtime_ns, st.st_size) != signature: # not parsed or cached: it may still be being copied
+                raise TemplateChangedError(f"'{os.path.basename(path)}' changed on disk since it was indexed.")
+            new_entry = _TemplateEntry(signature, data)
+        with self._lock:
+            old_entry = self._entries.pop(path, None)
+            if old_entry is not None: self.current_bytes -= old_entry.size
+            self._entries[path] = new_entry; self.current_bytes += new_entry.size
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_path, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size; self.evictions += 1
+                logger.debug(f"Template cache evicted {evicted_path} (~{evicted.size} bytes).")
+        return new_entry
+
+    def clone_template(self, path, write_mode="full", signature=None):
+        """
+        Returns (PdfWriter holding a private copy of the template at `path`, set up for `write_mode`, its WidgetMap).
+        With `signature`, raises TemplateChangedError unless the copy is of the file at that signature.
+        """
+        entry = self._get_entry(path, signature)
+        with entry.lock, timed_phase("fill", "clone", os.path.basename(path)):
+            writer = clone_for_fill(entry.reader, entry.data, write_mode)
+        return writer, entry.widget_map
+
+    def invalidate(self, path=None):
+        """Drops one template (or every template if `path` is None) from the cache."""
+        with self._lock:
+            if path is None:
+                self._entries.clear(); self.current_bytes = 0
+            else:
+                entry = self._entries.pop(path, None)
+                if entry is not None: self.current_bytes -= entry.size
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.current_bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+template_cache = TemplateCache()
 
 # ------------------------------------------------
-# 2. PDF Data Pre-Loading
+# 2a. Filled-Output Cache (content-addressed, optional; see fill_cache.py)
 # ------------------------------------------------
+FILL_CACHE_ENABLED = os.environ.get("FILL_CACHE", "0") == "1"
+FILL_CACHE_MAX_BYTES = int(os.environ.get("FILL_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+FILL_CACHE_TTL = float(os.environ.get("FILL_CACHE_TTL", 300)) # seconds a filled PDF (personal data) may be kept
+FILL_CACHE_DIR = os.environ.get("FILL_CACHE_DIR") # spill-over folder (one pid-<pid> subfolder per process) for entries evicted from memory; unset keeps them in memory
+FILL_CACHE_DISK_MAX_BYTES = int(os.environ.get("FILL_CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024))
+FILL_CACHE_KEY = os.environ.get("FILL_CACHE_KEY") # Fernet key for disk entries; a per-process key is generated if unset
+FILL_CACHE_DISK_PLAINTEXT = os.environ.get("FILL_CACHE_DISK_PLAINTEXT", "0") == "1" # allow unencrypted disk entries without 'cryptography'
+
+fill_result_cache = None # built by init_fill_cache() in the serving process only
+
+def init_fill_cache():
+    """Creates fill_result_cache (if FILL_CACHE is on); its disk tier is removed at exit."""
+    global fill_result_cache
+    if not FILL_CACHE_ENABLED or fill_result_cache is not None: return
+    fill_result_cache = fill_cache.FillResultCache(FILL_CACHE_MAX_BYTES, FILL_CACHE_TTL, FILL_CACHE_DIR, FILL_CACHE_DISK_MAX_BYTES,
+                                                   FILL_CACHE_KEY, FILL_CACHE_DISK_PLAINTEXT)
+    atexit.register(fill_result_cache.close)
+
+# ------------------------------------------------
+# 2b. Metrics (Prometheus text at /metrics; see metrics.py)
+# ------------------------------------------------
+SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING", "0") == "1" # add a Server-Timing header with per-phase durations
+
+HTTP_REQUEST_SECONDS = metrics.REGISTRY.histogram("http_request_duration_seconds", "Time until the response starts (streamed bodies continue after).", ("route", "method"))
+HTTP_REQUESTS = metrics.REGISTRY.counter("http_requests_total", "HTTP requests served.", ("route", "method", "status"))
+PDF_FILLS = metrics.REGISTRY.counter("pdf_fills_total", "Templates filled.", ("template", "mode"))
+PDF_FILL_ERRORS = metrics.REGISTRY.counter("pdf_fill_errors_total", "Template fills or writes that failed.", ("template",))
+PDF_FILL_BYTES = metrics.REGISTRY.counter("pdf_fill_bytes_total", "Bytes of filled PDF sent per template (ZIP entries uncompressed; a merged /fill_batch PDF as '(merged)').", ("template",))
+MERGED_TEMPLATE_LABEL = "(merged)" # template label for a merged /fill_batch PDF
+
+metrics.REGISTRY.gauge("pdf_template_cache", "Template cache state (entries, bytes, hits, misses, evictions).", ("stat",),
+                       lambda: [((stat,), value) for stat, value in template_cache.stats().items() if stat != "max_bytes"])
+metrics.REGISTRY.gauge("pdf_fill_result_cache", "Filled-output cache state (entries, bytes, hits, misses, evictions, expirations, ...).", ("stat",),
+                       lambda: [] if fill_result_cache is None else [((stat,), value) for stat, value in fill_result_cache.stats().items() if stat != "max_bytes"])
+metrics.REGISTRY.gauge("pdf_templates", "Templates currently loaded from FILES_FOLDER.", (), lambda: [((), len(pdf_data))])
+metrics.REGISTRY.gauge("combined_fields_results_cache", "Memoized /combined_fields results (hits, misses, entries) for the current snapshot.", ("stat",),
+                       lambda: [] if _field_postings is None else [(("hits",), _field_postings.result_hits), (("misses",), _field_postings.result_misses),
+                                                                   (("entries",), len(_field_postings.results))])
+
+# ------------------------------------------------
+# 3. PDF Data Pre-Loading
+# ------------------------------------------------
+PDF_INDEX_MODE = os.environ.get("PDF_INDEX_MODE", "eager") # 'eager': index everything at startup; 'lazy': index on first access
+PDF_INDEX_WORKERS = int(os.environ.get("PDF_INDEX_WORKERS", os.cpu_count() or 1))
+PDF_INDEX_WARMUP = os.environ.get("PDF_INDEX_WARMUP", "1") == "1" # lazy mode only: index the rest in a background thread
+PDF_INDEX_SLOW_MS = float(os.environ.get("PDF_INDEX_SLOW_MS", 500)) # per-file indexing time that gets a warning
+FIELD_INDEX_ENABLED = os.environ.get("FIELD_INDEX", "1") == "1" # persist extracted fields across restarts
+FIELD_INDEX_PATH = os.environ.get("FIELD_INDEX_PATH", field_index.default_index_path(FILES_FOLDER))
+FIELD_INDEX_SAVE_DELAY = float(os.environ.get("FIELD_INDEX_SAVE_DELAY", 10)) # seconds lazy extractions are batched before the index is saved
+PDF_WATCH_INTERVAL = float(os.environ.get("PDF_WATCH_INTERVAL", 0)) # seconds between scans of FILES_FOLDER; 0 disables hot reload
+
+# filename -> {"path", "signature" (mtime_ns, size), "fields_details" (None until indexed), "fill_plan", "index_ms"}
+# Replaced wholesale on reload, never edited key by key: read `pdf_data` once per request and use that map throughout.
 pdf_data = {}
-if not os.path.exists(FILES_FOLDER): 
-    os.makedirs(FILES_FOLDER); logger.info(f"Created missing folder: '{FILES_FOLDER}'")
-pdf_files_found = [f for f in os.listdir(FILES_FOLDER) if f.lower().endswith(".pdf")]
-if not pdf_files_found:
-     logger.warning(f"No PDF files found in the '{FILES_FOLDER}' directory.")
+_pdf_index_locks = {} # filename -> Lock guarding its first extraction
+_pdf_index_locks_guard = threading.Lock()
+_persisted_index = {} # filename -> field_index entry, mirrored to FIELD_INDEX_PATH
+_persisted_index_lock = threading.Lock()
+_field_index_save_timer = None # pending save after lazy extractions
+_field_index_save_lock = threading.Lock()
+_reload_lock = threading.Lock() # one reload (and pdf_data swap) at a time
+
+def _scan_files_folder():
+    """Returns {filename: (mtime_ns, size)} for every PDF currently in FILES_FOLDER."""
+    signatures = {}
+    for filename in os.listdir(FILES_FOLDER):
+        if not filename.lower().endswith(".pdf"): continue
+        try: st = os.stat(os.path.join(FILES_FOLDER, filename))
+        except OSError: continue # removed between listdir and stat
+        signatures[filename] = (st.st_mtime_ns, st.st_size)
+    return signatures
+
+def _new_pdf_entry(filename, signature):
+    return {"path": os.path.join(FILES_FOLDER, filename), "signature": signature, "fields_details": None, "fill_plan": None, "index_ms": None}
+
+def _set_fields_details(pdf_info, fields, index_ms):
+    """Stores a template's field details and compiles its FillPlan; fields_details is set last as the 'indexed' marker."""
+    pdf_info["fill_plan"] = FillPlan(fields); pdf_info["index_ms"] = index_ms
+    pdf_info["fields_details"] = fields
+
+def _record_index_result(filename, pdf_info, fields, elapsed_ms, phase_ms=None):
+    _set_fields_details(pdf_info, fields, elapsed_ms)
+    for phase, ms in (phase_ms or {}).items(): record_phase("extract", phase, ms / 1000, filename)
+    log = logger.warning if elapsed_ms >= PDF_INDEX_SLOW_MS else logger.info
+    log(f"Indexed {filename}: {len(fields)} field(s) in {elapsed_ms:.1f} ms.")
+    if FIELD_INDEX_ENABLED:
+        entry = field_index.make_entry(pdf_info["path"], fields, elapsed_ms, pdf_info["signature"]) # scanned before extraction
+        with _persisted_index_lock:
+            if entry is not None: _persisted_index[filename] = entry
+            else: _persisted_index.pop(filename, None)
+        if entry is None: logger.warning(f"{filename} changed while it was indexed; not persisting its fields.")
+
+def save_field_index():
+    """Writes the persisted index for the templates currently in pdf_data (dropping removed ones)."""
+    if not FIELD_INDEX_ENABLED: return
+    current_pdf_data = pdf_data
+    with _persisted_index_lock:
+        entries = {name: entry for name, entry in _persisted_index.items() if name in current_pdf_data}
+    try:
+        field_index.save_index(FIELD_INDEX_PATH, entries)
+        logger.info(f"Saved field index for {len(entries)} PDF(s) to {FIELD_INDEX_PATH}.")
+    except OSError as e:
+        logger.warning(f"Could not write field index {FIELD_INDEX_PATH}: {e}")
+
+def _run_scheduled_field_index_save():
+    global _field_index_save_timer
+    with _field_index_save_lock: _field_index_save_timer = None
+    save_field_index()
+
+def schedule_field_index_save():
+    """Saves the field index FIELD_INDEX_SAVE_DELAY seconds after the first of a burst of lazy extractions (or at exit, if sooner)."""
+    global _field_index_save_timer
+    if not FIELD_INDEX_ENABLED: return
+    with _field_index_save_lock:
+        if _field_index_save_timer is not None: return
+        _field_index_save_timer = threading.Timer(FIELD_INDEX_SAVE_DELAY, _run_scheduled_field_index_save)
+        _field_index_save_timer.daemon = True; _field_index_save_timer.start()
+
+def _save_pending_field_index():
+    global _field_index_save_timer
+    with _field_index_save_lock:
+        timer, _field_index_save_timer = _field_index_save_timer, None
+    if timer is not None:
+        timer.cancel(); save_field_index()
+
+atexit.register(_save_pending_field_index)
+
+def _apply_persisted_index(entries):
+    """Fills `entries` from the on-disk index where it is still valid. Returns (stale filenames, index needs saving)."""
+    if not FIELD_INDEX_ENABLED:
+        return list(entries), False
+    start = time.perf_counter()
+    persisted = field_index.load_index(FIELD_INDEX_PATH); stale_files = []; refreshed = 0
+    for filename, pdf_info in entries.items():
+        indexed_mtime = persisted.get(filename, {}).get("mtime_ns")
+        fields = field_index.lookup(persisted, filename, pdf_info["path"])
+        if fields is None:
+            stale_files.append(filename); continue
+        if persisted[filename]["mtime_ns"] != indexed_mtime: refreshed += 1 # content unchanged, only mtime moved
+        _set_fields_details(pdf_info, fields, persisted[filename].get("index_ms"))
+        with _persisted_index_lock: _persisted_index[filename] = persisted[filename]
+    logger.info(f"Field index {FIELD_INDEX_PATH}: {len(entries) - len(stale_files)} PDF(s) loaded in {(time.perf_counter() - start) * 1000:.1f} ms, {len(stale_files)} need extraction.")
+    return stale_files, bool(stale_files) or refreshed > 0 or not set(entries) <= set(persisted)
+
+def in_worker_process():
+    """True in a multiprocessing child, including a spawned child still re-running its parent's main script (which imports app)."""
+    # multiprocessing aliases __mp_main__ to __main__ in a parent; a spawned child runs the parent's script under that name
+    return multiprocessing.parent_process() is not None or getattr(sys.modules.get("__mp_main__"), "__name__", None) == "__mp_main__"
+
+def index_pdf_files(entries, workers=PDF_INDEX_WORKERS):
+    """
+    Extracts field details for the {filename: pdf_info} `entries` across a process pool (serially if only one
+    worker or file, or inside a child process: a spawned child may still be bootstrapping and cannot start a pool).
+    """
+    filenames = list(entries); paths = [entries[filename]["path"] for filename in filenames]
+    if in_worker_process(): workers = 1
+    start = time.perf_counter()
+    if workers > 1 and len(filenames) > 1:
+        # 'spawn' so workers start clean (no inherited locks or threads); they only import pdf_fields
+        with ProcessPoolExecutor(max_workers=min(workers, len(filenames)), mp_context=multiprocessing.get_context("spawn"), initializer=init_index_worker) as executor:
+            results = list(executor.map(timed_extract, paths, chunksize=max(1, len(paths) // (workers * 4))))
+    else:
+        results = [timed_extract(path) for path in paths]
+    for filename, (fields, elapsed_ms, phase_ms) in zip(filenames, results):
+        _record_index_result(filename, entries[filename], fields, elapsed_ms, phase_ms)
+    logger.info(f"Indexed {len(filenames)} PDF(s) in {(time.perf_counter() - start) * 1000:.1f} ms using {workers if len(filenames) > 1 else 1} worker(s).")
+
+def get_fields_details(pdf_name, pdf_info=None):
+    """Returns the field details for `pdf_name` (from `pdf_info` if given), extracting them on first access in lazy mode."""
+    if pdf_info is None: pdf_info = pdf_data[pdf_name]
+    if pdf_info["fields_details"] is not None:
+        return pdf_info["fields_details"]
+    with _pdf_index_locks_guard:
+        lock = _pdf_index_locks.setdefault(pdf_name, threading.Lock())
+    with lock:
+        if pdf_info["fields_details"] is None:
+            _record_index_result(pdf_name, pdf_info, *timed_extract(pdf_info["path"]))
+            schedule_field_index_save()
+    return pdf_info["fields_details"]
+
+def get_fill_plan(pdf_name, pdf_info=None):
+    """Returns the compiled FillPlan for `pdf_name`, indexing the template first if needed."""
+    if pdf_info is None: pdf_info = pdf_data[pdf_name]
+    get_fields_details(pdf_name, pdf_info)
+    return pdf_info["fill_plan"]
+
+def _warm_up_index():
+    """Background warm-up for lazy mode: indexes every template not yet touched by a request."""
+    start = time.perf_counter()
+    for filename, pdf_info in list(pdf_data.items()):
+        try: get_fields_details(filename, pdf_info)
+        except Exception as e: logger.error(f"Warm-up indexing failed for {filename}: {e}", exc_info=False)
+    logger.info(f"Background index warm-up finished in {(time.perf_counter() - start) * 1000:.1f} ms.")
+    save_field_index()
+
+def load_pdf_data():
+    """Builds pdf_data from FILES_FOLDER, indexing eagerly in parallel or lazily per PDF_INDEX_MODE."""
+    global pdf_data
+    if not os.path.exists(FILES_FOLDER): 
+        os.makedirs(FILES_FOLDER); logger.info(f"Created missing folder: '{FILES_FOLDER}'")
+    new_pdf_data = {filename: _new_pdf_entry(filename, signature) for filename, signature in _scan_files_folder().items()}
+    if not new_pdf_data:
+        logger.warning(f"No PDF files found in the '{FILES_FOLDER}' directory.")
+
+    stale_files, needs_save = _apply_persisted_index(new_pdf_data) # reuse the persisted index for unchanged templates
+    if PDF_INDEX_MODE == "lazy":
+        pdf_data = new_pdf_data
+        logger.info(f"Lazy indexing enabled: {len(pdf_data)} PDF(s) listed, {len(stale_files)} extracted on first access.")
+        if PDF_INDEX_WARMUP and stale_files:
+            threading.Thread(target=_warm_up_index, name="pdf-index-warmup", daemon=True).start()
+    else:
+        if stale_files: index_pdf_files({filename: new_pdf_data[filename] for filename in stale_files})
+        pdf_data = new_pdf_data
+        if needs_save: save_field_index()
+    logger.info(f"Finished loading PDF data. Found {len(pdf_data)} PDF(s).")
+    if PDF_WATCH_INTERVAL > 0:
+        start_files_watcher(PDF_WATCH_INTERVAL)
+
+def reload_pdf_data(on_disk=None):
+    """
+    Re-indexes only the templates added or modified in FILES_FOLDER and swaps in a new pdf_data map,
+    so concurrent requests see either the old map or the new one, never a mix. Returns (added, removed, modified).
+    """
+    global pdf_data
+    with _reload_lock:
+        current_pdf_data = pdf_data
+        if on_disk is None: on_disk = _scan_files_folder()
+        added = sorted(set(on_disk) - set(current_pdf_data))
+        removed = sorted(set(current_pdf_data) - set(on_disk))
+        modified = sorted(name for name in set(on_disk) & set(current_pdf_data) if on_disk[name] != current_pdf_data[name]["signature"])
+        if not (added or removed or modified):
+            return [], [], []
+
+        changed_entries = {filename: _new_pdf_entry(filename, on_disk[filename]) for filename in added + modified}
+        stale_files, _ = _apply_persisted_index(changed_entries)
+        if stale_files: index_pdf_files({filename: changed_entries[filename] for filename in stale_files})
+
+        new_pdf_data = {name: info for name, info in current_pdf_data.items() if name in on_disk}
+        new_pdf_data.update(changed_entries)
+        pdf_data = new_pdf_data # single reference swap
+        for filename in removed + modified:
+            template_cache.invalidate(current_pdf_data[filename]["path"])
+            if fill_result_cache is not None: fill_result_cache.invalidate_template(current_pdf_data[filename]["path"])
+    save_field_index()
+    logger.info(f"Reloaded '{FILES_FOLDER}': {len(added)} added, {len(removed)} removed, {len(modified)} modified. Now {len(pdf_data)} PDF(s).")
+    return added, removed, modified
+
+def _watch_files_folder(interval):
+    """Polls FILES_FOLDER; a change is applied once two consecutive scans agree, so half-copied files are not indexed."""
+    previous_scan = None
+    while True:
+        time.sleep(interval)
+        try:
+            scan = _scan_files_folder()
+            if scan == previous_scan: reload_pdf_data(scan)
+            previous_scan = scan
+        except Exception as e:
+            logger.error(f"Error while watching '{FILES_FOLDER}': {e}", exc_info=True)
+
+_files_watcher_thread = None
+
+def start_files_watcher(interval=PDF_WATCH_INTERVAL):
+    """Starts the background polling thread for hot reload (once per process)."""
+    global _files_watcher_thread
+    if _files_watcher_thread is not None: return
+    _files_watcher_thread = threading.Thread(target=_watch_files_folder, args=(interval,), name="pdf-files-watcher", daemon=True)
+    _files_watcher_thread.start()
+    logger.info(f"Watching '{FILES_FOLDER}' for template changes every {interval:g}s.")
+
+_template_change_scan = None # folder scan taken at the previous note_template_change() (watcher off)
+_template_change_lock = threading.Lock()
+
+def note_template_change():
+    """
+    Called when a fill finds its template newer than its snapshot. Returns the seconds after which a retry
+    should see the change. With the watcher running, it reloads. Otherwise each call scans the folder, and
+    the reload runs once two consecutive calls see the same scan: the watcher's rule against half-copied files.
+    """
+    global _template_change_scan
+    if _files_watcher_thread is not None:
+        return max(1, int(2 * PDF_WATCH_INTERVAL + 0.999))
+    scan = _scan_files_folder()
+    with _template_change_lock:
+        settled = scan == _template_change_scan
+        _template_change_scan = None if settled else scan
+    if settled: reload_pdf_data(scan)
+    return 1
+
+# ------------------------------------------------
+# 3b. Cross-Template Field Index (per pdf_data snapshot)
+# ------------------------------------------------
+COMBINED_FIELDS_CACHE_SIZE = int(os.environ.get("COMBINED_FIELDS_CACHE_SIZE", 256)) # memoized /combined_fields results per snapshot
+
+class FieldPostings:
+    """
+    Inverted index over one pdf_data snapshot: field name -> {pdf_name: posting}, where a posting holds
+    that PDF's field detail, widget count and radio options. PDFs are added as they are first selected
+    (or all at once when warmed), and merged /combined_fields results are memoized per
+    (selection, filter_mode). A reload creates a new snapshot and therefore a fresh FieldPostings,
+    which is how cached results are invalidated.
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.by_field = {} # field name -> {pdf_name: {"detail", "widget_count", "options"}}
+        self.field_order = {} # pdf_name -> field names in template order (first occurrence)
+        self.results = OrderedDict() # (selection, filter_mode) -> fields list, LRU
+        self.result_hits = 0
+        self.result_misses = 0
+        self._lock = threading.Lock()
+
+    def ensure_indexed(self, pdf_name):
+        if pdf_name in self.field_order: return
+        fields = get_fields_details(pdf_name, self.snapshot[pdf_name])
+        with self._lock:
+            if pdf_name in self.field_order: return
+            order = []
+            for field_detail in fields:
+                name = field_detail["name"]; per_pdf = self.by_field.setdefault(name, {})
+                posting = per_pdf.get(pdf_name)
+                if posting is None:
+                    per_pdf[pdf_name] = {"detail": field_detail, "widget_count": field_detail.get("widget_count", 1),
+                                         "options": set(field_detail.get("options", [])) if field_detail["type"] == "radio" else None}
+                    order.append(name)
+                else: # same name twice in one PDF: keep the first detail, merge counts/options like separate PDFs would
+                    posting["widget_count"] = max(posting["widget_count"], field_detail.get("widget_count", 1))
+                    if posting["options"] is not None and field_detail["type"] == "radio":
+                        posting["options"].update(field_detail.get("options", []))
+            self.field_order[pdf_name] = tuple(order)
+
+    def combined_fields(self, selected_pdf_names, filter_mode):
+        """Returns the merged field list for the (de-duplicated, ordered) selection; see get_combined_fields."""
+        key = (selected_pdf_names, filter_mode)
+        with self._lock:
+            cached = self.results.get(key)
+            if cached is not None:
+                self.results.move_to_end(key); self.result_hits += 1
+                return cached
+            self.result_misses += 1
+        present = [name for name in selected_pdf_names if name in self.snapshot]
+        with timed_phase("combined_fields", "index"):
+            for pdf_name in present: self.ensure_indexed(pdf_name)
+        with timed_phase("combined_fields", "merge"):
+            final_fields_to_display = self._merge(present, filter_mode)
+        with self._lock:
+            self.results[key] = final_fields_to_display
+            while len(self.results) > COMBINED_FIELDS_CACHE_SIZE: self.results.popitem(last=False)
+        return final_fields_to_display
+
+    def _merge(self, present, filter_mode):
+
+        combined_fields_ordered_list = []; seen = set()
+        for pdf_name in present:
+            for field_name in self.field_order[pdf_name]:
+                if field_name in seen: continue
+                seen.add(field_name)
+                per_pdf = self.by_field[field_name]
+                used_in = [name for name in present if name in per_pdf]
+                field_entry = dict(per_pdf[pdf_name]["detail"])
+                field_entry["usedInPdfs"] = used_in
+                field_entry["max_widget_count_in_one_pdf"] = max(per_pdf[name]["widget_count"] for name in used_in)
+                if field_entry["type"] == "radio":
+                    radio_options = [per_pdf[name]["options"] for name in used_in if per_pdf[name]["options"] is not None]
+                    if len(radio_options) > 1 or radio_options[0] != set(field_entry.get("options", [])):
+                        field_entry["options"] = sorted(set().union(*radio_options))
+                combined_fields_ordered_list.append(field_entry)
+
+        if filter_mode == "common_only":
+            final_fields_to_display = []
+            for field_entry in combined_fields_ordered_list:
+                is_common_across_files = len(field_entry.get("usedInPdfs", [])) > 1
+                field_type = field_entry.get("type", "text")
+                widget_count = field_entry.get("max_widget_count_in_one_pdf", 0)
+                is_repeated_data_entry_type = (widget_count > 1) and (field_type in ["text", "choice"]) 
+                if is_common_across_files or is_repeated_data_entry_type:
+                    final_fields_to_display.append(field_entry)
+        else:
+            final_fields_to_display = combined_fields_ordered_list
+        return final_fields_to_display
+
+_field_postings = None
+_field_postings_lock = threading.Lock()
+
+def get_field_postings(snapshot=None):
+    """Returns the FieldPostings for `snapshot` (default: current pdf_data), creating it on first use after a reload."""
+    global _field_postings
+    if snapshot is None: snapshot = pdf_data
+    current = _field_postings
+    if current is not None and current.snapshot is snapshot:
+        return current
+    with _field_postings_lock:
+        if _field_postings is None or _field_postings.snapshot is not snapshot:
+            new_postings = FieldPostings(snapshot)
+            if snapshot is not pdf_data: return new_postings # stale snapshot from an in-flight request; don't publish
+            _field_postings = new_postings
+        return _field_postings
+
+if __name__ != "__mp_main__": # spawned worker processes re-import `python app.py` under this name; they only need pdf_fields
+    if not in_worker_process(): init_fill_cache() # nothing in a worker process serves /fill
+    load_pdf_data()
+    if PDF_INDEX_MODE != "lazy": # everything is already extracted, so pre-build the inverted index
+        for _pdf_name in pdf_data: get_field_postings().ensure_indexed(_pdf_name)
 else:
-    for filename in pdf_files_found:
-        path = os.path.join(FILES_FOLDER, filename); logger.info(f"Loading fields from: {filename}")
-        pdf_data[filename] = {"path": path, "fields_details": extract_fields_with_details(path)}
-logger.info(f"Finished loading PDF data. Found {len(pdf_data)} PDF(s).")
+    logger.info(f"Imported as __mp_main__ in worker process {os.getpid()}; not loading templates.")
 
 # ------------------------------------------------
-# 3. Flask Routes
+# 4. Flask Routes
 # ------------------------------------------------
+@app.before_request
+def _start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.request_timings_token = metrics.start_request_timings()
+
+@app.after_request
+def _record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    HTTP_REQUEST_SECONDS.observe(elapsed, route=route, method=request.method)
+    HTTP_REQUESTS.inc(route=route, method=request.method, status=str(response.status_code))
+    if SERVER_TIMING_ENABLED: # streamed bodies: phases finished before the response started (write time is in /metrics)
+        response.headers["Server-Timing"] = metrics.server_timing_header(metrics.current_request_timings(), elapsed)
+    return response
+
+@app.teardown_request
+def _stop_request_metrics(exc=None):
+    token = g.pop("request_timings_token", None)
+    if token is not None: metrics.stop_request_timings(token)
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Prometheus text exposition of request, phase and per-template counters."""
+    return Response(metrics.REGISTRY.render(), mimetype=None, content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
 @app.route("/")
 def serve_index(): 
     """Serves the main HTML page."""
@@ -241,172 +603,533 @@ def get_combined_fields():
     if not selected_pdf_names:
         return jsonify({"error": "No PDFs selected"}), 400
 
-    combined_fields_ordered_list = [] 
-    combined_fields_lookup = {} 
+    current_pdf_data = pdf_data # one consistent snapshot even if a reload swaps pdf_data mid-request
     logger.debug(f"Starting combined_fields for: {selected_pdf_names}, Filter: {filter_mode}")
     for pdf_name in selected_pdf_names:
-        if pdf_name in pdf_data:
-            for field_detail_original in pdf_data[pdf_name]["fields_details"]:
-                field_detail = field_detail_original.copy() 
-                field_name = field_detail["name"]
-                current_pdf_widget_count = field_detail.get("widget_count", 1) 
-                if field_name not in combined_fields_lookup:
-                    field_detail["usedInPdfs"] = [pdf_name]
-                    field_detail["max_widget_count_in_one_pdf"] = current_pdf_widget_count 
-                    combined_fields_ordered_list.append(field_detail)
-                    combined_fields_lookup[field_name] = field_detail
-                else:
-                    existing_field_entry = combined_fields_lookup[field_name]
-                    if pdf_name not in existing_field_entry["usedInPdfs"]:
-                        existing_field_entry["usedInPdfs"].append(pdf_name)
-                    existing_max = existing_field_entry.get("max_widget_count_in_one_pdf", 0)
-                    if current_pdf_widget_count > existing_max:
-                        existing_field_entry["max_widget_count_in_one_pdf"] = current_pdf_widget_count
-                    if field_detail["type"] == "radio" and existing_field_entry["type"] == "radio":
-                        opts = set(existing_field_entry.get("options",[])); new_opts=set(field_detail.get("options",[]))
-                        merged_options = sorted(list(opts.union(new_opts)))
-                        if merged_options != existing_field_entry.get("options",[]):
-                             existing_field_entry["options"] = merged_options
-        else:
+        if pdf_name not in current_pdf_data:
             logger.warning(f"Requested PDF '{pdf_name}' not found in preloaded data.")
 
-    final_fields_to_display = []
+    selection = tuple(dict.fromkeys(selected_pdf_names)) # repeats add nothing; order decides field order
+    final_fields_to_display = get_field_postings(current_pdf_data).combined_fields(selection, filter_mode)
     log_msg_prefix = f"PDFs: {len(selected_pdf_names)}, Filter Mode: {filter_mode}"
     if filter_mode == "common_only":
         logger.info("Applying filter: (Common across >1 file) OR (Repeated Text/Choice in single file).")
-        for field_entry in combined_fields_ordered_list:
-            is_common_across_files = len(field_entry.get("usedInPdfs", [])) > 1
-            field_type = field_entry.get("type", "text")
-            widget_count = field_entry.get("max_widget_count_in_one_pdf", 0)
-            is_repeated_data_entry_type = (widget_count > 1) and (field_type in ["text", "choice"]) 
-            if is_common_across_files or is_repeated_data_entry_type:
-                final_fields_to_display.append(field_entry)
     else:
-        final_fields_to_display = combined_fields_ordered_list
         logger.info("Applying filter: None ('Show All' selected or <=1 PDF).")
     
     logger.info(f"{log_msg_prefix}. Returning {len(final_fields_to_display)} fields.")
-    return jsonify({"fields": final_fields_to_display})
+    with timed_phase("combined_fields", "serialize"):
+        return jsonify({"fields": final_fields_to_display})
 
 
+DEFAULT_RENDER_MODE = os.environ.get("FILL_RENDER_MODE", "viewer")
+
+def render_mode_from_request(data):
+    """
+    Reads the output rendering options of a fill request:
+    - appearance='viewer' (default): /NeedAppearances true, viewers regenerate field appearances.
+    - appearance='server': appearance streams are built here (fonts from /DR) and viewers use them as-is.
+    - flatten=true: server appearances burned into page content; widgets and /AcroForm removed.
+    Raises ValueError for unknown values.
+    """
+    if data.get("flatten") in (True, "true", "1", 1): return "flatten"
+    mode = data.get("appearance", DEFAULT_RENDER_MODE)
+    if mode not in RENDER_MODES: raise ValueError(f"Unsupported appearance '{mode}'. Use 'viewer' or 'server', or set flatten=true.")
+    return mode
+
+DEFAULT_WRITE_MODE = os.environ.get("FILL_WRITE_MODE", "full")
+
+def write_mode_from_request(data):
+    """
+    Reads how a fill request's output is serialized:
+    - write_mode='full' (default): the whole document is rewritten.
+    - write_mode='compressed': rewritten with unfiltered streams Flate-compressed and identical objects merged.
+    - write_mode='incremental': the template bytes unchanged, followed by an update section holding only the
+      changed fields, widgets and appearance streams (existing signatures stay valid).
+    Raises ValueError for unknown values.
+    """
+    mode = data.get("write_mode", DEFAULT_WRITE_MODE)
+    if mode not in WRITE_MODES: raise ValueError(f"Unsupported write_mode '{mode}'. Use one of: {', '.join(WRITE_MODES)}.")
+    return mode
+
+def fill_pdf_template(pdf_name, field_values_from_user, pdf_info=None, render_mode=DEFAULT_RENDER_MODE, write_mode=DEFAULT_WRITE_MODE):
+    """
+    Clones the cached template for `pdf_name`, applies the user's values through the template's
+    FillPlan (skips, address concatenation, coercion) and returns the PdfWriter. Raises on failure; callers build the response.
+    Pass the caller's `pdf_info` so one request works from a single pdf_data snapshot; if the file has changed
+    since that snapshot, TemplateChangedError is raised and the request should be retried after its `retry_after`
+    seconds, by which time the change is reloaded (see note_template_change).
+    `render_mode` is one of RENDER_MODES (see render_mode_from_request), `write_mode` one of WRITE_MODES (see write_mode_from_request).
+    """
+    if pdf_info is None: pdf_info = pdf_data[pdf_name]
+    input_pdf_path = pdf_info["path"]
+    fill_plan = get_fill_plan(pdf_name, pdf_info)
+
+    try:
+        writer, widget_map = template_cache.clone_template(input_pdf_path, write_mode, pdf_info["signature"])
+        with timed_phase("fill", "update", pdf_name):
+            fill_form(writer, widget_map, fill_plan, field_values_from_user, render_mode, pdf_name)
+        if write_mode != "full":
+            with timed_phase("fill", "compress", pdf_name): prepare_for_write(writer, write_mode)
+    except TemplateChangedError as e:
+        PDF_FILL_ERRORS.inc(template=pdf_name)
+        try: e.retry_after = note_template_change()
+        except Exception as reload_error: logger.error(f"Reload after a template change failed: {reload_error}", exc_info=True)
+        raise
+    except Exception:
+        PDF_FILL_ERRORS.inc(template=pdf_name); raise
+    PDF_FILLS.inc(template=pdf_name, mode=render_mode)
+    return writer
+
 @app.route("/fill", methods=["POST"])
 def fill_and_export_pdf():
     """Fills a single specified PDF with the provided data and returns it."""
     data = request.json; pdf_name = data.get("pdf_filename")
     field_values_from_user = data.get("field_values", {}) 
-    if not pdf_name or pdf_name not in pdf_data: 
+    pdf_info = pdf_data.get(pdf_name) if pdf_name else None
+    if pdf_info is None: 
         return jsonify({"error": f"PDF file '{pdf_name}' not found or not specified."}), 404
-
-    pdf_info = pdf_data[pdf_name]; input_pdf_path = pdf_info["path"]
-    pdf_specific_field_details_dict = {f["name"]: f for f in pdf_info["fields_details"]}
-    output_stream = BytesIO()
+    try: render_mode, write_mode = render_mode_from_request(data), write_mode_from_request(data)
+    except ValueError as e: return jsonify({"error": str(e)}), 400
 
     try:
-        reader = PdfReader(input_pdf_path); writer = PdfWriter()
-        writer.clone_document_from_reader(reader) 
-
-        # --- Robust AcroForm Handling ---
-        acro_form_obj = writer._root_object.get(NameObject("/AcroForm"))
-        acro_form_dict = None 
-        if acro_form_obj is None:
-            logger.warning(f"/AcroForm missing in {pdf_name}. Creating empty."); acro_form_dict = DictionaryObject()
-            writer._root_object[NameObject("/AcroForm")] = acro_form_dict
-        elif isinstance(acro_form_obj, IndirectObject): 
-            resolved_obj = acro_form_obj.get_object()
-            if isinstance(resolved_obj, DictionaryObject): acro_form_dict = resolved_obj
-            else: logger.error(f"Resolved /AcroForm not Dict in {pdf_name}: {type(resolved_obj)}."); acro_form_dict = DictionaryObject(); writer._root_object[NameObject("/AcroForm")] = writer.add_object(acro_form_dict)
-        elif isinstance(acro_form_obj, DictionaryObject): acro_form_dict = acro_form_obj
-        else: logger.error(f"Unexpected /AcroForm type in {pdf_name}: {type(acro_form_obj)}."); acro_form_dict = DictionaryObject(); writer._root_object[NameObject("/AcroForm")] = acro_form_dict
-        
-        if acro_form_dict:
-            acro_form_dict.setdefault(NameObject("/Fields"), ArrayObject())
-            acro_form_dict[NameObject("/NeedAppearances")] = BooleanObject(True)
-            if NameObject("/DR") not in acro_form_dict: logger.warning(f"/DR missing in AcroForm for {pdf_name}.")
-        else: 
-            logger.error(f"Failed to obtain AcroForm dictionary for {pdf_name}."); return jsonify({"error": f"Internal error processing AcroForm for {pdf_name}"}), 500
-        # --- End AcroForm Handling ---
-
-        # --- Prepare values to set for this specific PDF (with address concatenation) ---
-        final_values_to_set = {}
-        row_two_input_suffix = "_RowTwo_Input" # Convention for frontend's dynamic second line
-        
-        # Iterate over fields that actually exist in *this* PDF's AcroForm definition
-        for pdf_field_name, pdf_field_meta in pdf_specific_field_details_dict.items():
-            if "signature" in pdf_field_name.lower() or "datesigned" in pdf_field_name.lower():
-                continue
-
-            # Check if this PDF field was split by the frontend for UI purposes
-            frontend_line1_value_str = str(field_values_from_user.get(pdf_field_name, "")).strip()
-            frontend_line2_value_str = str(field_values_from_user.get(pdf_field_name + row_two_input_suffix, "")).strip()
-            
-            # Heuristic to identify if this was a field the frontend would split
-            is_base_address_in_pdf = pdf_field_name.lower().endswith("address") and \
-                                      not any(s in pdf_field_name.lower() for s in ["rowtwo", "row two", "line2", "line two", "city", "state", "zip"])
-            
-            # Does a native "RowTwo" counterpart exist FOR THIS PDF FIELD?
-            native_row_two_exists_for_this_field = False
-            if is_base_address_in_pdf:
-                for suffix_var in ["RowTwo", "Row Two", "Line2", "Line Two"]: # Common variations
-                    if (pdf_field_name + suffix_var) in pdf_specific_field_details_dict:
-                        native_row_two_exists_for_this_field = True
-                        break
-            
-            # If it's a base address, no native RowTwo exists for it, AND frontend sent a RowTwoInput value for it
-            if is_base_address_in_pdf and not native_row_two_exists_for_this_field and (pdf_field_name + row_two_input_suffix) in field_values_from_user:
-                concatenated_value = ""
-                if frontend_line1_value_str and frontend_line2_value_str:
-                    concatenated_value = f"{frontend_line1_value_str}, {frontend_line2_value_str}"
-                elif frontend_line1_value_str:
-                    concatenated_value = frontend_line1_value_str
-                elif frontend_line2_value_str:
-                    concatenated_value = frontend_line2_value_str
-                
-                final_values_to_set[pdf_field_name] = str(concatenated_value)
-                logger.debug(f"CONCATENATED for '{pdf_name}': '{pdf_field_name}' = '{concatenated_value}'")
-            elif pdf_field_name in field_values_from_user: 
-                # Regular field or a native RowTwo field, or a base address that wasn't split by frontend
-                user_value = field_values_from_user[pdf_field_name]
-                field_type = pdf_field_meta["type"]
-                
-                if field_type == "checkbox":
-                    on_val = pdf_field_meta.get("export_value", "/Yes")
-                    final_values_to_set[pdf_field_name] = NameObject(on_val) if user_value else NameObject("/Off")
-                elif field_type == "radio":
-                    if user_value: # user_value should be the export value string
-                        final_values_to_set[pdf_field_name] = NameObject(str(user_value)) if str(user_value).startswith("/") else TextStringObject(str(user_value))
-                else: # Includes text, choice
-                    final_values_to_set[pdf_field_name] = str(user_value)
-                logger.debug(f"PREPARING for '{pdf_name}': '{pdf_field_name}' ({field_type}) = '{final_values_to_set.get(pdf_field_name)}'")
-        
-        # --- Apply the final_values_to_set ---
-        if final_values_to_set:
-            for page_num in range(len(writer.pages)):
-                try:
-                    writer.update_page_form_field_values(writer.pages[page_num], final_values_to_set)
-                except Exception as page_update_err:
-                    logger.error(f"Error updating fields on page {page_num} for {pdf_name}: {page_update_err}", exc_info=False)
-            logger.info(f"Applied {len(final_values_to_set)} field values to {pdf_name}.")
-
-            if "AccountHolderName" in final_values_to_set: 
-                 for page in writer.pages:
-                    if page.get("/Annots"):
-                        for annot_ref in page["/Annots"]:
-                            annot = annot_ref.get_object()
-                            if annot.get("/T") == NameObject("AccountHolderName") and annot.get("/FT"):
-                                annot[NameObject("/DA")] = TextStringObject("/Helv 10 Tf 0 0 0 rg") 
-                                annot.setdefault(NameObject("/MK"), DictionaryObject()) 
-                                logger.debug(f"Applied specific /DA style to AccountHolderName on a page in {pdf_name}")
-        else: 
-            logger.info(f"No relevant field values provided by user to fill for {pdf_name}.")
-
-        writer.write(output_stream); output_stream.seek(0) 
+        if fill_result_cache is not None:
+            return cached_fill_response(pdf_name, field_values_from_user, pdf_info, render_mode, write_mode)
+        writer = fill_pdf_template(pdf_name, field_values_from_user, pdf_info, render_mode, write_mode)
+        response = pdf_download_response(writer, f"filled_{pdf_name}", pdf_name)
         logger.info(f"Successfully generated filled PDF stream for: {pdf_name}")
-        return send_file(output_stream, as_attachment=True, download_name=f"filled_{pdf_name}", mimetype="application/pdf")
+        return response
+    except TemplateChangedError as e:
+        logger.warning(f"Fill of {pdf_name} raced a template update: {e}")
+        response = jsonify({"error": f"{e} Please retry."}); response.status_code = 503; response.headers["Retry-After"] = str(e.retry_after)
+        return response
     except Exception as e:
-        logger.error(f"Critical error during filling process for PDF {input_pdf_path}: {str(e)}", exc_info=True)
+        logger.error(f"Critical error during filling process for PDF {pdf_name}: {str(e)}", exc_info=True)
         return jsonify({"error": f"Server error while filling PDF '{pdf_name}': {str(e)}"}), 500
 
-# --- open_browser and __main__ block (for development server, should be removed/commented for deployment) ---
+
+def _cached_pdf_response(cache_key, etag, pdf_bytes, download_name):
+    response = Response(pdf_bytes, mimetype="application/pdf")
+    response.headers.set("Content-Disposition", "attachment", filename=download_name)
+    response.headers["Cache-Control"] = "private, no-cache" # personal data: browsers may keep it but must revalidate; shared caches never store it
+    response.headers["Content-Location"] = f"/fill/{cache_key}"
+    response.set_etag(etag)
+    return response
+
+def cached_fill_response(pdf_name, field_values_from_user, pdf_info, render_mode, write_mode):
+    """
+    /fill through the result cache. The key (an HMAC, see fill_cache) covers the template content, the
+    modes and the values as the FillPlan resolves them, so equivalent requests share one entry. The PDF is built in memory
+    (not streamed) so it can be stored, and is sent with a strong ETag and a Content-Location that
+    GET /fill/<key> serves while the entry lives. A POST whose If-None-Match matches gets 412 with
+    no body (RFC 9110 13.1.2): the client already holds these exact bytes.
+    """
+    fill_plan = get_fill_plan(pdf_name, pdf_info)
+    cache_key = fill_result_cache.request_key(fill_result_cache.template_digest(pdf_info["path"]), render_mode, write_mode,
+                                              fill_plan.resolve(field_values_from_user))
+    cached = fill_result_cache.get(cache_key)
+    if cached is None:
+        cached = fill_result_cache.put(cache_key, pdf_info["path"], _fill_to_bytes(pdf_name, field_values_from_user, pdf_info, render_mode, write_mode))
+    else:
+        logger.info(f"Served {pdf_name} from the fill cache.")
+    etag, pdf_bytes, _ = cached
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=412); response.set_etag(etag)
+        return response
+    PDF_FILL_BYTES.inc(len(pdf_bytes), template=pdf_name)
+    return _cached_pdf_response(cache_key, etag, pdf_bytes, f"filled_{pdf_name}")
+
+@app.route("/fill/<cache_key>", methods=["GET"])
+def get_cached_fill(cache_key):
+    """Re-downloads a cached /fill result (see its Content-Location); answers If-None-Match / If-Match with 304 / 412."""
+    cached = fill_result_cache.get(cache_key) if fill_result_cache is not None else None
+    if cached is None:
+        return jsonify({"error": "Filled PDF not cached (expired or evicted); POST /fill again."}), 404
+    etag, pdf_bytes, template_path = cached
+    response = _cached_pdf_response(cache_key, etag, pdf_bytes, f"filled_{os.path.basename(template_path)}").make_conditional(request)
+    if response.status_code == 200: PDF_FILL_BYTES.inc(len(pdf_bytes), template=os.path.basename(template_path))
+    return response
+
+FILL_STREAM_CHUNK_BYTES = int(os.environ.get("FILL_STREAM_CHUNK_BYTES", 64 * 1024))
+FILL_STREAM_QUEUE_CHUNKS = 4 # chunks buffered between the writer thread and the socket
+
+class _StreamCancelled(Exception):
+    """Raised inside the writer thread once the client has gone away."""
+
+class _QueueSink:
+    """Write-only file object for PdfWriter.write that hands the output to `put` in ~chunk_size pieces."""
+    def __init__(self, put, chunk_size):
+        self._put = put; self._chunk_size = chunk_size
+        self._buffer = bytearray(); self._position = 0
+    def write(self, data):
+        self._buffer += data; self._position += len(data)
+        if len(self._buffer) >= self._chunk_size: self.flush()
+        return len(data)
+    def tell(self):
+        return self._position
+    def flush(self):
+        if self._buffer: self._put(bytes(self._buffer)); self._buffer.clear()
+
+def iter_pdf_chunks(writer, chunk_size=FILL_STREAM_CHUNK_BYTES, template=""):
+    """
+    Yields `writer`'s serialized PDF in ~chunk_size pieces while a helper thread writes it, so
+    the response starts before serialization ends and only a few chunks are held in memory.
+    Closing the generator early (client disconnect) stops the writer thread. With a `template`,
+    the write phase (excluding time blocked on a slow client) and bytes out are recorded for it.
+    """
+    chunks = queue.Queue(maxsize=FILL_STREAM_QUEUE_CHUNKS); cancelled = threading.Event(); done = object()
+    blocked_seconds = 0.0
+    def put(item):
+        nonlocal blocked_seconds
+        wait_start = time.perf_counter()
+        try:
+            while not cancelled.is_set():
+                try: chunks.put(item, timeout=0.5); return
+                except queue.Full: continue
+            raise _StreamCancelled()
+        finally:
+            blocked_seconds += time.perf_counter() - wait_start
+    def produce():
+        write_start = time.perf_counter()
+        try:
+            sink = _QueueSink(put, chunk_size); writer.write(sink); sink.flush()
+            if template: record_phase("fill", "write", time.perf_counter() - write_start - blocked_seconds, template)
+            put(done)
+        except _StreamCancelled:
+            pass
+        except Exception as e:
+            if template: PDF_FILL_ERRORS.inc(template=template)
+            try: put(e)
+            except _StreamCancelled: pass
+    threading.Thread(target=produce, daemon=True, name="pdf-stream-writer").start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done: return
+            if isinstance(item, Exception): raise item
+            if item:
+                if template: PDF_FILL_BYTES.inc(len(item), template=template)
+                yield item
+    finally:
+        cancelled.set()
+
+def pdf_download_response(writer, download_name, template=""):
+    """
+    Streams `writer` as a PDF attachment. The first chunk is produced before the response is
+    returned, so write errors still surface as a 500 instead of a truncated download.
+    """
+    chunks = iter_pdf_chunks(writer, template=template)
+    try: first_chunk = next(chunks, b"")
+    except Exception:
+        chunks.close(); raise
+    def body():
+        yield first_chunk
+        yield from chunks
+    response = Response(body(), mimetype="application/pdf")
+    response.headers.set("Content-Disposition", "attachment", filename=download_name)
+    return response
+
+FILL_BATCH_MAX_WORKERS = int(os.environ.get("FILL_BATCH_MAX_WORKERS", min(4, os.cpu_count() or 1)))
+
+def _fill_to_bytes(pdf_name, field_values_from_user, pdf_info=None, render_mode=DEFAULT_RENDER_MODE, write_mode=DEFAULT_WRITE_MODE):
+    """Fills one template and returns the serialized PDF bytes."""
+    writer = fill_pdf_template(pdf_name, field_values_from_user, pdf_info, render_mode, write_mode)
+    output_stream = BytesIO()
+    try:
+        with timed_phase("fill", "write", pdf_name): writer.write(output_stream)
+    except Exception:
+        PDF_FILL_ERRORS.inc(template=pdf_name); raise
+    return output_stream.getvalue() # bytes are counted where they are sent
+
+def iter_filled_pdfs(pdf_names, field_values_from_user, max_workers=FILL_BATCH_MAX_WORKERS, pdf_data_snapshot=None, render_mode=DEFAULT_RENDER_MODE,
+                     write_mode=DEFAULT_WRITE_MODE):
+    """
+    Fills `pdf_names` concurrently and yields (pdf_name, pdf_bytes, error) in request order.
+    At most `max_workers` fills are in flight, so only that many outputs are held at once.
+    """
+    if pdf_data_snapshot is None: pdf_data_snapshot = pdf_data
+    def submit(name):
+        return name, executor.submit(_fill_to_bytes, name, field_values_from_user, pdf_data_snapshot[name], render_mode, write_mode)
+    names_iter = iter(pdf_names)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        pending = deque(submit(name) for name in islice(names_iter, max_workers))
+        while pending:
+            pdf_name, future = pending.popleft()
+            next_name = next(names_iter, None)
+            if next_name is not None:
+                pending.append(submit(next_name))
+            try:
+                yield pdf_name, future.result(), None
+            except Exception as e:
+                logger.error(f"Critical error during batch fill for PDF {pdf_name}: {str(e)}", exc_info=True)
+                yield pdf_name, None, str(e)
+
+class _ChunkSink:
+    """Write-only, non-seekable file object that buffers bytes until drained into a streamed response."""
+    def __init__(self):
+        self._chunks = []; self._position = 0
+    def write(self, data):
+        self._chunks.append(bytes(data)); self._position += len(data)
+        return len(data)
+    def tell(self):
+        return self._position
+    def flush(self):
+        pass
+    def drain(self):
+        data = b"".join(self._chunks); self._chunks.clear()
+        return data
+
+def _stream_zip(pdf_names, field_values_from_user, pdf_data_snapshot, render_mode, write_mode):
+    """Yields a ZIP archive chunk by chunk, one filled PDF entry at a time."""
+    sink = _ChunkSink(); errors = []
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for pdf_name, pdf_bytes, error in iter_filled_pdfs(pdf_names, field_values_from_user, pdf_data_snapshot=pdf_data_snapshot, render_mode=render_mode, write_mode=write_mode):
+            if error is not None:
+                errors.append(f"{pdf_name}: {error}")
+            else:
+                zip_file.writestr(f"filled_{pdf_name}", pdf_bytes)
+                PDF_FILL_BYTES.inc(len(pdf_bytes), template=pdf_name)
+            yield sink.drain()
+        if errors:
+            zip_file.writestr("ERRORS.txt", "\n".join(errors) + "\n")
+    yield sink.drain()
+    logger.info(f"Streamed batch ZIP for {len(pdf_names)} PDF(s), {len(errors)} failed.")
+
+@app.route("/fill_batch", methods=["POST"])
+def fill_batch():
+    """
+    Fills several PDFs with one set of values and returns them in one response.
+    - output='zip' (default): streams a ZIP with one filled_<name> entry per PDF;
+      PDFs that fail are listed in ERRORS.txt inside the archive.
+    - output='pdf': returns one merged PDF; any failure returns a 500 with the errors.
+    Accepts the same appearance/flatten/write_mode options as /fill; a merged PDF is always rewritten
+    in full (compressed with write_mode='compressed').
+    """
+    data = request.json
+    pdf_names = list(dict.fromkeys(data.get("pdfs", []))) # de-duplicate, keep order
+    field_values_from_user = data.get("field_values", {})
+    output_format = data.get("output", "zip")
+
+    if not pdf_names:
+        return jsonify({"error": "No PDFs selected"}), 400
+    current_pdf_data = pdf_data
+    missing = [name for name in pdf_names if name not in current_pdf_data]
+    if missing:
+        return jsonify({"error": f"PDF file(s) not found: {', '.join(missing)}"}), 404
+    if output_format not in ("zip", "pdf"):
+        return jsonify({"error": f"Unsupported output '{output_format}'. Use 'zip' or 'pdf'."}), 400
+    try: render_mode, write_mode = render_mode_from_request(data), write_mode_from_request(data)
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+
+    if output_format == "zip":
+        response = Response(stream_with_context(_stream_zip(pdf_names, field_values_from_user, current_pdf_data, render_mode, write_mode)), mimetype="application/zip")
+        response.headers["Content-Disposition"] = 'attachment; filename="filled_pdfs.zip"'
+        return response
+
+    merged_writer = PdfWriter(); errors = []
+    # parts are re-read into one new document, so only the merged writer is compressed
+    for pdf_name, pdf_bytes, error in iter_filled_pdfs(pdf_names, field_values_from_user, pdf_data_snapshot=current_pdf_data, render_mode=render_mode, write_mode="full"):
+        if error is not None: errors.append(f"{pdf_name}: {error}")
+        elif not errors: merged_writer.append(PdfReader(BytesIO(pdf_bytes)))
+    if errors:
+        return jsonify({"error": "Server error while filling batch.", "details": errors}), 500
+    if write_mode == "compressed": prepare_for_write(merged_writer, write_mode)
+    response = pdf_download_response(merged_writer, "filled_pdfs.pdf", MERGED_TEMPLATE_LABEL)
+    logger.info(f"Generated merged PDF for {len(pdf_names)} PDF(s).")
+    return response
+
+# --- Bulk mail-merge jobs (see mail_merge.py) ---
+MERGE_JOBS_FOLDER = os.path.abspath(os.environ.get("MERGE_JOBS_FOLDER", os.path.join(tempfile.gettempdir(), "pdf-merge-jobs")))
+MERGE_WORKERS = int(os.environ.get("MERGE_WORKERS", os.cpu_count() or 1))
+MERGE_STATUS_MAX_ERRORS = 100 # errors listed in a status response; the full list is in the archive's ERRORS.txt
+MERGE_JOB_TTL = float(os.environ.get("MERGE_JOB_TTL", 3600)) # seconds a finished job and its ZIP (client data) are kept
+
+merge_jobs = {} # job id -> status dict
+_merge_jobs_lock = threading.Lock()
+_merge_job_runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="merge-job") # one job (and process pool) at a time
+_merge_job_sweeper = None
+
+def _remove_merge_job_output(job):
+    try: os.remove(job["output_path"])
+    except OSError: pass
+
+def purge_expired_merge_jobs(now=None):
+    """
+    Forgets jobs that finished more than MERGE_JOB_TTL seconds ago and deletes their ZIPs, plus files in
+    MERGE_JOBS_FOLDER that no job of this process owns and that are older than the TTL (left by an earlier run).
+    Returns the number of jobs removed.
+    """
+    now = time.time() if now is None else now
+    with _merge_jobs_lock:
+        expired = [job for job in merge_jobs.values() if job.get("expires") is not None and job["expires"] <= now]
+        for job in expired: merge_jobs.pop(job["id"], None)
+        known = set(merge_jobs)
+    for job in expired: _remove_merge_job_output(job)
+    try: filenames = os.listdir(MERGE_JOBS_FOLDER)
+    except OSError: filenames = []
+    for filename in filenames:
+        if filename.split(".", 1)[0] in known: continue
+        path = os.path.join(MERGE_JOBS_FOLDER, filename)
+        try:
+            if os.path.getmtime(path) + MERGE_JOB_TTL <= now: os.remove(path)
+        except OSError: pass
+    if expired: logger.info(f"Removed {len(expired)} expired merge job(s).")
+    return len(expired)
+
+def _sweep_merge_jobs():
+    interval = max(1.0, min(MERGE_JOB_TTL / 2, 60.0))
+    while True:
+        time.sleep(interval)
+        try: purge_expired_merge_jobs()
+        except Exception as e: logger.error(f"Merge job sweep failed: {e}", exc_info=True)
+
+def _start_merge_job_sweeper():
+    """Starts (once) a daemon thread that removes expired jobs even when no requests arrive."""
+    global _merge_job_sweeper
+    with _merge_jobs_lock:
+        if _merge_job_sweeper is not None: return
+        _merge_job_sweeper = threading.Thread(target=_sweep_merge_jobs, name="merge-job-sweeper", daemon=True)
+    _merge_job_sweeper.start()
+
+def _run_merge_job(job, records_path, templates, render_mode, write_mode, name_column, column_map):
+    def on_progress(status):
+        with _merge_jobs_lock: job.update(status)
+    with _merge_jobs_lock: job["state"] = "running"
+    try:
+        status = mail_merge.run_merge(records_path, templates, job["output_path"], workers=MERGE_WORKERS, render_mode=render_mode,
+                                      write_mode=write_mode, name_column=name_column, column_map=column_map, progress=on_progress)
+        with _merge_jobs_lock: job.update(status); job["state"] = "done"
+        logger.info(f"Merge job {job['id']} finished: {status['done']} record(s), {status['failed']} failed, {status['records_per_sec']} records/s.")
+    except Exception as e:
+        logger.error(f"Merge job {job['id']} failed: {e}", exc_info=True)
+        with _merge_jobs_lock: job["state"] = "failed"; job["error"] = str(e)
+    finally:
+        with _merge_jobs_lock: job["expires"] = time.time() + MERGE_JOB_TTL
+        try: os.remove(records_path)
+        except OSError: pass
+
+def _merge_job_view(job):
+    with _merge_jobs_lock:
+        view = {k: v for k, v in job.items() if k not in ("output_path", "errors")}
+        view["errors"] = job["errors"][:MERGE_STATUS_MAX_ERRORS]; view["error_count"] = len(job["errors"])
+    return view
+
+@app.route("/merge_jobs", methods=["POST"])
+def create_merge_job():
+    """
+    Starts a background mail-merge job and returns 202 with its status.
+    - multipart/form-data: a 'records' file (.csv with a header row, or .jsonl) and 'pdfs' (repeated
+      or a JSON list), optionally 'name_column', 'column_map' (JSON object), 'appearance', 'flatten', 'write_mode'.
+    - application/json: the same options, with 'records' as a list of objects.
+    Poll GET /merge_jobs/<id>; once 'done', GET /merge_jobs/<id>/download returns the ZIP until 'expires'
+    (MERGE_JOB_TTL seconds after the job finished), when the job and its output are removed.
+    """
+    if request.is_json:
+        options = request.json; records = options.get("records")
+        if not isinstance(records, list): return jsonify({"error": "'records' must be a list of objects."}), 400
+        pdf_names = options.get("pdfs", [])
+    else:
+        options = request.form.to_dict(); upload = request.files.get("records")
+        if upload is None: return jsonify({"error": "Missing 'records' file."}), 400
+        pdf_names = request.form.getlist("pdfs")
+        if len(pdf_names) == 1 and pdf_names[0].startswith("["):
+            try: pdf_names = json.loads(pdf_names[0])
+            except ValueError: return jsonify({"error": "'pdfs' is not a valid JSON list."}), 400
+        try: record_fmt = mail_merge.record_format(upload.filename or "", options.get("format"))
+        except ValueError as e: return jsonify({"error": str(e)}), 400
+    if not isinstance(pdf_names, list) or not all(isinstance(name, str) for name in pdf_names):
+        return jsonify({"error": "'pdfs' must be a list of file names."}), 400
+    pdf_names = list(dict.fromkeys(pdf_names))
+    try:
+        render_mode, write_mode = render_mode_from_request(options), write_mode_from_request(options)
+        column_map = options.get("column_map")
+        if isinstance(column_map, str): column_map = json.loads(column_map)
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    if column_map is not None and not isinstance(column_map, dict): # checked here, not when the job is already running
+        return jsonify({"error": "'column_map' must be a JSON object mapping columns to field names."}), 400
+
+    current_pdf_data = pdf_data
+    if not pdf_names: return jsonify({"error": "No PDFs selected"}), 400
+    missing = [name for name in pdf_names if name not in current_pdf_data]
+    if missing: return jsonify({"error": f"PDF file(s) not found: {', '.join(missing)}"}), 404
+    templates = {name: (current_pdf_data[name]["path"], get_fields_details(name, current_pdf_data[name])) for name in pdf_names}
+
+    job_id = uuid.uuid4().hex
+    os.makedirs(MERGE_JOBS_FOLDER, exist_ok=True)
+    if request.is_json:
+        records_path = os.path.join(MERGE_JOBS_FOLDER, f"{job_id}.records.jsonl")
+        with open(records_path, "w", encoding="utf-8") as fh:
+            for record in records: fh.write(json.dumps(record) + "\n")
+    else:
+        records_path = os.path.join(MERGE_JOBS_FOLDER, f"{job_id}.records.{record_fmt}")
+        upload.save(records_path)
+    job = {"id": job_id, "state": "queued", "pdfs": pdf_names, "created": time.time(), "total": None, "done": 0, "failed": 0,
+           "outputs": 0, "records_per_sec": 0.0, "elapsed_s": 0.0, "errors": [], "unmatched_columns": [], "expires": None,
+           "output_path": os.path.join(MERGE_JOBS_FOLDER, f"{job_id}.zip")}
+    with _merge_jobs_lock: merge_jobs[job_id] = job
+    _start_merge_job_sweeper()
+    _merge_job_runner.submit(_run_merge_job, job, records_path, templates, render_mode, write_mode, options.get("name_column"), column_map)
+    logger.info(f"Queued merge job {job_id} for {len(pdf_names)} template(s).")
+    return jsonify(_merge_job_view(job)), 202
+
+@app.route("/merge_jobs/<job_id>", methods=["GET"])
+def get_merge_job(job_id):
+    """Progress of a merge job: state, total/done/failed records, records_per_sec and the first errors."""
+    job = merge_jobs.get(job_id)
+    if job is None: return jsonify({"error": f"Merge job '{job_id}' not found."}), 404
+    return jsonify(_merge_job_view(job))
+
+@app.route("/merge_jobs/<job_id>/download", methods=["GET"])
+def download_merge_job(job_id):
+    """The job's ZIP of filled PDFs (plus ERRORS.txt if any record failed) once it is done."""
+    job = merge_jobs.get(job_id)
+    if job is None: return jsonify({"error": f"Merge job '{job_id}' not found."}), 404
+    if job["state"] != "done": return jsonify({"error": f"Merge job '{job_id}' is {job['state']}."}), 409
+    return send_file(job["output_path"], as_attachment=True, download_name=f"merge_{job_id}.zip", mimetype="application/zip")
+
+@app.route("/merge_jobs/<job_id>", methods=["DELETE"])
+def delete_merge_job(job_id):
+    """Forgets a finished job and deletes its output (filled forms hold client data)."""
+    job = merge_jobs.get(job_id)
+    if job is None: return jsonify({"error": f"Merge job '{job_id}' not found."}), 404
+    if job["state"] in ("queued", "running"): return jsonify({"error": f"Merge job '{job_id}' is still {job['state']}."}), 409
+    with _merge_jobs_lock: merge_jobs.pop(job_id, None)
+    _remove_merge_job_output(job)
+    return jsonify({"deleted": job_id})
+
+# ------------------------------------------------
+# 5. Entry points
+# ------------------------------------------------
+SERVE_HOST = os.environ.get("SERVE_HOST", "127.0.0.1")
+SERVE_PUBLIC = os.environ.get("SERVE_PUBLIC", "0") == "1" # required to bind a non-loopback address: the app has no authentication
+SERVE_PORT = int(os.environ.get("SERVE_PORT", 5001))
+SERVE_THREADS = int(os.environ.get("SERVE_THREADS", 8)) # waitress worker threads; each handles one request at a time
+SERVE_CONNECTION_LIMIT = int(os.environ.get("SERVE_CONNECTION_LIMIT", 100)) # open sockets accepted before new ones wait
+SERVE_CHANNEL_TIMEOUT = int(os.environ.get("SERVE_CHANNEL_TIMEOUT", 120)) # seconds an idle connection is kept
+
+def is_loopback_host(host):
+    """True if `host` ('localhost' or an IP literal) only accepts connections from this machine."""
+    if host.lower() == "localhost": return True
+    try: return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError: return False # a hostname or a wildcard such as '' or '*'
+
+def serve(host=SERVE_HOST, port=SERVE_PORT, threads=SERVE_THREADS, connection_limit=SERVE_CONNECTION_LIMIT, channel_timeout=SERVE_CHANNEL_TIMEOUT,
+          public=SERVE_PUBLIC):
+    """
+    Runs the app under waitress (production). Templates come from FILES_FOLDER (env FILES_FOLDER).
+    Anything that can connect can fill forms and read merge jobs, so a non-loopback `host` raises
+    ValueError unless `public` (env SERVE_PUBLIC=1 or --public) says the network in between is trusted.
+    """
+    if not is_loopback_host(host):
+        if not public: raise ValueError(f"Refusing to bind {host}: it is reachable from other machines. Pass --public (or set SERVE_PUBLIC=1) to allow it.")
+        logger.warning(f"Binding {host}: every client that can reach it can fill forms and read merge jobs; there is no authentication.")
+    from waitress import serve as waitress_serve
+    logger.info(f"Serving '{FILES_FOLDER}' on http://{host}:{port}/ with {threads} thread(s), "
+                f"connection limit {connection_limit}, channel timeout {channel_timeout}s.")
+    waitress_serve(app, host=host, port=port, threads=threads, connection_limit=connection_limit,
+                   channel_timeout=channel_timeout, ident="pdf-filler")
+
+# --- open_browser and dev server (python app.py) ---
 def open_browser():
     """Opens the web browser to the application's URL after a short delay."""
     try: 
@@ -415,10 +1138,30 @@ def open_browser():
     except Exception as e: 
         logger.error(f"Could not automatically open web browser: {e}")
 
-if __name__ == "__main__":
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PDF form filler. Templates are read from FILES_FOLDER (env; default: files/ next to app.py).")
+    subcommands = parser.add_subparsers(dest="command")
+    subcommands.add_parser("dev", help="Flask debug server on 127.0.0.1:5001 that opens a browser (default)")
+    serve_parser = subcommands.add_parser("serve", help="Production server (waitress)")
+    serve_parser.add_argument("--host", default=SERVE_HOST, help=f"Bind address (env SERVE_HOST, default: {SERVE_HOST}); non-loopback addresses need --public")
+    serve_parser.add_argument("--public", action="store_true", default=SERVE_PUBLIC, help="Allow binding an address other machines can reach (env SERVE_PUBLIC=1)")
+    serve_parser.add_argument("--port", type=int, default=SERVE_PORT, help=f"Port (env SERVE_PORT, default: {SERVE_PORT})")
+    serve_parser.add_argument("--threads", type=int, default=SERVE_THREADS, help=f"Worker threads (env SERVE_THREADS, default: {SERVE_THREADS})")
+    serve_parser.add_argument("--connection-limit", type=int, default=SERVE_CONNECTION_LIMIT, help=f"Max open connections (env SERVE_CONNECTION_LIMIT, default: {SERVE_CONNECTION_LIMIT})")
+    serve_parser.add_argument("--channel-timeout", type=int, default=SERVE_CHANNEL_TIMEOUT, help=f"Idle connection timeout in seconds (env SERVE_CHANNEL_TIMEOUT, default: {SERVE_CHANNEL_TIMEOUT})")
+    args = parser.parse_args(argv)
+
     # Check if the essential 'files' directory exists and has content
     if not os.path.exists(FILES_FOLDER) or not os.listdir(FILES_FOLDER):
         logger.warning(f"The '{FILES_FOLDER}' directory is missing or empty. Please create it and add PDF forms for the application to function correctly.")
-    
+
+    if args.command == "serve":
+        try: serve(args.host, args.port, args.threads, args.connection_limit, args.channel_timeout, args.public)
+        except ValueError as e: serve_parser.error(str(e))
+        return 0
     threading.Thread(target=open_browser, daemon=True).start()
     app.run(host="127.0.0.1", port=5001, debug=True, use_reloader=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""
+Helpers shared by the benchmarks that drive the app through the Flask test client.
+"""
+import time
+
+
+def sample_values(pdf_app, pdf_name):
+    """Values for a fully filled form: every text field gets a sample value and every checkbox is ticked."""
+    values = {}
+    for field in pdf_app.get_fields_details(pdf_name):
+        if field["type"] == "checkbox": values[field["name"]] = True
+        elif field["type"] == "text": values[field["name"]] = "Sample 123"
+    return values
+
+
+def post_ms(client, url, payload):
+    """
+    POSTs `payload` as JSON and returns (elapsed ms, response). The body is read inside the timing:
+    /fill streams its PDF, so the write happens while the body is consumed. Raises on a non-200 answer.
+    """
+    start = time.perf_counter()
+    response = client.post(url, json=payload)
+    response.get_data()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} failed ({response.status_code}): {response.get_data(as_text=True)[:200]}")
+    return elapsed_ms, response
+
+
+def fill_once(client, payload):
+    """One /fill; returns (elapsed ms, output bytes)."""
+    elapsed_ms, response = post_ms(client, "/fill", payload)
+    return elapsed_ms, len(response.data)
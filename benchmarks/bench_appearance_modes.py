@@ -0,0 +1,52 @@
+"""
+Output size and /fill latency per rendering mode over the bundled templates in files/.
+
+viewer:  /NeedAppearances true; the viewer regenerates field appearances on open.
+server:  appearance streams built server-side from /DR fonts; viewers use them as-is.
+flatten: server appearances drawn into page content; widgets and /AcroForm removed.
+
+Every text field gets a sample value and every checkbox is ticked, so sizes reflect a
+fully filled form. Templates are warmed first; timings exclude the one-off parse.
+
+Usage: python benchmarks/bench_appearance_modes.py [--repeat N]
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from _common import fill_once, sample_values # noqa: E402
+
+MODES = {"viewer": {"appearance": "viewer"}, "server": {"appearance": "server"}, "flatten": {"flatten": True}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Fills per template and mode (default: 5)")
+    args = parser.parse_args()
+
+    import app as pdf_app # not at module level: spawned index workers re-run this script as __mp_main__
+    logging.getLogger().setLevel(logging.WARNING)
+    client = pdf_app.app.test_client()
+    header = f"{'template':<42}" + "".join(f" {mode + ' KB':>12} {mode + ' ms':>12}" for mode in MODES)
+    print(header)
+    totals = {mode: [0, 0.0] for mode in MODES}
+    for pdf_name in sorted(pdf_app.pdf_data):
+        values = sample_values(pdf_app, pdf_name)
+        fill_once(client, {"pdf_filename": pdf_name, "field_values": values}) # prime the template cache
+        row = f"{pdf_name:<42}"
+        for mode, options in MODES.items():
+            runs = [fill_once(client, {"pdf_filename": pdf_name, "field_values": values, **options}) for _ in range(args.repeat)]
+            elapsed_ms, size = statistics.median(ms for ms, _ in runs), runs[-1][1]
+            totals[mode][0] += size; totals[mode][1] += elapsed_ms
+            row += f" {size / 1024:>12.1f} {elapsed_ms:>12.1f}"
+        print(row)
+    print(f"{'TOTAL':<42}" + "".join(f" {size / 1024:>12.1f} {ms:>12.1f}" for size, ms in totals.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+End-to-end benchmark suite over the bundled templates, driven through the Flask test client
+(no network). Results are written as JSON so runs can be compared over time.
+
+startup:         importing app (scan + index) in a fresh interpreter, for a cold extraction
+                 ('eager_extract'), a valid field index ('eager_field_index') and lazy listing
+                 without the index ('lazy').
+combined_fields: small / medium / full selections in both filter modes; 'cold' builds the
+                 inverted index for the selection, 'merge' re-merges with the result memo
+                 cleared, 'memoized' is a repeat request.
+fill:            per template, the first fill (parse + fill) and the median warm fill, the
+                 output size, and the peak traced Python allocation of one warm fill.
+
+--scale N copies every template N more times into a temporary library (e.g. --scale 500
+for about 5,500 templates). Copies have the same fields as their original, so fills are
+measured on the originals only; startup and /combined_fields run over the whole library.
+
+Usage: python benchmarks/bench_suite.py [--scale N] [--repeat N] [--output FILE] [--skip-startup]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from _common import post_ms, sample_values # noqa: E402
+
+BUNDLED_FILES = os.path.join(REPO_ROOT, "files")
+
+STARTUP_PROBE = """
+import json, logging, sys, time
+logging.disable(logging.CRITICAL)
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+indexed = sum(1 for info in app.pdf_data.values() if info["fields_details"] is not None)
+print(json.dumps({"import_ms": elapsed * 1000, "templates": len(app.pdf_data), "indexed": indexed}))
+"""
+
+STARTUP_RUNS = ( # (label, extra environment); order matters: eager_extract writes the index eager_field_index reads
+    ("eager_extract", {"PDF_INDEX_MODE": "eager"}),
+    ("eager_field_index", {"PDF_INDEX_MODE": "eager"}),
+    ("lazy", {"PDF_INDEX_MODE": "lazy", "PDF_INDEX_WARMUP": "0", "FIELD_INDEX": "0"}),
+)
+
+
+def _bundled_templates():
+    return sorted(name for name in os.listdir(BUNDLED_FILES) if name.lower().endswith(".pdf"))
+
+
+def _build_library(folder, scale):
+    """Copies the bundled templates plus `scale` renamed copies of each into `folder`."""
+    for name in _bundled_templates():
+        source = os.path.join(BUNDLED_FILES, name)
+        shutil.copyfile(source, os.path.join(folder, name))
+        for copy in range(1, scale + 1):
+            shutil.copyfile(source, os.path.join(folder, f"copy{copy:04d}_{name}"))
+
+
+def _bench_environment(files_folder, index_path):
+    env = dict(os.environ, FILES_FOLDER=files_folder, FIELD_INDEX="1", FIELD_INDEX_PATH=index_path, PDF_WATCH_INTERVAL="0")
+    env.pop("SERVER_TIMING", None)
+    return env
+
+
+def bench_startup(env):
+    results = {}
+    for label, extra in STARTUP_RUNS:
+        completed = subprocess.run([sys.executable, "-c", STARTUP_PROBE], env=dict(env, **extra), cwd=REPO_ROOT,
+                                   capture_output=True, text=True, check=True)
+        results[label] = json.loads(completed.stdout.strip().splitlines()[-1])
+    return results
+
+
+def _selections(pdf_names):
+    """small: 2 templates, medium: a quarter of the library (at least 3), full: everything; spread evenly."""
+    def spread(count):
+        count = max(1, min(count, len(pdf_names)))
+        return [pdf_names[i * len(pdf_names) // count] for i in range(count)]
+    return {"small": spread(2), "medium": spread(max(3, len(pdf_names) // 4)), "full": list(pdf_names)}
+
+
+def bench_combined_fields(pdf_app, client, repeat):
+    results = []
+    for size, selection in _selections(sorted(pdf_app.pdf_data)).items():
+        for filter_mode in ("all", "common_only"):
+            payload = {"pdfs": selection, "filter_mode": filter_mode}
+            pdf_app._field_postings = None # fresh inverted index: the first request indexes the selection
+            cold_ms, response = post_ms(client, "/combined_fields", payload)
+            merge = []
+            for _ in range(repeat):
+                pdf_app.get_field_postings().results.clear()
+                merge.append(post_ms(client, "/combined_fields", payload)[0])
+            memoized = [post_ms(client, "/combined_fields", payload)[0] for _ in range(repeat)]
+            results.append({"selection": size, "filter_mode": filter_mode, "templates": len(selection),
+                            "fields": len(response.get_json()["fields"]), "response_bytes": len(response.data),
+                            "cold_ms": cold_ms, "merge_ms": statistics.median(merge), "memoized_ms": statistics.median(memoized)})
+    return results
+
+
+def bench_fill(pdf_app, client, pdf_names, repeat):
+    results = []
+    for pdf_name in pdf_names:
+        payload = {"pdf_filename": pdf_name, "field_values": sample_values(pdf_app, pdf_name)}
+        pdf_app.template_cache.invalidate(pdf_app.pdf_data[pdf_name]["path"])
+        first_ms, response = post_ms(client, "/fill", payload)
+        warm = [post_ms(client, "/fill", payload)[0] for _ in range(repeat)]
+        tracemalloc.start() # traced separately: tracing slows allocation-heavy code and would skew the timings
+        try:
+            post_ms(client, "/fill", payload)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results.append({"template": pdf_name, "template_bytes": os.path.getsize(pdf_app.pdf_data[pdf_name]["path"]),
+                        "fields": len(payload["field_values"]), "output_bytes": len(response.data), "first_ms": first_ms,
+                        "warm_ms": statistics.median(warm), "warm_min_ms": min(warm), "peak_traced_bytes": peak_bytes})
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=int, default=0, help="Extra copies of each bundled template (default: 0)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed requests per measurement; medians are reported (default: 5)")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--skip-startup", action="store_true", help="Skip the fresh-interpreter startup runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="pdf-bench-") as workdir:
+        files_folder = os.path.join(workdir, "files"); os.makedirs(files_folder)
+        _build_library(files_folder, args.scale)
+        env = _bench_environment(files_folder, os.path.join(workdir, "field_index.json"))
+        report = {"meta": {"revision": _git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+                           "cpu_count": os.cpu_count(), "scale": args.scale, "templates": len(os.listdir(files_folder)),
+                           "repeat": args.repeat, "started": time.strftime("%Y-%m-%dT%H:%M:%S%z")}}
+        if not args.skip_startup:
+            report["startup"] = bench_startup(env)
+
+        os.environ.update(env) # the in-process app reuses the index written above (or extracts if startup was skipped)
+        logging.disable(logging.CRITICAL)
+        import app as pdf_app
+        client = pdf_app.app.test_client()
+        report["combined_fields"] = bench_combined_fields(pdf_app, client, args.repeat)
+        report["fill"] = bench_fill(pdf_app, client, _bundled_templates(), args.repeat)
+        report["meta"]["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
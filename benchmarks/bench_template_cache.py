@@ -0,0 +1,45 @@
+"""
+Cold vs. warm /fill latency over the bundled templates in files/.
+
+Cold: the template cache is cleared before every fill (parse + clone each time).
+Warm: the template is already parsed and cached; a fill only clones and writes.
+
+Usage: python benchmarks/bench_template_cache.py [--repeat N]
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from _common import fill_once # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Fills per template and mode (default: 5)")
+    args = parser.parse_args()
+
+    import app as pdf_app # not at module level: spawned index workers re-run this script as __mp_main__
+    logging.getLogger().setLevel(logging.WARNING)
+    client = pdf_app.app.test_client()
+    cache = pdf_app.template_cache
+    print(f"{'template':<42} {'cold ms':>9} {'warm ms':>9} {'speedup':>8}")
+    for pdf_name in sorted(pdf_app.pdf_data):
+        payload = {"pdf_filename": pdf_name, "field_values": {}}
+        cold = []
+        for _ in range(args.repeat):
+            cache.invalidate()
+            cold.append(fill_once(client, payload)[0])
+        fill_once(client, payload) # prime
+        warm = [fill_once(client, payload)[0] for _ in range(args.repeat)]
+        cold_ms, warm_ms = statistics.median(cold), statistics.median(warm)
+        print(f"{pdf_name:<42} {cold_ms:>9.1f} {warm_ms:>9.1f} {cold_ms / warm_ms:>7.2f}x")
+    print(f"cache stats: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Output size and /fill latency per write mode over the bundled templates in files/.
+
+full:        the whole document is rewritten.
+compressed:  rewritten with unfiltered streams Flate-compressed and identical objects merged.
+incremental: the template bytes followed by an update section with only the changed objects.
+
+Every text field gets a sample value and every checkbox is ticked, as in
+bench_appearance_modes.py. Templates are warmed first; timings exclude the one-off parse.
+
+Usage: python benchmarks/bench_write_modes.py [--repeat N] [--appearance viewer|server] [--flatten]
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from _common import fill_once, sample_values # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Fills per template and mode (default: 5)")
+    parser.add_argument("--appearance", choices=["viewer", "server"], default="viewer", help="Appearance generation (default: viewer)")
+    parser.add_argument("--flatten", action="store_true", help="Flatten the filled forms")
+    args = parser.parse_args()
+
+    import app as pdf_app # not at module level: spawned index workers re-run this script as __mp_main__
+    logging.getLogger().setLevel(logging.WARNING)
+    client = pdf_app.app.test_client()
+    modes = pdf_app.WRITE_MODES
+    print(f"{'template':<42} {'tmpl KB':>8}" + "".join(f" {mode + ' KB':>15} {mode + ' ms':>15}" for mode in modes))
+    totals = {mode: [0, 0.0] for mode in modes}; template_total = 0
+    for pdf_name in sorted(pdf_app.pdf_data):
+        base = {"pdf_filename": pdf_name, "field_values": sample_values(pdf_app, pdf_name), "appearance": args.appearance, "flatten": args.flatten}
+        fill_once(client, dict(base, write_mode="full")) # prime the template cache
+        template_bytes = os.path.getsize(pdf_app.pdf_data[pdf_name]["path"]); template_total += template_bytes
+        row = f"{pdf_name:<42} {template_bytes / 1024:>8.1f}"
+        for mode in modes:
+            runs = [fill_once(client, dict(base, write_mode=mode)) for _ in range(args.repeat)]
+            elapsed_ms, size = statistics.median(ms for ms, _ in runs), runs[-1][1]
+            totals[mode][0] += size; totals[mode][1] += elapsed_ms
+            row += f" {size / 1024:>15.1f} {elapsed_ms:>15.1f}"
+        print(row)
+    print(f"{'TOTAL':<42} {template_total / 1024:>8.1f}" + "".join(f" {size / 1024:>15.1f} {ms:>15.1f}" for size, ms in totals.values()))
+
+
+if __name__ == "__main__":
+    main()
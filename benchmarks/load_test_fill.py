@@ -0,0 +1,105 @@
+"""
+/fill throughput of the waitress server (python app.py serve) at different thread counts.
+
+For each --threads value a fresh server is started on --port, warmed with one fill per
+template, then hit by --concurrency client threads for --duration seconds, cycling
+through the templates in files/ with empty field values. Reports requests/sec, latency
+percentiles, MB/s and errors per server thread count.
+
+Usage: python benchmarks/load_test_fill.py [--threads 1,2,4,8] [--concurrency 16] [--duration 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _post_fill(base_url, pdf_name):
+    body = json.dumps({"pdf_filename": pdf_name, "field_values": {}}).encode("utf-8")
+    request = urllib.request.Request(f"{base_url}/fill", data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        return len(response.read())
+
+
+def _wait_until_up(base_url, server, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with code {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"{base_url}/pdfs", timeout=5) as response:
+                return json.loads(response.read())["pdfs"]
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not come up within {timeout}s")
+
+
+def _run_load(base_url, pdf_names, concurrency, duration):
+    latencies, sizes, errors = [], [], []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(offset):
+        i = offset
+        while time.monotonic() < stop_at:
+            pdf_name = pdf_names[i % len(pdf_names)]; i += 1
+            start = time.perf_counter()
+            try:
+                size = _post_fill(base_url, pdf_name)
+            except Exception as e:
+                with lock: errors.append(f"{pdf_name}: {e}")
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000); sizes.append(size)
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in clients: thread.start()
+    for thread in clients: thread.join()
+    return latencies, sizes, errors, time.perf_counter() - started
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", default="1,2,4,8", help="Comma-separated server thread counts (default: 1,2,4,8)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent client connections (default: 16)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load per thread count (default: 10)")
+    parser.add_argument("--port", type=int, default=5099, help="Port for the server under test (default: 5099)")
+    args = parser.parse_args()
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    print(f"{'threads':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'MB/s':>7} {'errors':>6}")
+    for threads in (int(n) for n in args.threads.split(",")):
+        command = [sys.executable, os.path.join(REPO_ROOT, "app.py"), "serve", "--host", "127.0.0.1",
+                   "--port", str(args.port), "--threads", str(threads), "--connection-limit", str(max(100, args.concurrency * 2))]
+        server = subprocess.Popen(command, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            pdf_names = _wait_until_up(base_url, server)
+            for pdf_name in pdf_names: _post_fill(base_url, pdf_name) # warm the template cache
+            latencies, sizes, errors, elapsed = _run_load(base_url, pdf_names, args.concurrency, args.duration)
+        finally:
+            server.terminate(); server.wait(timeout=30)
+        if not latencies:
+            print(f"{threads:>7} {'-':>8} {'-':>8} {'-':>8} {'-':>8} {'-':>7} {len(errors):>6}")
+            continue
+        print(f"{threads:>7} {len(latencies) / elapsed:>8.1f} {statistics.median(latencies):>8.1f} "
+              f"{_percentile(latencies, 0.95):>8.1f} {_percentile(latencies, 0.99):>8.1f} "
+              f"{sum(sizes) / elapsed / 1e6:>7.2f} {len(errors):>6}")
+        for error in errors[:3]: print(f"        {error}")
+
+
+if __name__ == "__main__":
+    main()
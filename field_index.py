@@ -0,0 +1,162 @@
+"""
+Persistent on-disk index of extract_fields_with_details() output.
+
+One compact JSON file maps each template filename to its size, mtime, SHA-256 and
+extracted field details, so a process start can skip PDF parsing for unchanged
+templates. Entries are validated per file: a size/mtime match is trusted as-is, a
+mismatch falls back to the content hash (e.g. files copied into an image with new
+mtimes), and anything else is re-extracted.
+
+CLI (no Flask needed, suitable for baking the index into a deploy image):
+    python field_index.py rebuild [--files DIR] [--index PATH] [--workers N]
+    python field_index.py verify  [--files DIR] [--index PATH]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf_fields import timed_extract, init_index_worker, display_name_replacements_fingerprint
+
+logger = logging.getLogger(__name__)
+
+FIELD_INDEX_VERSION = 1 # bump when extract_fields_with_details output changes shape
+FIELD_INDEX_FILENAME = ".field_index.json"
+
+def default_index_path(files_folder):
+    return os.path.join(files_folder, FIELD_INDEX_FILENAME)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""): digest.update(block)
+    return digest.hexdigest()
+
+def file_signature(path):
+    """(mtime_ns, size) of `path`."""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def make_entry(path, fields, index_ms, signature):
+    """
+    Builds an index entry for `path` from `fields`, extracted while the file had `signature` (file_signature()
+    taken before extraction). Returns None if the file has changed since, so old fields never get the new file's identity.
+    """
+    digest = file_sha256(path)
+    try: current = file_signature(path)
+    except OSError: return None
+    if current != tuple(signature): return None
+    return {"size": signature[1], "mtime_ns": signature[0], "sha256": digest, "index_ms": index_ms, "fields": fields}
+
+def load_index(index_path):
+    """
+    Returns {filename: entry} from `index_path`, or {} if it is missing, unreadable, from another
+    version, or built with a different display-name replacement table.
+    """
+    try:
+        with open(index_path, "r", encoding="utf-8") as fh: payload = json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable field index {index_path}: {e}")
+        return {}
+    if payload.get("version") != FIELD_INDEX_VERSION:
+        logger.info(f"Ignoring field index {index_path}: version {payload.get('version')} != {FIELD_INDEX_VERSION}.")
+        return {}
+    if payload.get("display_names") != display_name_replacements_fingerprint():
+        logger.info(f"Ignoring field index {index_path}: built with a different display-name replacement table.")
+        return {}
+    return payload.get("files", {})
+
+def save_index(index_path, entries):
+    """Writes `entries` atomically (temp file + rename) so concurrent readers never see a partial index."""
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump({"version": FIELD_INDEX_VERSION, "display_names": display_name_replacements_fingerprint(), "files": entries}, fh, separators=(",", ":"), default=str)
+    os.replace(tmp_path, index_path)
+
+def lookup(entries, filename, path):
+    """
+    Returns the cached fields for `filename` if its entry still matches the file on disk, else None.
+    A hash-only match refreshes the entry's size/mtime in place.
+    """
+    entry = entries.get(filename)
+    if entry is None:
+        return None
+    try: st = os.stat(path)
+    except OSError: return None
+    if entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+        return entry["fields"]
+    if entry.get("size") == st.st_size and entry.get("sha256") == file_sha256(path):
+        entry["mtime_ns"] = st.st_mtime_ns
+        return entry["fields"]
+    return None
+
+def _pdf_filenames(files_folder):
+    return sorted(f for f in os.listdir(files_folder) if f.lower().endswith(".pdf"))
+
+def build_index(files_folder, index_path, workers=1, force=False):
+    """Re-extracts every stale (or, with `force`, every) template and rewrites the index. Returns the entries."""
+    existing = {} if force else load_index(index_path)
+    entries, stale = {}, []
+    for filename in _pdf_filenames(files_folder):
+        path = os.path.join(files_folder, filename)
+        if lookup(existing, filename, path) is not None: entries[filename] = existing[filename]
+        else: stale.append(filename)
+    paths = [os.path.join(files_folder, filename) for filename in stale]
+    signatures = [file_signature(path) for path in paths] # before extraction; see make_entry
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths)), mp_context=multiprocessing.get_context("spawn"), initializer=init_index_worker) as executor:
+            results = list(executor.map(timed_extract, paths))
+    else:
+        results = [timed_extract(path) for path in paths]
+    for filename, path, signature, (fields, elapsed_ms, _) in zip(stale, paths, signatures, results):
+        entry = make_entry(path, fields, elapsed_ms, signature)
+        if entry is None:
+            logger.warning(f"{filename} changed while it was indexed; left out of the index."); continue
+        entries[filename] = entry
+        logger.info(f"Indexed {filename}: {len(fields)} field(s) in {elapsed_ms:.1f} ms.")
+    save_index(index_path, entries)
+    logger.info(f"Wrote {index_path}: {len(entries)} template(s), {len(stale)} re-extracted.")
+    return entries
+
+def verify_index(files_folder, index_path):
+    """Returns a list of human-readable problems (missing, stale or orphaned entries); empty means up to date."""
+    entries = load_index(index_path); problems = []
+    filenames = _pdf_filenames(files_folder)
+    for filename in filenames:
+        if filename not in entries: problems.append(f"missing: {filename}")
+        elif lookup(dict(entries), filename, os.path.join(files_folder, filename)) is None: problems.append(f"stale: {filename}")
+    for filename in sorted(set(entries) - set(filenames)):
+        problems.append(f"orphaned: {filename}")
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild or verify the persistent PDF field index.")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    parser.add_argument("--files", default=os.environ.get("FILES_FOLDER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")),
+                        help="Template directory (env FILES_FOLDER, default: files/ next to this script)")
+    parser.add_argument("--index", default=None, help=f"Index path (default: <files>/{FIELD_INDEX_FILENAME})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Extraction processes for rebuild")
+    parser.add_argument("--force", action="store_true", help="rebuild: re-extract every template, ignoring the existing index")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    index_path = args.index or default_index_path(args.files)
+
+    if args.command == "rebuild":
+        start = time.perf_counter()
+        build_index(args.files, index_path, workers=args.workers, force=args.force)
+        logger.info(f"Rebuild finished in {(time.perf_counter() - start) * 1000:.1f} ms.")
+        return 0
+    problems = verify_index(args.files, index_path)
+    for problem in problems: print(problem)
+    print(f"{index_path}: {'OK' if not problems else f'{len(problems)} problem(s)'}")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Content-addressed cache of filled PDFs.
+
+A key is an HMAC-SHA-256 of the template's content digest, the render and write modes and the
+resolved field values (canonical JSON), so identical requests map to one entry and an edited
+template can never hit a stale one. The HMAC secret is random per cache (per process): keys
+appear in URLs, logs and file names, and a plain hash would let anyone who can guess a
+record's values confirm through GET /fill/<key> that it was filled recently. Entries live in an in-memory LRU bounded by bytes;
+entries evicted from memory spill to an optional on-disk LRU with its own byte budget. Every
+entry expires after a TTL, since filled forms hold personal data.
+
+Disk entries are encrypted with Fernet (the optional `cryptography` package) under a key from
+the caller or one generated per process. Without it, nothing is written to disk unless plaintext
+storage is explicitly allowed. The disk tier belongs to the running process: it uses its own
+subfolder of the configured folder (named after the process id, so several server processes can
+share one folder), which is emptied at startup, as entries expire or are evicted, and on close().
+
+No Flask; `cryptography` is optional.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError: # optional: without it the disk tier needs allow_plaintext_disk
+    Fernet = None
+    InvalidToken = ValueError
+
+from field_index import file_sha256
+
+logger = logging.getLogger(__name__)
+
+DISK_ENTRY_SUFFIX = ".fillcache"
+
+def request_key(secret, template_digest, render_mode, write_mode, resolved_values):
+    """Cache key for one fill, keyed by `secret`: the template content plus everything that decides the output bytes."""
+    payload = json.dumps([template_digest, render_mode, write_mode, resolved_values], sort_keys=True, separators=(",", ":"),
+                         ensure_ascii=False, default=str)
+    return hmac.new(secret, payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+class _Entry:
+    __slots__ = ("etag", "data", "template", "expires")
+
+    def __init__(self, etag, data, template, expires):
+        self.etag = etag; self.data = data; self.template = template; self.expires = expires
+
+class _DiskTier:
+    """LRU of entry files in this process's subfolder of `folder`, bounded by `max_bytes`; the index is kept in memory."""
+    def __init__(self, folder, max_bytes, fernet=None):
+        self.folder = os.path.join(folder, f"pid-{os.getpid()}"); self.max_bytes = max_bytes; self._fernet = fernet
+        self._entries = OrderedDict() # key -> (etag, template, expires, stored size)
+        self.current_bytes = 0
+        os.makedirs(self.folder, mode=0o700, exist_ok=True)
+        self._remove_entry_files() # left by an earlier process with this id; its key (and TTLs) are gone
+
+    def _remove_entry_files(self):
+        for filename in os.listdir(self.folder):
+            if filename.endswith(DISK_ENTRY_SUFFIX) or filename.endswith(DISK_ENTRY_SUFFIX + ".tmp"):
+                try: os.remove(os.path.join(self.folder, filename))
+                except OSError: pass
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + DISK_ENTRY_SUFFIX)
+
+    def _remove(self, key):
+        _, _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+        try: os.remove(self._path(key))
+        except OSError: pass
+
+    def put(self, key, entry):
+        """Stores `entry`; returns the keys evicted to make room. Caller holds the cache lock."""
+        blob = self._fernet.encrypt(entry.data) if self._fernet is not None else entry.data
+        if len(blob) > self.max_bytes: return [key]
+        if key in self._entries: self._remove(key)
+        temp_path = self._path(key) + ".tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as fh: fh.write(blob)
+        os.replace(temp_path, self._path(key))
+        self._entries[key] = (entry.etag, entry.template, entry.expires, len(blob)); self.current_bytes += len(blob)
+        evicted = []
+        while self.current_bytes > self.max_bytes:
+            evicted_key = next(iter(self._entries)); self._remove(evicted_key); evicted.append(evicted_key)
+        return evicted
+
+    def pop(self, key):
+        """Removes and returns the entry for `key` (None if missing or unreadable). Caller holds the cache lock."""
+        meta = self._entries.get(key)
+        if meta is None: return None
+        etag, template, expires, _ = meta
+        try:
+            with open(self._path(key), "rb") as fh: blob = fh.read()
+            data = self._fernet.decrypt(blob) if self._fernet is not None else blob
+        except (OSError, InvalidToken) as e:
+            logger.warning(f"Dropping unreadable fill cache entry {key}: {e}")
+            data = None
+        self._remove(key)
+        if data is None or hashlib.sha256(data).hexdigest() != etag: return None
+        return _Entry(etag, data, template, expires)
+
+    def keys_where(self, predicate):
+        return [key for key, (_, template, expires, _) in self._entries.items() if predicate(template, expires)]
+
+    def discard(self, key):
+        if key in self._entries: self._remove(key)
+
+    def clear(self):
+        for key in list(self._entries): self._remove(key)
+
+    def close(self):
+        """Removes every entry file and the process's subfolder."""
+        self.clear()
+        try:
+            self._remove_entry_files(); os.rmdir(self.folder)
+        except OSError: pass
+
+class FillResultCache:
+    """
+    Two-tier LRU of filled PDFs keyed by self.request_key(). get() returns (etag, pdf bytes, template path) or None;
+    the ETag is the SHA-256 of the bytes, so it is a strong validator. A disk tier is used only
+    when `disk_folder` and `disk_max_bytes` are set and the entries can be encrypted (or
+    `allow_plaintext_disk` is true).
+    """
+    def __init__(self, max_bytes, ttl_seconds, disk_folder=None, disk_max_bytes=0, encryption_key=None, allow_plaintext_disk=False):
+        self.max_bytes = max_bytes; self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> _Entry
+        self._template_digests = {} # template path -> ((mtime_ns, size), sha256)
+        self._lock = threading.Lock()
+        self._key_secret = os.urandom(32) # entries never outlive the process, so neither does the secret
+        self.current_bytes = 0
+        self.hits = 0; self.disk_hits = 0; self.misses = 0; self.evictions = 0; self.expirations = 0; self.invalidations = 0
+        self._disk = None
+        if disk_folder and disk_max_bytes > 0:
+            if Fernet is not None:
+                self._disk = _DiskTier(disk_folder, disk_max_bytes, Fernet(encryption_key or Fernet.generate_key()))
+            elif allow_plaintext_disk:
+                logger.warning(f"Fill cache entries will be written to '{disk_folder}' unencrypted.")
+                self._disk = _DiskTier(disk_folder, disk_max_bytes)
+            else:
+                logger.warning("Fill cache disk tier disabled: install 'cryptography' to encrypt entries (or explicitly allow plaintext).")
+        self._sweeper = None
+
+    def request_key(self, template_digest, render_mode, write_mode, resolved_values):
+        return request_key(self._key_secret, template_digest, render_mode, write_mode, resolved_values)
+
+    def template_digest(self, path):
+        """SHA-256 of the template at `path`, re-hashed only when its mtime/size change (which also drops its cached fills)."""
+        st = os.stat(path); signature = (st.st_mtime_ns, st.st_size)
+        with self._lock: known = self._template_digests.get(path)
+        if known is not None and known[0] == signature: return known[1]
+        digest = file_sha256(path)
+        if known is not None and known[1] != digest: self.invalidate_template(path)
+        with self._lock: self._template_digests[path] = (signature, digest)
+        return digest
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            elif self._disk is not None:
+                entry = self._disk.pop(key)
+                if entry is not None and entry.expires > now:
+                    self._store(key, entry); self.disk_hits += 1
+            if entry is not None and entry.expires <= now:
+                self._drop(key); self.expirations += 1; entry = None
+            if entry is None:
+                self.misses += 1; return None
+            self.hits += 1
+            return entry.etag, entry.data, entry.template
+
+    def put(self, key, template_path, data):
+        """Caches `data` (the fill output for `key` from `template_path`) and returns (etag, data, template_path)."""
+        entry = _Entry(hashlib.sha256(data).hexdigest(), data, template_path, time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            self._drop(key); self._store(key, entry)
+        self._start_sweeper()
+        return entry.etag, data, template_path
+
+    def _store(self, key, entry):
+        """Adds `entry` to memory, spilling least recently used entries to disk (or dropping them). Caller holds the lock."""
+        if len(entry.data) > self.max_bytes:
+            self._spill(key, entry); return
+        self._entries[key] = entry; self.current_bytes += len(entry.data)
+        while self.current_bytes > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted.data)
+            self._spill(evicted_key, evicted)
+
+    def _spill(self, key, entry):
+        if self._disk is None:
+            self.evictions += 1; return
+        try: self.evictions += len(self._disk.put(key, entry))
+        except OSError as e:
+            self.evictions += 1; logger.warning(f"Could not write fill cache entry to disk: {e}")
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None: self.current_bytes -= len(entry.data)
+        if self._disk is not None: self._disk.discard(key)
+
+    def _drop_where(self, predicate):
+        """Drops memory and disk entries for which predicate(template, expires) is true. Caller holds the lock; returns the count."""
+        keys = [key for key, entry in self._entries.items() if predicate(entry.template, entry.expires)]
+        if self._disk is not None: keys += self._disk.keys_where(predicate)
+        for key in keys: self._drop(key)
+        return len(keys)
+
+    def invalidate_template(self, path):
+        """Drops every cached fill of the template at `path` (it changed or was removed)."""
+        with self._lock:
+            self.invalidations += self._drop_where(lambda template, expires: template == path)
+            self._template_digests.pop(path, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear(); self.current_bytes = 0; self._template_digests.clear()
+            if self._disk is not None: self._disk.clear()
+
+    def close(self):
+        """Drops every entry and removes the disk tier's folder (call at process exit)."""
+        with self._lock:
+            self._entries.clear(); self.current_bytes = 0; self._template_digests.clear()
+            if self._disk is not None: self._disk.close()
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock: self.expirations += self._drop_where(lambda template, expires: expires <= now)
+
+    def _start_sweeper(self):
+        """Starts (once) a daemon thread that removes expired entries even when no requests arrive."""
+        if self._sweeper is not None: return
+        with self._lock:
+            if self._sweeper is not None: return
+            self._sweeper = threading.Thread(target=self._sweep, name="fill-cache-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep(self):
+        interval = max(1.0, min(self.ttl_seconds / 2, 60.0))
+        while True:
+            time.sleep(interval)
+            try: self.purge_expired()
+            except Exception as e: logger.error(f"Fill cache sweep failed: {e}", exc_info=True)
+
+    def stats(self):
+        with self._lock:
+            stats = {"entries": len(self._entries), "bytes": self.current_bytes, "max_bytes": self.max_bytes, "hits": self.hits,
+                     "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations, "invalidations": self.invalidations}
+            if self._disk is not None:
+                stats.update(disk_entries=len(self._disk._entries), disk_bytes=self._disk.current_bytes, disk_hits=self.disk_hits)
+            return stats
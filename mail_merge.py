@@ -0,0 +1,316 @@
+"""
+Bulk mail-merge: fills the same templates for every record of a CSV or JSONL file.
+
+Record keys are matched to the field names extract_fields_with_details() discovers: by
+field name or display name, ignoring case, spaces and punctuation (an explicit column map
+wins). `<column>_RowTwo_Input` keys follow their base column, so address concatenation works
+as in the web form. Records are filled across a process pool; each worker parses every
+template once in its initializer and only clones it per record. Outputs are written as
+records complete, to a directory or a ZIP, and a failing record is listed in ERRORS.txt
+instead of stopping the run.
+
+CLI (no Flask needed):
+    python mail_merge.py RECORDS --out DIR|FILE.zip [--template NAME ...] [--files DIR]
+                         [--workers N] [--name-column COL] [--map FILE.json]
+                         [--appearance viewer|server] [--flatten]
+                         [--write-mode full|compressed|incremental]
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from pypdf import PdfReader
+
+from pdf_fields import (ROW_TWO_INPUT_SUFFIX, RENDER_MODES, WRITE_MODES, FillPlan, WidgetMap, fill_form, timed_extract,
+                        clone_for_fill, prepare_for_write)
+import field_index
+
+logger = logging.getLogger(__name__)
+
+MERGE_IN_FLIGHT_PER_WORKER = 4 # records queued per worker; bounds the filled PDFs held in memory
+MERGE_ERRORS_FILENAME = "ERRORS.txt"
+_CHECKBOX_FALSE_STRINGS = {"", "0", "false", "no", "n", "off"}
+
+# ------------------------------------------------
+# Records and column mapping
+# ------------------------------------------------
+def record_format(path, fmt=None):
+    """'csv' or 'jsonl', from `fmt` or the file extension."""
+    fmt = (fmt or os.path.splitext(path)[1].lstrip(".")).lower()
+    if fmt == "csv": return "csv"
+    if fmt in ("jsonl", "ndjson"): return "jsonl"
+    raise ValueError(f"Unsupported record format '{fmt}'. Use csv or jsonl.")
+
+def read_records(path, fmt=None):
+    """Yields (record dict, None) per record of a CSV (header row) or JSONL file, or (None, error) for a bad JSONL line."""
+    fmt = record_format(path, fmt)
+    with open(path, "r", encoding="utf-8-sig", newline="") as fh:
+        if fmt == "csv":
+            for row in csv.DictReader(fh, restval=""): # short rows: missing cells are blank
+                row.pop(None, None) # cells beyond the header
+                yield row, None
+            return
+        for line_no, line in enumerate(fh, 1):
+            if not line.strip(): continue
+            try: record = json.loads(line)
+            except ValueError as e:
+                yield None, f"line {line_no}: invalid JSON ({e})"; continue
+            if not isinstance(record, dict):
+                yield None, f"line {line_no}: expected a JSON object"; continue
+            yield record, None
+
+def _match_key(text):
+    return re.sub(r"[^0-9a-z]", "", str(text).lower())
+
+class ColumnMapper:
+    """
+    Maps record keys to template field names, resolving each distinct key once.
+    A key may feed several fields (same display name on different templates); a fill plan
+    ignores names its template doesn't have.
+    """
+    def __init__(self, fields_by_template, column_map=None):
+        self._column_map = dict(column_map or {})
+        self._by_key = {} # normalized field name / display name -> field names
+        for fields in fields_by_template.values():
+            for field in fields:
+                for label in (field["name"], field.get("displayName", "")):
+                    names = self._by_key.setdefault(_match_key(label), [])
+                    if field["name"] not in names: names.append(field["name"])
+        self._by_key.pop("", None)
+        self._resolved = {} # record key -> tuple of field names
+        self.unmatched = set()
+
+    def fields_for(self, column):
+        names = self._resolved.get(column)
+        if names is not None: return names
+        if column in self._column_map:
+            target = self._column_map[column]
+            names = tuple(target) if isinstance(target, list) else (target,)
+        elif column.endswith(ROW_TWO_INPUT_SUFFIX):
+            names = tuple(name + ROW_TWO_INPUT_SUFFIX for name in self.fields_for(column[:-len(ROW_TWO_INPUT_SUFFIX)]))
+        else:
+            names = tuple(self._by_key.get(_match_key(column), ()))
+        if not names: self.unmatched.add(column)
+        self._resolved[column] = names
+        return names
+
+    def map_record(self, record):
+        """Returns {field name: value} for the keys of `record` that match a field; null values are left out (not filled)."""
+        values = {}
+        for column, value in record.items():
+            if value is None: continue
+            for name in self.fields_for(str(column)): values[name] = value
+        return values
+
+def _output_stem(index, record, name_column):
+    slug = re.sub(r"[^0-9A-Za-z._-]+", "_", str(record.get(name_column, "")).strip()).strip("._") if name_column else ""
+    return f"{index + 1:06d}_{slug[:80]}" if slug else f"{index + 1:06d}"
+
+# ------------------------------------------------
+# Worker side (one parse per template per process)
+# ------------------------------------------------
+_worker_templates = {} # template name -> (template bytes, reader, widget_map, fill_plan)
+_worker_render_mode = "viewer"
+_worker_write_mode = "full"
+
+def init_merge_worker(templates, render_mode, write_mode="full"):
+    """ProcessPoolExecutor initializer. `templates` is {name: (path, fields_details)}."""
+    global _worker_render_mode, _worker_write_mode
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger().setLevel(logging.WARNING) # per-fill INFO lines would flood the log at thousands of records
+    _worker_render_mode = render_mode; _worker_write_mode = write_mode
+    for name, (path, fields) in templates.items():
+        with open(path, "rb") as fh: data = fh.read()
+        reader = PdfReader(BytesIO(data))
+        _worker_templates[name] = (data, reader, WidgetMap(reader), FillPlan(fields))
+
+def _checkbox_strings_to_bool(fill_plan, values):
+    """CSV cells are strings; read 'false'/'0'/'no'/'off'/'' as an unchecked box instead of a truthy string."""
+    coerced = None
+    for name, value in values.items():
+        if isinstance(value, str) and fill_plan.fields.get(name, ("",))[0] == "checkbox":
+            if coerced is None: coerced = dict(values)
+            coerced[name] = value.strip().lower() not in _CHECKBOX_FALSE_STRINGS
+    return values if coerced is None else coerced
+
+def fill_record(task):
+    """Fills every template for one record. Returns (index, [(output name, pdf bytes)], [template errors])."""
+    index, stem, values = task
+    outputs, errors = [], []
+    for name, (data, reader, widget_map, fill_plan) in _worker_templates.items():
+        try:
+            writer = clone_for_fill(reader, data, _worker_write_mode)
+            fill_form(writer, widget_map, fill_plan, _checkbox_strings_to_bool(fill_plan, values), _worker_render_mode, name)
+            prepare_for_write(writer, _worker_write_mode)
+            output_stream = BytesIO(); writer.write(output_stream)
+            outputs.append((f"{stem}_{name}", output_stream.getvalue()))
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+    return index, outputs, errors
+
+# ------------------------------------------------
+# Outputs
+# ------------------------------------------------
+class _DirectoryOutput:
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True); self.path = path
+    def add(self, name, data):
+        tmp_path = os.path.join(self.path, f".{name}.tmp")
+        with open(tmp_path, "wb") as fh: fh.write(data)
+        os.replace(tmp_path, os.path.join(self.path, name))
+    def close(self):
+        pass
+
+class _ZipOutput:
+    def __init__(self, path):
+        self._zip = zipfile.ZipFile(path, mode="w", compression=zipfile.ZIP_DEFLATED)
+    def add(self, name, data):
+        self._zip.writestr(name, data)
+    def close(self):
+        self._zip.close()
+
+def open_output(path):
+    """A ZIP archive if `path` ends in .zip, otherwise a directory (created if missing)."""
+    return _ZipOutput(path) if path.lower().endswith(".zip") else _DirectoryOutput(path)
+
+# ------------------------------------------------
+# Driver
+# ------------------------------------------------
+def run_merge(records_path, templates, output_path, workers=None, render_mode="viewer", name_column=None,
+              column_map=None, record_fmt=None, progress=None, progress_interval=1.0, write_mode="full"):
+    """
+    Fills `templates` ({name: (path, fields_details)}) for every record in `records_path` and writes
+    the PDFs to `output_path` as they complete. Per-record failures (bad lines, fill errors, a crashed
+    worker) are collected, never raised. `progress(status)` is called at most every `progress_interval`
+    seconds and once at the end. Returns the final status dict.
+    """
+    if not templates: raise ValueError("No templates selected.")
+    if render_mode not in RENDER_MODES: raise ValueError(f"Unsupported render mode '{render_mode}'.")
+    if write_mode not in WRITE_MODES: raise ValueError(f"Unsupported write mode '{write_mode}'.")
+    workers = max(1, workers or os.cpu_count() or 1)
+    records = list(read_records(records_path, record_fmt))
+    mapper = ColumnMapper({name: fields for name, (_, fields) in templates.items()}, column_map)
+    status = {"total": len(records), "done": 0, "failed": 0, "outputs": 0, "records_per_sec": 0.0,
+              "elapsed_s": 0.0, "errors": [], "unmatched_columns": []}
+    start = time.perf_counter(); last_report = start
+
+    def record_error(index, stem, message):
+        status["errors"].append(f"record {index + 1} ({stem}): {message}" if stem else f"record {index + 1}: {message}")
+
+    def report(force=False):
+        nonlocal last_report
+        now = time.perf_counter()
+        if not force and now - last_report < progress_interval: return
+        last_report = now
+        status["elapsed_s"] = round(now - start, 3)
+        status["records_per_sec"] = round(status["done"] / (now - start), 2) if now > start else 0.0
+        status["unmatched_columns"] = sorted(mapper.unmatched)
+        if progress is not None: progress(status)
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=min(workers, max(1, len(records))), mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=init_merge_worker, initargs=(templates, render_mode, write_mode))
+
+    output = open_output(output_path)
+    executor = new_pool(); pending = {} # future -> (index, stem)
+    tasks = iter(enumerate(records))
+    try:
+        while True:
+            while len(pending) < workers * MERGE_IN_FLIGHT_PER_WORKER:
+                index, (record, error) = next(tasks, (None, (None, None)))
+                if index is None: break
+                if error is not None:
+                    record_error(index, "", error); status["done"] += 1; status["failed"] += 1; continue
+                stem = _output_stem(index, record, name_column)
+                pending[executor.submit(fill_record, (index, stem, mapper.map_record(record)))] = (index, stem)
+            if not pending: break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            pool_broken = False
+            for future in done:
+                index, stem = pending.pop(future)
+                status["done"] += 1
+                try:
+                    _, outputs, errors = future.result()
+                except BrokenProcessPool:
+                    pool_broken = True; status["failed"] += 1
+                    record_error(index, stem, "worker process crashed; record not filled"); continue
+                except Exception as e:
+                    status["failed"] += 1; record_error(index, stem, str(e)); continue
+                for name, data in outputs: output.add(name, data)
+                status["outputs"] += len(outputs)
+                if errors:
+                    status["failed"] += 1
+                    for error in errors: record_error(index, stem, error)
+            if pool_broken: # every in-flight record died with the pool; start a fresh one and carry on
+                for future, (index, stem) in pending.items():
+                    status["done"] += 1; status["failed"] += 1
+                    record_error(index, stem, "worker process crashed; record not filled")
+                pending.clear(); executor.shutdown(wait=False, cancel_futures=True); executor = new_pool()
+                logger.warning("Mail-merge worker pool crashed; restarted it.")
+            if progress is not None: report()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if status["errors"]: output.add(MERGE_ERRORS_FILENAME, ("\n".join(status["errors"]) + "\n").encode("utf-8"))
+        output.close()
+    report(force=True)
+    return status
+
+def load_templates(files_folder, names=None, index_path=None):
+    """{name: (path, fields_details)} for `names` (default: every PDF in `files_folder`), reusing the field index when valid."""
+    names = names or sorted(f for f in os.listdir(files_folder) if f.lower().endswith(".pdf"))
+    persisted = field_index.load_index(index_path or field_index.default_index_path(files_folder))
+    templates = {}
+    for name in names:
+        path = os.path.join(files_folder, name)
+        if not os.path.isfile(path): raise FileNotFoundError(f"Template not found: {path}")
+        fields = field_index.lookup(persisted, name, path)
+        templates[name] = (path, fields if fields is not None else timed_extract(path)[0])
+    return templates
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill templates for every record of a CSV or JSONL file.")
+    parser.add_argument("records", help="Records file (.csv with a header row, or .jsonl)")
+    parser.add_argument("--out", required=True, help="Output directory, or a path ending in .zip")
+    parser.add_argument("--template", action="append", dest="templates", help="Template filename in --files (repeatable; default: all)")
+    parser.add_argument("--files", default=os.environ.get("FILES_FOLDER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")),
+                        help="Template directory (env FILES_FOLDER, default: files/ next to this script)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Records format (default: from the extension)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Fill processes")
+    parser.add_argument("--name-column", help="Record column used in output filenames")
+    parser.add_argument("--map", help="JSON file mapping record columns to field names (overrides matching)")
+    parser.add_argument("--appearance", choices=["viewer", "server"], default="viewer", help="Appearance generation (default: viewer)")
+    parser.add_argument("--flatten", action="store_true", help="Flatten the filled forms")
+    parser.add_argument("--write-mode", choices=WRITE_MODES, default="full",
+                        help="full rewrite, compressed rewrite, or the template plus an incremental update (default: full)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    column_map = None
+    if args.map:
+        with open(args.map, "r", encoding="utf-8") as fh: column_map = json.load(fh)
+    templates = load_templates(args.files, args.templates)
+
+    def print_progress(status):
+        logger.info(f"{status['done']}/{status['total']} record(s), {status['failed']} failed, {status['records_per_sec']:.1f} records/s")
+
+    status = run_merge(args.records, templates, args.out, workers=args.workers, render_mode="flatten" if args.flatten else args.appearance,
+                       name_column=args.name_column, column_map=column_map, record_fmt=args.format, progress=print_progress,
+                       write_mode=args.write_mode)
+    if status["unmatched_columns"]: logger.warning(f"Columns matching no field: {', '.join(status['unmatched_columns'])}")
+    for error in status["errors"][:20]: logger.error(error)
+    logger.info(f"Wrote {status['outputs']} PDF(s) to {args.out} in {status['elapsed_s']:.1f}s "
+                f"({status['records_per_sec']:.1f} records/s, {status['failed']} failed record(s)).")
+    return 1 if status["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
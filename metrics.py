@@ -0,0 +1,137 @@
+"""
+In-process metrics: counters and histograms rendered in the Prometheus text format, plus
+per-request phase timings for the Server-Timing header.
+
+Stdlib only; label sets are kept small (route, template, phase). Phase timings are recorded
+into a histogram and, when the calling thread is serving a request that collects timings,
+into that request's Server-Timing entries.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in (*zip(labelnames, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_number(value):
+    if value == float("inf"): return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with labels."""
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name; self.help = help_text; self.labelnames = tuple(labelnames)
+        self._values = {}; self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock: self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock: items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}" for key, value in items)
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram (seconds) with labels."""
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name; self.help = help_text; self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {} # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None: series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: series[i] += 1; break
+            series[-2] += value; series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock: items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, (('le', _format_number(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+class Registry:
+    """Holds metrics plus gauge callbacks (values read at scrape time) and renders them all."""
+    def __init__(self):
+        self._metrics = []; self._gauges = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames); self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets); self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, labelnames, collect):
+        """`collect()` returns [(label values tuple, value), ...] when scraped."""
+        self._gauges.append((name, help_text, tuple(labelnames), collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics: lines.extend(metric.render())
+        for name, help_text, labelnames, collect in self._gauges:
+            lines.extend((f"# HELP {name} {help_text}", f"# TYPE {name} gauge"))
+            lines.extend(f"{name}{_format_labels(labelnames, key)} {_format_number(value)}" for key, value in collect())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PHASE_SECONDS = REGISTRY.histogram("pdf_phase_seconds", "Time spent per processing phase.", ("operation", "phase", "template"))
+
+# ------------------------------------------------
+# Per-request phase collection (Server-Timing)
+# ------------------------------------------------
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def start_request_timings():
+    """Starts collecting phase timings for the current request; returns a token for stop_request_timings()."""
+    return _request_timings.set([])
+
+def stop_request_timings(token):
+    """Stops collecting for the current request."""
+    _request_timings.reset(token)
+
+def current_request_timings():
+    """The [(phase, seconds), ...] collected so far for the current request ([] if not collecting)."""
+    return _request_timings.get() or []
+
+def record_phase(operation, phase, seconds, template=""):
+    """Adds one phase measurement to the histogram and to the current request's timings."""
+    PHASE_SECONDS.observe(seconds, operation=operation, phase=phase, template=template)
+    timings = _request_timings.get()
+    if timings is not None: timings.append((phase, seconds))
+
+@contextmanager
+def timed_phase(operation, phase, template=""):
+    start = time.perf_counter()
+    try: yield
+    finally: record_phase(operation, phase, time.perf_counter() - start, template)
+
+def server_timing_header(timings, total_seconds=None):
+    """Server-Timing value: phases with the same name are summed, in first-seen order, plus an optional 'total'."""
+    summed = {}
+    for phase, seconds in timings: summed[phase] = summed.get(phase, 0.0) + seconds
+    if total_seconds is not None: summed["total"] = total_seconds
+    return ", ".join(f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in summed.items())
@@ -0,0 +1,571 @@
+"""
+PDF form helpers: display-name formatting, per-template field extraction, widget layout,
+fill plans, form flattening and output write modes. Kept free of Flask and app state so index worker processes can import it cheaply.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import re # For display name generation
+import time
+from io import BytesIO
+
+# pypdf import
+import pypdf
+from pypdf import PdfReader, PdfWriter
+# Import necessary types from pypdf.generic
+from pypdf.generic import DictionaryObject, ArrayObject, NameObject, TextStringObject, NumberObject, BooleanObject, StreamObject, DecodedStreamObject, EncodedStreamObject, IndirectObject, NullObject
+
+logger = logging.getLogger(__name__)
+
+PYPDF_VERIFIED_SERIES = "6.20" # the write modes and flattening use pypdf internals checked against this series (pinned in Requirements.txt)
+
+if not pypdf.__version__.startswith(PYPDF_VERIFIED_SERIES + "."):
+    logger.warning(f"pypdf {pypdf.__version__} is installed; write modes and flattening were verified against {PYPDF_VERIFIED_SERIES}.x.")
+
+def _pypdf_internal(obj, name):
+    """getattr for a private pypdf attribute the write modes or flattening rely on; raises RuntimeError if pypdf no longer has it."""
+    try: return getattr(obj, name)
+    except AttributeError:
+        raise RuntimeError(f"pypdf {pypdf.__version__} has no {type(obj).__name__}.{name}; write modes and flattening "
+                           f"need pypdf {PYPDF_VERIFIED_SERIES}.x (see Requirements.txt).") from None
+
+# Constants for PDF field flags (values are 2^(bit_position-1))
+PDF_FIELD_FLAG_READ_ONLY = 1 << (1 - 1)
+PDF_FIELD_FLAG_RADIO = 1 << (16 - 1)
+PDF_FIELD_FLAG_PUSHBUTTON = 1 << (17 - 1)
+# Add other flags if needed (e.g., REQUIRED, NO_EXPORT, etc.)
+PDF_ANNOT_FLAG_HIDDEN = 1 << (2 - 1)
+PDF_ANNOT_FLAG_NOVIEW = 1 << (6 - 1)
+
+
+# --- Enhanced Helper Function for Display Names ---
+# Specific replacements (case-insensitive), applied before the general splitting passes.
+# Extend or override them without code changes: point DISPLAY_NAME_REPLACEMENTS_FILE at a JSON object.
+DEFAULT_DISPLAY_NAME_REPLACEMENTS = {
+    "Dateofbirth": "Date of Birth", "Date Of Birth": "Date of Birth",
+    "Orunemployed": "Or Unemployed", "Retiredorunemployed": "Retired or Unemployed",
+    "Retiredor": "Retired or", "Accountholder": "Account Holder",
+    "Holderemail": "Holder Email", "Holderdate Ofbirth": "Holder Date of Birth",
+    "Holderdependents": "Holder Dependents", "Holderemployer": "Holder Employer",
+    "Holdermarital": "Holder Marital", "Maritalstatus": "Marital Status",
+    "Employername": "Employer Name", "Priorposition": "Prior Position",
+    "Current Orprior Position": "Current or Prior Position",
+    "Document Andcurrent Supplementalsprovided": "Document And Current Supplementals Provided",
+    "Supplementalsprovided": "Supplementals Provided",
+    "Numberof Yearsexperience": "Number of Years Experience",
+    "Numberof Tradesper Month": "Number of Trades per Month",
+    "Numberof": "Number of", "Tradesper": "Trades per", "Yearsexperience": "Years Experience",
+    "Covered Callsnumbers Ofyears Experience": "Covered Calls Numbers of Years Experience",
+    # Add more specific cases as identified
+}
+DISPLAY_NAME_REPLACEMENTS_FILE = os.environ.get("DISPLAY_NAME_REPLACEMENTS_FILE")
+DISPLAY_NAME_CACHE_SIZE = 65536 # distinct raw names memoized; names repeat heavily across forms
+
+# General CamelCase, number, and separator splitting
+_LOWER_OR_DIGIT_THEN_UPPER = re.compile(r'([a-z0-9])([A-Z])')
+_UPPER_THEN_CAPITALIZED = re.compile(r'([A-Z])([A-Z][a-z])')
+_LETTER_THEN_DIGITS = re.compile(r'([a-zA-Z])([0-9]+)')
+_DIGIT_THEN_LETTER = re.compile(r'([0-9])([a-zA-Z])')
+_SEPARATORS = re.compile(r'[_\-]+')
+_WHITESPACE = re.compile(r'\s+')
+_SMALL_WORDS = frozenset({"of", "or", "per", "and", "the", "a", "an"})
+
+_display_replacements = {} # lowercased pattern -> replacement
+_display_replacements_re = None
+_display_replacements_fingerprint = ""
+
+def set_display_name_replacements(table):
+    """
+    Installs `table` ({pattern: replacement}, matched case-insensitively) as one alternation regex,
+    longest pattern first, and clears the memoized display names.
+    """
+    global _display_replacements, _display_replacements_re, _display_replacements_fingerprint
+    lowered = {}
+    for pattern, replacement in table.items(): lowered.setdefault(pattern.lower(), str(replacement))
+    _display_replacements = lowered
+    _display_replacements_re = re.compile("|".join(re.escape(p) for p in sorted(lowered, key=len, reverse=True)), re.IGNORECASE) if lowered else None
+    _display_replacements_fingerprint = hashlib.sha256(json.dumps(list(table.items())).encode("utf-8")).hexdigest()[:16]
+    _format_display_name.cache_clear()
+
+def load_display_name_replacements(path=DISPLAY_NAME_REPLACEMENTS_FILE):
+    """Installs the built-in table, extended/overridden by the JSON object in `path` if given."""
+    table = dict(DEFAULT_DISPLAY_NAME_REPLACEMENTS)
+    if path:
+        with open(path, "r", encoding="utf-8") as fh: extra = json.load(fh)
+        if not isinstance(extra, dict): raise ValueError(f"{path}: expected a JSON object of pattern -> replacement")
+        table.update(extra)
+    set_display_name_replacements(table)
+
+def display_name_replacements_fingerprint():
+    """Short hash of the active replacement table; persisted display names are only valid for the same table."""
+    return _display_replacements_fingerprint
+
+def _apply_display_replacements(name):
+    # One alternation pass can't see a match that only forms once a neighbour is replaced
+    # ('Accountholderemail' -> 'Account Holderemail' -> 'Account Holder Email'), so repeat until stable.
+    if _display_replacements_re is None: return name
+    for _ in range(len(_display_replacements) + 1): # bounded, in case a replacement re-creates its own pattern
+        replaced = _display_replacements_re.sub(lambda m: _display_replacements[m.group(0).lower()], name)
+        if replaced == name: break
+        name = replaced
+    return name
+
+def format_field_name_for_display(name):
+    """Converts internal PDF field names to more readable display names (memoized per raw name)."""
+    if not name:
+        return ""
+    return _format_display_name(name)
+
+@functools.lru_cache(maxsize=DISPLAY_NAME_CACHE_SIZE)
+def _format_display_name(name):
+    processed_name = _apply_display_replacements(name)
+    
+    # General CamelCase, number, and separator splitting
+    s1 = _LOWER_OR_DIGIT_THEN_UPPER.sub(r'\1 \2', processed_name)
+    s1 = _UPPER_THEN_CAPITALIZED.sub(r'\1 \2', s1)
+    s1 = _LETTER_THEN_DIGITS.sub(r'\1 \2', s1)
+    s1 = _DIGIT_THEN_LETTER.sub(r'\1 \2', s1)
+    s2 = _SEPARATORS.sub(' ', s1)
+    s3 = _WHITESPACE.sub(' ', s2).strip()
+    
+    # Capitalization with lowercase small words (of, or, per, and, etc.)
+    words = s3.split(' ')
+    final_words = []
+    for i, word_val in enumerate(words):
+        if not word_val: continue
+        if word_val.lower() in _SMALL_WORDS and i != 0 and i != len(words) -1 :
+            final_words.append(word_val.lower())
+        else:
+            final_words.append(word_val[0].upper() + word_val[1:])
+    
+    # Fix leading 'Or' if it was lowercased
+    if final_words and final_words[0].lower() == "or" and name.strip().startswith("Or"):
+        final_words[0] = "Or"
+        
+    return ' '.join(final_words)
+
+load_display_name_replacements()
+
+# ------------------------------------------------
+# Field Extraction with Details (Includes Widget Count)
+# ------------------------------------------------
+def extract_fields_with_details(pdf_path, phase_ms=None):
+    """
+    Extracts detailed field info including type, options, value, and widget count.
+    If `phase_ms` is a dict, the time spent parsing the PDF is stored in it under 'parse'.
+    """
+    detailed_fields = []
+    try:
+        parse_start = time.perf_counter()
+        reader = PdfReader(pdf_path)
+        form_fields = reader.get_fields()
+        if phase_ms is not None: phase_ms["parse"] = (time.perf_counter() - parse_start) * 1000
+        if not form_fields:
+            logger.info(f"No interactive form fields found in {pdf_path}")
+            return []
+            
+        for field_name_fq, field_obj_ref in form_fields.items():
+            try:
+                field_obj = field_obj_ref.get_object()
+                # Prefer /T for field name, fallback to fully qualified name
+                field_name_t = field_obj.get("/T")
+                if field_name_t: field_name = str(field_name_t).strip()
+                else: field_name = str(field_name_fq).strip(); logger.debug(f"Field '{field_name_fq}' missing /T, using FQ name.")
+                
+                # --- Filtering ---
+                lname = field_name.lower()
+                if "signature" in lname or "datesigned" in lname or "print name" in lname or ("title" in lname and "job title" not in lname) :
+                    logger.debug(f"Filtered meta field: {field_name}"); continue
+                ff_val = field_obj.get("/Ff", 0)
+                if isinstance(ff_val, NumberObject): ff_val = int(ff_val)
+                if ff_val & PDF_FIELD_FLAG_READ_ONLY: logger.debug(f"Filtered read-only: {field_name}"); continue
+                if ff_val & PDF_FIELD_FLAG_PUSHBUTTON: logger.debug(f"Ignoring pushbutton: {field_name}"); continue
+                
+                # --- Determine Widget Count ---
+                widget_count = 0
+                kids = field_obj.get(NameObject("/Kids")) # Use NameObject for keys
+                if kids and isinstance(kids, ArrayObject):
+                    widget_count = len(kids)
+                elif NameObject("/Subtype") in field_obj and field_obj[NameObject("/Subtype")] == NameObject("/Widget"):
+                    # If it has /Subtype /Widget and no /Kids, it's likely a single widget field
+                     widget_count = 1
+                else:
+                    # Fallback: Assume 1 if it's a field pypdf returned and not clearly a non-widget parent
+                    widget_count = 1 
+                    logger.debug(f"Field '{field_name}' widget count determination fallback: assuming 1.")
+
+                # --- Get Field Value ---
+                raw_value = field_obj.get("/V")
+                field_info_value = None
+                if isinstance(raw_value, (NameObject, TextStringObject)): field_info_value = str(raw_value)
+                elif raw_value is not None: field_info_value = raw_value 
+
+                # --- Initialize Field Info Dict ---
+                field_info = {
+                    "name": field_name, 
+                    "displayName": format_field_name_for_display(field_name),
+                    "type": "text", # Default type
+                    "options": [], 
+                    "export_value": None, # For checkbox 'On' state
+                    "value": field_info_value, 
+                    "widget_count": widget_count, # Store widget count for this PDF
+                    "usedInPdfs": [] # Populated later in /combined_fields
+                }
+
+                # --- Determine Field Type and Options ---
+                field_type_raw = field_obj.get("/FT")
+                if field_type_raw == NameObject("/Tx"): field_info["type"] = "text"
+                elif field_type_raw == NameObject("/Btn"):
+                    if ff_val & PDF_FIELD_FLAG_RADIO:
+                        field_info["type"] = "radio"
+                        radio_options = set()
+                        kids_for_opts = field_obj.get("/Kids") 
+                        if kids_for_opts:
+                            for kid_ref in kids_for_opts:
+                                kid_obj = kid_ref.get_object(); ap = kid_obj.get("/AP")
+                                if ap and isinstance(ap, DictionaryObject):
+                                    n_dict = ap.get("/N")
+                                    if isinstance(n_dict, DictionaryObject):
+                                        for evo in n_dict: 
+                                            evo_str = str(evo)
+                                            if evo_str.lower() != "/off": radio_options.add(evo_str)
+                        if not radio_options and field_obj.get("/Opt"):
+                            opts_raw = field_obj.get("/Opt")
+                            if opts_raw and isinstance(opts_raw, ArrayObject):
+                                for opt_val_raw in opts_raw:
+                                    if isinstance(opt_val_raw, (NameObject, TextStringObject)): radio_options.add(str(opt_val_raw))
+                        field_info["options"] = sorted(list(radio_options))
+                        if not field_info["options"]: logger.warning(f"Radio '{field_name}' in {pdf_path} has no discernible options.")
+                    else: # Checkbox
+                        field_info["type"] = "checkbox"; on_value = "/Yes" 
+                        ap = field_obj.get("/AP")
+                        if ap and isinstance(ap, DictionaryObject):
+                            n_dict = ap.get("/N")
+                            if isinstance(n_dict, DictionaryObject):
+                                for key_obj in n_dict: 
+                                    key_str = str(key_obj)
+                                    if key_str.lower() != "/off": on_value = key_str; break 
+                        field_info["export_value"] = on_value
+                elif field_type_raw == NameObject("/Ch"): # Choice field
+                    field_info["type"] = "choice"; opts = field_obj.get("/Opt")
+                    choice_options = []
+                    if opts and isinstance(opts, ArrayObject):
+                        for opt_item in opts:
+                            if isinstance(opt_item, ArrayObject) and len(opt_item) == 2: 
+                                val = str(opt_item[0]) if isinstance(opt_item[0],(TextStringObject,NameObject)) else str(opt_item[0])
+                                disp = str(opt_item[1]) if isinstance(opt_item[1],(TextStringObject,NameObject)) else str(opt_item[1])
+                                choice_options.append({"value": val, "display": disp})
+                            elif isinstance(opt_item, (TextStringObject,NameObject)): 
+                                val=str(opt_item); choice_options.append({"value":val,"display":val})
+                    field_info["options"] = choice_options
+                else: # Default to text if type is unknown or unhandled
+                    if field_type_raw: logger.warning(f"Unknown field type '{str(field_type_raw)}' for {field_name}. Defaulting text.")
+                    field_info["type"] = "text"
+                
+                detailed_fields.append(field_info)
+            except Exception as e_inner: 
+                logger.error(f"Error processing field '{str(field_name_fq)}' in {pdf_path}: {e_inner}", exc_info=False) 
+    except Exception as e: 
+        logger.error(f"Critical error extracting fields from {pdf_path}: {e}", exc_info=True)
+    return detailed_fields
+
+def timed_extract(path):
+    """
+    Runs extract_fields_with_details and returns (fields, elapsed_ms, phase_ms), where phase_ms splits
+    elapsed_ms into 'parse' (reading the PDF) and 'fields' (building the details). Top-level so worker processes can pickle it.
+    """
+    start = time.perf_counter(); phase_ms = {}
+    fields = extract_fields_with_details(path, phase_ms)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    phase_ms["fields"] = elapsed_ms - phase_ms.setdefault("parse", elapsed_ms)
+    return fields, elapsed_ms, phase_ms
+
+def init_index_worker():
+    """ProcessPoolExecutor initializer: give index workers the same log format as the app."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# ------------------------------------------------
+# Widget Layout (field name -> page/annotation positions)
+# ------------------------------------------------
+def _qualified_field_name(field_obj):
+    """Fully qualified field name, built the same way pypdf's form filler builds it."""
+    if "/TM" in field_obj: return str(field_obj["/TM"])
+    if "/Parent" in field_obj: return _qualified_field_name(field_obj["/Parent"].get_object()) + "." + str(field_obj.get("/T", ""))
+    return str(field_obj.get("/T", ""))
+
+class WidgetMap:
+    """
+    Where each field's widget annotations sit in a template, as (page_index, annot_index) positions.
+    Positions survive cloning, so the map is computed once per template and reused for every fill.
+    Names are matched like PdfWriter.update_page_form_field_values does: qualified name or parent /T.
+    """
+    __slots__ = ("widgets", "titled_widgets")
+
+    def __init__(self, reader):
+        self.widgets = {} # field name -> [(page_index, annot_index), ...]
+        self.titled_widgets = {} # /T -> positions of merged field/widget annotations (own /T and /FT)
+        for page_index, page in enumerate(reader.pages):
+            annots = page.get("/Annots")
+            if not annots: continue
+            for annot_index, annot_ref in enumerate(annots.get_object()):
+                annot = annot_ref.get_object()
+                if "/T" in annot and "/FT" in annot:
+                    self.titled_widgets.setdefault(str(annot["/T"]), []).append((page_index, annot_index))
+                if annot.get("/Subtype") != "/Widget": continue
+                if "/T" in annot and "/FT" in annot: parent = annot
+                elif "/Parent" in annot: parent = annot["/Parent"].get_object()
+                else: continue
+                names = {_qualified_field_name(parent)}
+                if "/T" in parent: names.add(str(parent["/T"]))
+                for name in names:
+                    self.widgets.setdefault(name, []).append((page_index, annot_index))
+
+    def pages_for(self, field_name):
+        """Sorted page indexes holding at least one widget of `field_name`."""
+        return sorted({page_index for page_index, _ in self.widgets.get(field_name, ())})
+
+# ------------------------------------------------
+# Fill Plan (submitted values -> field writes)
+# ------------------------------------------------
+ROW_TWO_INPUT_SUFFIX = "_RowTwo_Input" # Convention for frontend's dynamic second line
+_NATIVE_ROW_TWO_SUFFIXES = ("RowTwo", "Row Two", "Line2", "Line Two") # Common variations
+_NOT_BASE_ADDRESS_MARKERS = ("rowtwo", "row two", "line2", "line two", "city", "state", "zip")
+
+class FillPlan:
+    """
+    Per-template value mapping compiled once from extract_fields_with_details() output.
+    Records which fields are never written (signature/datesigned), which base address fields
+    join the frontend's `<name>_RowTwo_Input` line, and each field's coercion (checkbox on-value,
+    radio, text), so resolve() only does work for the keys a request actually submits.
+    """
+    __slots__ = ("fields", "targets", "skipped")
+
+    def __init__(self, fields_details):
+        self.fields = {} # field name -> (type, checkbox on-value, joins RowTwo input, template's current value)
+        self.targets = {} # submitted key -> field names it feeds
+        self.skipped = [] # template fields never written
+        names = {f["name"] for f in fields_details}
+        for field in fields_details:
+            name = field["name"]; lname = name.lower()
+            if "signature" in lname or "datesigned" in lname:
+                self.skipped.append(name); continue
+            # A base address without a native second-line field gets the frontend's extra input appended
+            is_base_address = lname.endswith("address") and not any(m in lname for m in _NOT_BASE_ADDRESS_MARKERS)
+            joins_row_two = is_base_address and not any(name + suffix in names for suffix in _NATIVE_ROW_TWO_SUFFIXES)
+            self.fields[name] = (field["type"], field.get("export_value", "/Yes"), joins_row_two, field.get("value"))
+            self.targets.setdefault(name, []).append(name)
+            if joins_row_two: self.targets.setdefault(name + ROW_TWO_INPUT_SUFFIX, []).append(name)
+
+    def resolve(self, values):
+        """Maps submitted `values` to {field name: pypdf value}; cost scales with len(values), not the template size."""
+        resolved = {}
+        for key in values:
+            for name in self.targets.get(key, ()):
+                if name in resolved: continue
+                field_type, on_value, joins_row_two, _ = self.fields[name]
+                if joins_row_two and name + ROW_TWO_INPUT_SUFFIX in values:
+                    line1 = str(values.get(name, "")).strip(); line2 = str(values[name + ROW_TWO_INPUT_SUFFIX]).strip()
+                    resolved[name] = ", ".join(part for part in (line1, line2) if part)
+                    continue
+                if name not in values: continue
+                user_value = values[name]
+                if field_type == "checkbox":
+                    resolved[name] = NameObject(on_value) if user_value else NameObject("/Off")
+                elif field_type == "radio":
+                    if user_value: # user_value should be the export value string
+                        resolved[name] = NameObject(str(user_value)) if str(user_value).startswith("/") else TextStringObject(str(user_value))
+                else: # Includes text, choice
+                    resolved[name] = str(user_value)
+        return resolved
+
+    def is_unchanged(self, name, new_value):
+        """True if the template already holds `new_value` for `name` (unset counts as /Off or empty)."""
+        current_value = self.fields[name][3]
+        if current_value is None: current_value = "/Off" if isinstance(new_value, NameObject) else ""
+        return str(new_value) == str(current_value)
+
+# ------------------------------------------------
+# Form Filling (shared by the web app and mail-merge workers)
+# ------------------------------------------------
+RENDER_MODES = ("viewer", "server", "flatten") # viewer-built appearances, server-built appearances, flattened
+
+def fill_form(writer, widget_map, fill_plan, field_values, render_mode="viewer", pdf_name="template"):
+    """
+    Applies `field_values` to `writer` (a fresh clone of the template that `widget_map` and
+    `fill_plan` were built for). Only changed values are written, only on the pages holding
+    their widgets. Raises RuntimeError if the AcroForm can't be obtained.
+    """
+    # --- Robust AcroForm Handling ---
+    acro_form_obj = writer._root_object.get(NameObject("/AcroForm"))
+    acro_form_dict = None 
+    if acro_form_obj is None:
+        logger.warning(f"/AcroForm missing in {pdf_name}. Creating empty."); acro_form_dict = DictionaryObject()
+        writer._root_object[NameObject("/AcroForm")] = acro_form_dict
+    elif isinstance(acro_form_obj, IndirectObject): 
+        resolved_obj = acro_form_obj.get_object()
+        if isinstance(resolved_obj, DictionaryObject): acro_form_dict = resolved_obj
+        else: logger.error(f"Resolved /AcroForm not Dict in {pdf_name}: {type(resolved_obj)}."); acro_form_dict = DictionaryObject(); writer._root_object[NameObject("/AcroForm")] = writer._add_object(acro_form_dict)
+    elif isinstance(acro_form_obj, DictionaryObject): acro_form_dict = acro_form_obj
+    else: logger.error(f"Unexpected /AcroForm type in {pdf_name}: {type(acro_form_obj)}."); acro_form_dict = DictionaryObject(); writer._root_object[NameObject("/AcroForm")] = acro_form_dict
+    
+    if acro_form_dict:
+        acro_form_dict.setdefault(NameObject("/Fields"), ArrayObject())
+        acro_form_dict[NameObject("/NeedAppearances")] = BooleanObject(render_mode == "viewer")
+        if NameObject("/DR") not in acro_form_dict: logger.warning(f"/DR missing in AcroForm for {pdf_name}.")
+    else: 
+        logger.error(f"Failed to obtain AcroForm dictionary for {pdf_name}."); raise RuntimeError(f"Internal error processing AcroForm for {pdf_name}")
+    # --- End AcroForm Handling ---
+
+    # --- Map the submitted values through the template's fill plan (skips, address concatenation, coercion) ---
+    final_values_to_set = fill_plan.resolve(field_values)
+    
+    # --- Apply the final_values_to_set (only changed values, only on pages that hold their widgets) ---
+    if final_values_to_set:
+        # Set before the page updates, which build the appearance streams from /DA (server/flatten never regenerate them)
+        if "AccountHolderName" in final_values_to_set:
+            for page_num, annot_index in widget_map.titled_widgets.get("AccountHolderName", ()):
+                annot = writer.pages[page_num]["/Annots"][annot_index].get_object()
+                annot[NameObject("/DA")] = TextStringObject("/Helv 10 Tf 0 0 0 rg")
+                annot.setdefault(NameObject("/MK"), DictionaryObject())
+                logger.debug(f"Applied specific /DA style to AccountHolderName on page {page_num} in {pdf_name}")
+
+        values_by_page = {}
+        for pdf_field_name, new_value in final_values_to_set.items():
+            if fill_plan.is_unchanged(pdf_field_name, new_value): continue # template already holds this value
+            for page_num in widget_map.pages_for(pdf_field_name):
+                values_by_page.setdefault(page_num, {})[pdf_field_name] = new_value
+        for page_num, page_values in sorted(values_by_page.items()):
+            try:
+                writer.update_page_form_field_values(writer.pages[page_num], page_values, auto_regenerate=(render_mode == "viewer"))
+            except Exception as page_update_err:
+                logger.error(f"Error updating fields on page {page_num} for {pdf_name}: {page_update_err}", exc_info=False)
+        logger.info(f"Applied {len(final_values_to_set)} field values to {pdf_name} ({len(values_by_page)} of {len(writer.pages)} page(s) touched).")
+    else: 
+        logger.info(f"No relevant field values provided by user to fill for {pdf_name}.")
+
+    if render_mode == "flatten":
+        widgets_drawn = flatten_form(writer)
+        logger.info(f"Flattened {widgets_drawn} widget(s) into page content for {pdf_name}.")
+
+# ------------------------------------------------
+# Flattening (burn widget appearances into page content)
+# ------------------------------------------------
+def _normal_appearance(annot):
+    """The widget's current normal appearance stream (state-selected via /AS for buttons), or None."""
+    ap = annot.get("/AP")
+    if ap is None: return None
+    normal = ap.get_object().get("/N")
+    if normal is None: return None
+    normal = normal.get_object()
+    if isinstance(normal, StreamObject): return normal
+    if isinstance(normal, DictionaryObject):
+        state = annot.get("/AS")
+        if state is not None and state in normal: return normal[state].get_object()
+    return None
+
+def _form_to_rect_matrix(appearance, rect):
+    """Matrix mapping the appearance's transformed /BBox onto the annotation /Rect (PDF 32000 12.5.5), or None."""
+    rx0, rx1 = sorted((float(rect[0]), float(rect[2]))); ry0, ry1 = sorted((float(rect[1]), float(rect[3])))
+    bbox = [float(v) for v in appearance.get("/BBox", [0, 0, rx1 - rx0, ry1 - ry0])]
+    a, b, c, d, e, f = [float(v) for v in appearance.get("/Matrix", [1, 0, 0, 1, 0, 0])]
+    corners = [(x * a + y * c + e, x * b + y * d + f) for x in (bbox[0], bbox[2]) for y in (bbox[1], bbox[3])]
+    bx0, bx1 = min(x for x, _ in corners), max(x for x, _ in corners)
+    by0, by1 = min(y for _, y in corners), max(y for _, y in corners)
+    if bx1 - bx0 == 0 or by1 - by0 == 0: return None
+    sx = (rx1 - rx0) / (bx1 - bx0); sy = (ry1 - ry0) / (by1 - by0)
+    return sx, sy, rx0 - bx0 * sx, ry0 - by0 * sy
+
+def flatten_form(writer):
+    """
+    Draws every visible widget's current normal appearance into its page's content stream, then
+    removes the widget annotations and the /AcroForm dictionary. Values must already have
+    appearance streams (fill with server-side appearances first). Returns the number of widgets drawn.
+    """
+    drawn = 0
+    for page in writer.pages:
+        annots = page.get("/Annots")
+        if not annots: continue
+        drawing = []; xobjects = None
+        for annot_ref in annots.get_object():
+            annot = annot_ref.get_object()
+            if annot.get("/Subtype") != "/Widget" or "/Rect" not in annot: continue
+            if int(annot.get("/F", 0)) & (PDF_ANNOT_FLAG_HIDDEN | PDF_ANNOT_FLAG_NOVIEW): continue
+            appearance = _normal_appearance(annot)
+            if appearance is None: continue
+            placement = _form_to_rect_matrix(appearance, annot["/Rect"])
+            if placement is None: continue
+            if xobjects is None:
+                resources = page.setdefault(NameObject("/Resources"), DictionaryObject()).get_object()
+                xobjects = resources.setdefault(NameObject("/XObject"), DictionaryObject()).get_object()
+            appearance.setdefault(NameObject("/Type"), NameObject("/XObject"))
+            appearance.setdefault(NameObject("/Subtype"), NameObject("/Form"))
+            appearance_ref = appearance.indirect_reference or writer._add_object(appearance)
+            xobject_name = NameObject(f"/FlatFm{len(xobjects)}")
+            while xobject_name in xobjects: xobject_name = NameObject(xobject_name + "_")
+            xobjects[xobject_name] = appearance_ref
+            sx, sy, tx, ty = placement
+            drawing.append(f"q {sx:.6g} 0 0 {sy:.6g} {tx:.6g} {ty:.6g} cm {xobject_name} Do Q")
+        if not drawing: continue
+        # Isolate the existing content in q/Q so its graphics state can't displace the burned-in fields
+        save_state = DecodedStreamObject(); save_state.set_data(b"q\n")
+        fields_content = DecodedStreamObject(); fields_content.set_data(("\nQ\n" + "\n".join(drawing) + "\n").encode("latin-1"))
+        existing_parts = []
+        if "/Contents" in page:
+            existing = page.raw_get("/Contents"); resolved = existing.get_object()
+            existing_parts = list(resolved) if isinstance(resolved, ArrayObject) else [existing if isinstance(existing, IndirectObject) else writer._add_object(existing)]
+        page[NameObject("/Contents")] = ArrayObject([writer._add_object(save_state), *existing_parts, writer._add_object(fields_content)])
+        drawn += len(drawing)
+    writer.remove_annotations(subtypes="/Widget")
+    for idnum, obj in enumerate(_pypdf_internal(writer, "_objects"), start=1): # removed widgets become bare NullObjects; incremental writes need their ids
+        if isinstance(obj, NullObject) and getattr(obj, "indirect_reference", None) is None:
+            try: obj.indirect_reference = IndirectObject(idnum, 0, writer)
+            except AttributeError: _pypdf_internal(obj, "indirect_reference") # raises: NullObject no longer takes the attribute
+    if "/AcroForm" in writer.root_object: del writer.root_object["/AcroForm"]
+    return drawn
+
+# ------------------------------------------------
+# Output Write Modes
+# ------------------------------------------------
+WRITE_MODES = ("full", "compressed", "incremental") # full rewrite, rewrite with Flate + merged duplicates, changes appended to the template bytes
+
+class _IncrementBase:
+    """
+    Stands in for the template reader when an incremental writer is serialized, which only reads the
+    original bytes and their startxref. Each writer gets its own stream, so concurrent fills of one
+    cached template never share a file position.
+    """
+    def __init__(self, data, startxref):
+        self.stream = BytesIO(data); self._startxref = startxref
+
+def clone_for_fill(reader, template_bytes, write_mode="full"):
+    """Returns a PdfWriter holding a private copy of `reader`'s document (parsed from `template_bytes`), set up for `write_mode`."""
+    if write_mode == "incremental":
+        writer = PdfWriter(reader, incremental=True)
+        _pypdf_internal(writer, "_reader") # replaced below; the increment is written against it
+        writer._reader = _IncrementBase(template_bytes, _pypdf_internal(reader, "_startxref"))
+    else:
+        writer = PdfWriter(); writer.clone_document_from_reader(reader)
+    return writer
+
+def _flate_encode_streams(writer, idnums):
+    """Flate-compresses the unfiltered streams among `idnums` (XMP metadata stays readable, as PDF/A expects)."""
+    objects, replace_object = _pypdf_internal(writer, "_objects"), _pypdf_internal(writer, "_replace_object")
+    for idnum in idnums:
+        obj = objects[idnum - 1]
+        if not isinstance(obj, StreamObject) or isinstance(obj, EncodedStreamObject) or "/Filter" in obj or obj.get("/Type") == "/Metadata": continue
+        replace_object(idnum, obj.flate_encode())
+
+def prepare_for_write(writer, write_mode="full"):
+    """
+    Size reductions applied after filling, just before the writer is serialized:
+    - 'compressed': Flate-compresses every unfiltered stream, then merges identical objects and drops unreferenced ones.
+    - 'incremental': compresses only the streams the increment adds or replaces; template objects are left byte-identical.
+    - 'full': nothing.
+    """
+    if write_mode == "compressed":
+        _flate_encode_streams(writer, range(1, len(_pypdf_internal(writer, "_objects")) + 1))
+        writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+    elif write_mode == "incremental":
+        _flate_encode_streams(writer, [ref.idnum for ref in writer.list_objects_in_increment()])
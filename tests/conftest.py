@@ -0,0 +1,27 @@
+"""
+Shared fixtures. The app is imported once per session against the bundled templates in files/,
+eagerly indexed in-process and without the persisted field index, so runs leave no files behind.
+"""
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILES_FOLDER = os.path.join(REPO_ROOT, "files")
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+sys.path.insert(0, REPO_ROOT)
+
+os.environ.update(FILES_FOLDER=FILES_FOLDER, FIELD_INDEX="0", PDF_INDEX_MODE="eager", PDF_INDEX_WORKERS="1",
+                  PDF_WATCH_INTERVAL="0", FILL_CACHE="0")
+
+
+@pytest.fixture(scope="session")
+def pdf_app():
+    import app
+    return app
+
+
+@pytest.fixture()
+def client(pdf_app):
+    return pdf_app.app.test_client()
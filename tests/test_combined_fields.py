@@ -0,0 +1,61 @@
+"""
+/combined_fields against stored responses for the bundled templates.
+
+tests/data/combined_fields.json was recorded with the original single-pass merge (before the
+inverted index and result memo), so these tests pin that output: field order, usedInPdfs,
+widget counts, merged radio options and the common_only filter.
+"""
+import json
+import os
+import random
+
+import pytest
+
+from conftest import DATA_FOLDER
+
+EXPECTED_PATH = os.path.join(DATA_FOLDER, "combined_fields.json")
+FILTER_MODES = ("all", "common_only")
+
+
+def selections(pdf_names):
+    """{case id: selection}; fixed seeds so the cases never change."""
+    rnd = random.Random(1)
+    cases = {"all": list(pdf_names), "all_reversed": list(reversed(pdf_names)), "single": [pdf_names[0]],
+             "repeated_and_missing": ["F6.pdf", "F1C.pdf", "F6.pdf", "missing.pdf"]}
+    for i in range(4):
+        cases[f"sample_{i}"] = rnd.sample(pdf_names, rnd.randint(2, len(pdf_names) - 1))
+    return cases
+
+
+def collect(client, pdf_names):
+    """{'<case>/<filter_mode>': response JSON} for every case; also used to record the expectations."""
+    results = {}
+    for case, selection in selections(pdf_names).items():
+        for filter_mode in FILTER_MODES:
+            response = client.post("/combined_fields", json={"pdfs": selection, "filter_mode": filter_mode})
+            assert response.status_code == 200, (case, filter_mode, response.status_code)
+            results[f"{case}/{filter_mode}"] = response.get_json()
+    return results
+
+
+@pytest.fixture(scope="module")
+def expected():
+    with open(EXPECTED_PATH, "r", encoding="utf-8") as fh: return json.load(fh)
+
+
+def test_matches_recorded_responses(pdf_app, client, expected):
+    actual = collect(client, sorted(pdf_app.pdf_data))
+    assert sorted(actual) == sorted(expected)
+    for case in expected:
+        assert actual[case] == expected[case], case
+
+
+def test_memoized_result_is_identical(pdf_app, client):
+    payload = {"pdfs": sorted(pdf_app.pdf_data), "filter_mode": "common_only"}
+    first = client.post("/combined_fields", json=payload).get_json()
+    assert client.post("/combined_fields", json=payload).get_json() == first
+
+
+def test_empty_selection_is_rejected(client):
+    response = client.post("/combined_fields", json={"pdfs": []})
+    assert response.status_code == 400
@@ -0,0 +1,106 @@
+"""
+format_field_name_for_display against the original per-call regex implementation, the
+DISPLAY_NAME_REPLACEMENTS_FILE override, and the field index it invalidates.
+"""
+import json
+import os
+import re
+
+import pytest
+from pypdf import PdfReader
+
+from conftest import FILES_FOLDER
+import field_index
+import pdf_fields
+
+COPIES = 3 # renamed copies of each corpus name ('AccountHolderName' -> 'AccountHolderName_2')
+EDGE_NAMES = ["", " ", "OrUnemployed", "Or_prior", "retiredorunemployed", "ACCOUNTHOLDERemail", "Accountholderemail",
+              "numberof tradesper month", "SSN2ndLine", "a-b__c", "IRAOwnerName", "x1y2Z3", "TheEndOfThe"]
+
+
+def reference_format(name):
+    """The pre-optimization implementation, kept as the behavioural reference (also timed by benchmarks/bench_display_names.py)."""
+    if not name:
+        return ""
+    processed_name = name
+    for pattern, replacement in pdf_fields.DEFAULT_DISPLAY_NAME_REPLACEMENTS.items():
+        processed_name = re.sub(r'(?i)' + re.escape(pattern), lambda m: replacement, processed_name)
+    s1 = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', processed_name)
+    s1 = re.sub(r'([A-Z])([A-Z][a-z])', r'\1 \2', s1)
+    s1 = re.sub(r'([a-zA-Z])([0-9]+)', r'\1 \2', s1)
+    s1 = re.sub(r'([0-9])([a-zA-Z])', r'\1 \2', s1)
+    s2 = re.sub(r'[_\-]+', ' ', s1)
+    s3 = re.sub(r'\s+', ' ', s2).strip()
+    words = s3.split(' ')
+    final_words = []
+    small_words = {"of", "or", "per", "and", "the", "a", "an"}
+    for i, word_val in enumerate(words):
+        if not word_val: continue
+        if word_val.lower() in small_words and i != 0 and i != len(words) - 1:
+            final_words.append(word_val.lower())
+        else:
+            final_words.append(word_val[0].upper() + word_val[1:])
+    if final_words and final_words[0].lower() == "or" and name.strip().startswith("Or"):
+        final_words[0] = "Or"
+    return ' '.join(final_words)
+
+
+def corpus(copies=COPIES):
+    """Every raw field name in files/, plus `copies` renamed copies of each."""
+    names = []
+    for filename in sorted(os.listdir(FILES_FOLDER)):
+        if filename.lower().endswith(".pdf"):
+            names.extend((PdfReader(os.path.join(FILES_FOLDER, filename)).get_fields() or {}).keys())
+    return names + [f"{name}_{copy}" for copy in range(1, copies + 1) for name in names]
+
+
+@pytest.fixture()
+def replacements():
+    """Restores the configured replacement table after the test."""
+    yield
+    pdf_fields.load_display_name_replacements(pdf_fields.DISPLAY_NAME_REPLACEMENTS_FILE)
+
+
+def test_matches_reference_on_corpus(replacements):
+    pdf_fields.load_display_name_replacements(None) # built-in table only, same as the reference
+    names = sorted(set(corpus()))
+    assert len(names) > 500
+    mismatches = [name for name in names if pdf_fields.format_field_name_for_display(name) != reference_format(name)]
+    assert mismatches == []
+
+
+@pytest.mark.parametrize("name", EDGE_NAMES)
+def test_matches_reference_on_edge_names(replacements, name):
+    pdf_fields.load_display_name_replacements(None)
+    assert pdf_fields.format_field_name_for_display(name) == reference_format(name)
+
+
+def test_replacements_file_extends_and_overrides(replacements, tmp_path):
+    pdf_fields.load_display_name_replacements(None)
+    default_fingerprint = pdf_fields.display_name_replacements_fingerprint()
+    assert pdf_fields.format_field_name_for_display("DateofbirthAcctNo") == "Date of Birth Acct No" # memoized before the reload
+
+    path = tmp_path / "names.json"
+    path.write_text(json.dumps({"Acct": "Account", "Dateofbirth": "DOB"}), encoding="utf-8")
+    pdf_fields.load_display_name_replacements(str(path))
+    assert pdf_fields.format_field_name_for_display("DateofbirthAcctNo") == "DOB Account No"
+    assert pdf_fields.format_field_name_for_display("Accountholder") == "Account Holder" # built-ins still apply
+    assert pdf_fields.display_name_replacements_fingerprint() != default_fingerprint
+
+    path.write_text(json.dumps(["Acct", "Account"]), encoding="utf-8")
+    with pytest.raises(ValueError):
+        pdf_fields.load_display_name_replacements(str(path))
+
+
+def test_field_index_is_ignored_after_the_table_changes(replacements, tmp_path):
+    pdf_fields.load_display_name_replacements(None)
+    index_path = str(tmp_path / "field_index.json")
+    entries = {"F6.pdf": {"fields": [{"name": "Accountholder", "display_name": "Account Holder"}]}}
+    field_index.save_index(index_path, entries)
+    assert field_index.load_index(index_path) == entries
+
+    pdf_fields.set_display_name_replacements({**pdf_fields.DEFAULT_DISPLAY_NAME_REPLACEMENTS, "Accountholder": "Holder"})
+    assert field_index.load_index(index_path) == {} # display names were built with the old table
+
+    pdf_fields.load_display_name_replacements(None)
+    assert field_index.load_index(index_path) == entries
@@ -0,0 +1,60 @@
+"""
+Persisting fields extracted lazily (PDF_INDEX_MODE=lazy without warm-up) to the on-disk field index.
+"""
+import pytest
+
+import field_index
+
+
+@pytest.fixture()
+def index_path(pdf_app, tmp_path, monkeypatch):
+    path = str(tmp_path / "field_index.json")
+    monkeypatch.setattr(pdf_app, "FIELD_INDEX_ENABLED", True)
+    monkeypatch.setattr(pdf_app, "FIELD_INDEX_PATH", path)
+    monkeypatch.setattr(pdf_app, "_persisted_index", {})
+    return path
+
+
+def _unindexed(pdf_app, pdf_name):
+    return pdf_app._new_pdf_entry(pdf_name, pdf_app.pdf_data[pdf_name]["signature"])
+
+
+def test_lazy_extraction_is_saved_after_the_delay(pdf_app, index_path, monkeypatch):
+    saves = []; save = pdf_app.save_field_index
+    monkeypatch.setattr(pdf_app, "save_field_index", lambda: (saves.append(True), save()))
+    monkeypatch.setattr(pdf_app, "FIELD_INDEX_SAVE_DELAY", 0.5) # long enough that both extractions land first on a busy machine
+    for pdf_name in ("F6.pdf", "EP1.pdf"): # a burst of extractions is saved once
+        pdf_app.get_fields_details(pdf_name, _unindexed(pdf_app, pdf_name))
+    timer = pdf_app._field_index_save_timer
+    assert timer is not None
+    timer.join(5)
+    assert saves == [True] and pdf_app._field_index_save_timer is None
+    assert {"F6.pdf", "EP1.pdf"} <= set(field_index.load_index(index_path))
+
+
+def test_pending_save_runs_at_exit(pdf_app, index_path):
+    pdf_app.get_fields_details("F6.pdf", _unindexed(pdf_app, "F6.pdf"))
+    assert pdf_app._field_index_save_timer is not None
+    pdf_app._save_pending_field_index()
+    assert pdf_app._field_index_save_timer is None
+    assert "F6.pdf" in field_index.load_index(index_path)
+
+
+def test_entry_keeps_the_identity_the_fields_were_extracted_from(tmp_path):
+    path = tmp_path / "form.pdf"
+    path.write_bytes(b"%PDF-1.4 old")
+    signature = field_index.file_signature(str(path))
+    entry = field_index.make_entry(str(path), [{"name": "Old"}], 1.0, signature)
+    assert (entry["mtime_ns"], entry["size"]) == signature
+
+    path.write_bytes(b"%PDF-1.4 replaced after extraction")
+    assert field_index.make_entry(str(path), [{"name": "Old"}], 1.0, signature) is None
+
+
+def test_template_replaced_during_extraction_is_not_persisted(pdf_app, index_path):
+    pdf_info = _unindexed(pdf_app, "F6.pdf")
+    pdf_info["signature"] = (0, 0) # scanned before the file was replaced
+    pdf_app._persisted_index["F6.pdf"] = {"stale": True}
+    pdf_app.get_fields_details("F6.pdf", pdf_info)
+    pdf_app._save_pending_field_index()
+    assert pdf_info["fields_details"] and "F6.pdf" not in pdf_app._persisted_index
@@ -0,0 +1,98 @@
+"""
+/fill against stored field values for the bundled templates.
+
+tests/data/fill_values.json was recorded with the original per-request fill (before the template
+cache, widget map and fill plan), so these tests pin which value each field ends up with:
+checkbox on-values, radio and choice options, cleared fields, the RowTwo address join and the
+skipped signature fields.
+"""
+import io
+import json
+import os
+import random
+
+import pytest
+from pypdf import PdfReader
+
+from conftest import DATA_FOLDER
+
+EXPECTED_PATH = os.path.join(DATA_FOLDER, "fill_values.json")
+TRIALS = 3
+
+
+def random_values(fields, rnd):
+    """Submitted values for one fill: a mix of set, cleared and unset fields of every type."""
+    values = {}
+    for field in fields:
+        r = rnd.random()
+        if field["type"] == "checkbox": values[field["name"]] = r < 0.5
+        elif field["type"] == "radio": values[field["name"]] = rnd.choice(field["options"] + [""]) if field["options"] else ""
+        elif field["type"] == "choice": values[field["name"]] = rnd.choice([o["value"] for o in field["options"]] + [""]) if field["options"] else ""
+        else: values[field["name"]] = "" if r < 0.4 else f"v{rnd.randint(0, 999)}"
+        if field["name"].lower().endswith("address") and r < 0.7: values[field["name"] + "_RowTwo_Input"] = "City ST"
+    return values
+
+
+def filled_values(pdf_bytes):
+    """{field name: /V as text}, with unset and /Off both reported as ''."""
+    values = {}
+    for name, field in (PdfReader(io.BytesIO(pdf_bytes)).get_fields() or {}).items():
+        value = field.get("/V")
+        value = "" if value is None else str(value)
+        values[name] = "" if value == "/Off" else value
+    return values
+
+
+def collect(client, pdf_names, fields_for):
+    """{'<template>#<trial>': filled values}; `fields_for(name)` gives the template's field details. Also records the expectations."""
+    rnd = random.Random(7); results = {}
+    for pdf_name in pdf_names:
+        fields = fields_for(pdf_name)
+        for trial in range(TRIALS):
+            values = random_values(fields, rnd)
+            if pdf_name == "F6.pdf" and trial == 0: values["AccountHolderName"] = "Jane Q"
+            response = client.post("/fill", json={"pdf_filename": pdf_name, "field_values": values})
+            assert response.status_code == 200, (pdf_name, trial, response.status_code)
+            results[f"{pdf_name}#{trial}"] = filled_values(response.data)
+    return results
+
+
+@pytest.fixture(scope="module")
+def expected():
+    with open(EXPECTED_PATH, "r", encoding="utf-8") as fh: return json.load(fh)
+
+
+def test_matches_recorded_values(pdf_app, client, expected):
+    actual = collect(client, sorted(pdf_app.pdf_data), pdf_app.get_fields_details)
+    assert sorted(actual) == sorted(expected)
+    for case in expected:
+        assert actual[case] == expected[case], case
+
+
+@pytest.mark.parametrize("write_mode", ["compressed", "incremental"])
+def test_write_modes_fill_the_same_values(pdf_app, client, write_mode):
+    pdf_name = "F6.pdf"
+    values = random_values(pdf_app.get_fields_details(pdf_name), random.Random(3))
+    full = client.post("/fill", json={"pdf_filename": pdf_name, "field_values": values})
+    other = client.post("/fill", json={"pdf_filename": pdf_name, "field_values": values, "write_mode": write_mode})
+    assert full.status_code == other.status_code == 200
+    assert filled_values(other.data) == filled_values(full.data)
+
+
+@pytest.mark.parametrize("render", [{"appearance": "server"}, {"flatten": True}])
+def test_account_holder_name_appearance_uses_forced_style(client, render):
+    """The AccountHolderName /DA override must reach the appearance stream the server builds (and flattening burns in)."""
+    response = client.post("/fill", json=dict(render, pdf_filename="EP1.pdf", field_values={"AccountHolderName": "Jane Q"}))
+    assert response.status_code == 200
+    page = PdfReader(io.BytesIO(response.data)).pages[1]
+    streams = [xobject.get_object().get_data() for xobject in page["/Resources"].get("/XObject", {}).values()]
+    for annot in page.get("/Annots") or ():
+        annot = annot.get_object()
+        if annot.get("/T") == "AccountHolderName": streams.append(annot["/AP"]["/N"].get_object().get_data())
+    drawn = [stream for stream in streams if b"(Jane Q) Tj" in stream]
+    assert drawn and all(b"/Helv 10.0 Tf" in stream for stream in drawn)
+
+
+def test_unknown_template_is_404(client):
+    response = client.post("/fill", json={"pdf_filename": "missing.pdf", "field_values": {}})
+    assert response.status_code == 404
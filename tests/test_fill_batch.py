@@ -0,0 +1,83 @@
+"""
+/fill_batch over the bundled templates: the streamed ZIP, ERRORS.txt on partial failure,
+de-duplication, the merged output='pdf' and the request errors.
+"""
+import io
+import os
+import zipfile
+
+import pytest
+from pypdf import PdfReader
+
+from conftest import FILES_FOLDER
+
+PDFS = ["F6.pdf", "EP1.pdf"]
+
+
+def fill_batch(client, **payload):
+    payload.setdefault("field_values", {})
+    return client.post("/fill_batch", json=payload)
+
+
+def page_count(pdf_name):
+    return len(PdfReader(os.path.join(FILES_FOLDER, pdf_name)).pages)
+
+
+@pytest.fixture()
+def fail_f6(pdf_app, monkeypatch):
+    """Makes every F6.pdf fill raise; the other templates fill as usual."""
+    original = pdf_app.fill_pdf_template
+    def fill_pdf_template(pdf_name, *args, **kwargs):
+        if pdf_name == "F6.pdf": raise RuntimeError("F6 exploded")
+        return original(pdf_name, *args, **kwargs)
+    monkeypatch.setattr(pdf_app, "fill_pdf_template", fill_pdf_template)
+
+
+def test_zip_has_one_filled_entry_per_pdf(client):
+    response = fill_batch(client, pdfs=PDFS, field_values={"AccountHolderName": "Jane Q"})
+    assert response.status_code == 200 and response.mimetype == "application/zip"
+    assert response.is_streamed
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == [f"filled_{name}" for name in PDFS]
+        for name in PDFS:
+            fields = PdfReader(io.BytesIO(archive.read(f"filled_{name}"))).get_fields()
+            assert fields["AccountHolderName"].get("/V") == "Jane Q"
+
+
+def test_zip_lists_failures_in_errors_txt(client, fail_f6):
+    response = fill_batch(client, pdfs=PDFS)
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ["filled_EP1.pdf", "ERRORS.txt"]
+        assert archive.read("ERRORS.txt").decode() == "F6.pdf: F6 exploded\n"
+
+
+def test_duplicate_pdfs_are_filled_once(client):
+    response = fill_batch(client, pdfs=["F6.pdf", "EP1.pdf", "F6.pdf"])
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ["filled_F6.pdf", "filled_EP1.pdf"]
+
+
+@pytest.mark.parametrize("write_mode", ["full", "compressed"])
+def test_pdf_output_merges_every_page(client, write_mode):
+    response = fill_batch(client, pdfs=PDFS + ["F6.pdf"], output="pdf", write_mode=write_mode)
+    assert response.status_code == 200 and response.mimetype == "application/pdf"
+    assert len(PdfReader(io.BytesIO(response.data)).pages) == sum(page_count(name) for name in PDFS)
+
+
+def test_pdf_output_fails_whole_on_any_error(client, fail_f6):
+    response = fill_batch(client, pdfs=PDFS, output="pdf")
+    assert response.status_code == 500
+    assert response.json["details"] == ["F6.pdf: F6 exploded"]
+
+
+@pytest.mark.parametrize("payload", [{"pdfs": []}, {}, {"pdfs": PDFS, "output": "tar"}, {"pdfs": PDFS, "write_mode": "bogus"}])
+def test_bad_request_is_400(client, payload):
+    assert fill_batch(client, **payload).status_code == 400
+
+
+def test_unknown_pdf_is_404(client):
+    response = fill_batch(client, pdfs=["F6.pdf", "missing.pdf"])
+    assert response.status_code == 404
+    assert "missing.pdf" in response.json["error"]
@@ -0,0 +1,66 @@
+"""
+fill_cache keys and the /fill result cache routes.
+"""
+import hashlib
+import json
+import os
+
+import pytest
+
+import fill_cache
+
+KEY_ARGS = ("digest", "viewer", "full", {"Name": "Jane Q"})
+
+
+def test_request_key_is_keyed_by_a_per_cache_secret():
+    first, second = fill_cache.FillResultCache(1 << 20, 60), fill_cache.FillResultCache(1 << 20, 60)
+    assert first.request_key(*KEY_ARGS) == first.request_key(*KEY_ARGS)
+    assert first.request_key(*KEY_ARGS) != second.request_key(*KEY_ARGS)
+    unkeyed = hashlib.sha256(json.dumps(list(KEY_ARGS), sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+    assert first.request_key(*KEY_ARGS) != unkeyed
+
+
+@pytest.fixture()
+def result_cache(pdf_app, monkeypatch):
+    cache = fill_cache.FillResultCache(8 << 20, 60)
+    monkeypatch.setattr(pdf_app, "fill_result_cache", cache)
+    return cache
+
+
+def test_fill_is_served_again_from_content_location(client, result_cache):
+    payload = {"pdf_filename": "F6.pdf", "field_values": {"AccountHolderName": "Jane Q"}}
+    filled = client.post("/fill", json=payload)
+    assert filled.status_code == 200
+    location = filled.headers["Content-Location"]
+    again = client.get(location)
+    assert again.status_code == 200 and again.data == filled.data
+    assert client.get(location, headers={"If-None-Match": filled.headers["ETag"]}).status_code == 304
+    assert client.post("/fill", json=payload).headers["Content-Location"] == location
+    assert client.get("/fill/" + "0" * 64).status_code == 404
+
+
+def _spilled_cache(folder, count=3):
+    cache = fill_cache.FillResultCache(100, 60, str(folder), 1 << 20, allow_plaintext_disk=True)
+    for i in range(count): cache.put(f"key{i}", "template.pdf", bytes([i]) * 80) # each put spills the previous entry
+    return cache
+
+
+def _entry_files(folder):
+    return sorted(name for _, _, names in os.walk(folder) for name in names if name.endswith(fill_cache.DISK_ENTRY_SUFFIX))
+
+
+def test_disk_tier_is_private_to_the_process(tmp_path, monkeypatch):
+    first = _spilled_cache(tmp_path)
+    assert len(_entry_files(tmp_path)) == 2
+    monkeypatch.setattr(os, "getpid", lambda: 1) # another server (or worker) process sharing the folder
+    other = _spilled_cache(tmp_path)
+    assert len(_entry_files(tmp_path)) == 4
+    assert first.get("key0")[1] == bytes([0]) * 80 and first.stats()["disk_hits"] == 1
+    other.close()
+    assert not (tmp_path / "pid-1").exists() and first.get("key1") is not None
+
+
+def test_app_builds_the_cache_only_when_enabled(pdf_app, monkeypatch):
+    monkeypatch.setattr(pdf_app, "fill_result_cache", None)
+    pdf_app.init_fill_cache()
+    assert pdf_app.fill_result_cache is None # FILL_CACHE=0 in the test environment
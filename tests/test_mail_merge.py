@@ -0,0 +1,45 @@
+"""
+mail_merge record reading, column mapping and an end-to-end run over a bundled template.
+"""
+import io
+import json
+import os
+
+from pypdf import PdfReader
+
+from conftest import FILES_FOLDER
+import mail_merge
+import pdf_fields
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as fh: fh.write(text)
+    return str(path)
+
+
+def _f6_templates():
+    path = os.path.join(FILES_FOLDER, "F6.pdf")
+    return {"F6.pdf": (path, pdf_fields.extract_fields_with_details(path))}
+
+
+def test_short_csv_row_reads_missing_cells_as_blank(tmp_path):
+    path = _write(tmp_path / "records.csv", "AccountHolderName,AccountNumber\nJane Q\nJohn R,1234,extra\n")
+    records = [record for record, _ in mail_merge.read_records(path)]
+    assert records == [{"AccountHolderName": "Jane Q", "AccountNumber": ""}, {"AccountHolderName": "John R", "AccountNumber": "1234"}]
+
+
+def test_null_values_are_not_mapped(tmp_path):
+    path = _write(tmp_path / "records.jsonl", json.dumps({"AccountHolderName": "Jane Q", "AccountNumber": None}) + "\n")
+    (record, error), = mail_merge.read_records(path)
+    mapper = mail_merge.ColumnMapper({name: fields for name, (_, fields) in _f6_templates().items()})
+    assert error is None and mapper.map_record(record) == {"AccountHolderName": "Jane Q"}
+
+
+def test_run_merge_never_fills_the_text_none(tmp_path):
+    records = _write(tmp_path / "records.csv", "AccountHolderName,AccountNumber\nJane Q\n")
+    status = mail_merge.run_merge(records, _f6_templates(), str(tmp_path / "out"), workers=1, name_column="AccountHolderName")
+    assert status["done"] == 1 and status["failed"] == 0 and status["outputs"] == 1
+    with open(tmp_path / "out" / "000001_Jane_Q_F6.pdf", "rb") as fh:
+        fields = PdfReader(io.BytesIO(fh.read())).get_fields()
+    assert fields["AccountHolderName"].get("/V") == "Jane Q"
+    assert all(field.get("/V") != "None" for field in fields.values())
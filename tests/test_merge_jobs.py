@@ -0,0 +1,68 @@
+"""
+/merge_jobs: bad input is rejected with 400 before a job is queued; finished jobs expire with their output.
+"""
+import io
+import os
+import time
+
+import pytest
+
+
+def _post_form(client, **form):
+    form.setdefault("records", (io.BytesIO(b"AccountHolderName\nJane Q\n"), "records.csv"))
+    return client.post("/merge_jobs", data=form, content_type="multipart/form-data")
+
+
+@pytest.mark.parametrize("pdfs", ['["F6.pdf"', '["F6.pdf", 3]', '[{}]'])
+def test_malformed_pdfs_form_value_is_400(client, pdfs):
+    assert _post_form(client, pdfs=pdfs).status_code == 400
+
+
+@pytest.mark.parametrize("column_map", ['["x"]', '"x"', "3", "{not json"])
+def test_column_map_must_be_an_object(client, column_map):
+    assert _post_form(client, pdfs="F6.pdf", column_map=column_map).status_code == 400
+
+
+@pytest.mark.parametrize("options", [{"pdfs": "F6.pdf"}, {"pdfs": ["F6.pdf"], "column_map": ["x"]}])
+def test_json_options_are_validated(client, options):
+    response = client.post("/merge_jobs", json=dict(options, records=[{"AccountHolderName": "Jane Q"}]))
+    assert response.status_code == 400
+
+
+@pytest.fixture()
+def jobs_folder(pdf_app, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_app, "MERGE_JOBS_FOLDER", str(tmp_path))
+    monkeypatch.setattr(pdf_app, "MERGE_WORKERS", 1)
+    return tmp_path
+
+
+def _wait_for(client, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/merge_jobs/{job_id}").get_json()
+        if job["state"] in ("done", "failed"): return job
+        time.sleep(0.05)
+    raise AssertionError(f"merge job {job_id} did not finish")
+
+
+def test_finished_job_expires_with_its_output(pdf_app, client, jobs_folder):
+    response = client.post("/merge_jobs", json={"pdfs": ["F6.pdf"], "records": [{"AccountHolderName": "Jane Q"}]})
+    assert response.status_code == 202
+    job = _wait_for(client, response.get_json()["id"])
+    assert job["state"] == "done" and job["expires"] is not None
+    assert client.get(f"/merge_jobs/{job['id']}/download").status_code == 200
+    output_path = os.path.join(jobs_folder, f"{job['id']}.zip")
+    assert os.path.exists(output_path)
+
+    assert pdf_app.purge_expired_merge_jobs(now=job["expires"] - 1) == 0
+    assert pdf_app.purge_expired_merge_jobs(now=job["expires"]) == 1
+    assert client.get(f"/merge_jobs/{job['id']}").status_code == 404
+    assert not os.path.exists(output_path)
+
+
+def test_purge_removes_old_files_of_unknown_jobs(pdf_app, jobs_folder):
+    old, recent = jobs_folder / "0123abcd.zip", jobs_folder / "4567cdef.zip"
+    old.write_bytes(b"PK"); recent.write_bytes(b"PK")
+    os.utime(old, (time.time() - pdf_app.MERGE_JOB_TTL - 10,) * 2)
+    pdf_app.purge_expired_merge_jobs()
+    assert not old.exists() and recent.exists()
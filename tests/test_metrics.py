@@ -0,0 +1,86 @@
+"""
+/metrics after fills (pdf_fill_bytes_total counts the bytes each response sends) and the Server-Timing header.
+"""
+import io
+import zipfile
+
+import pytest
+
+import fill_cache
+import metrics
+
+FILL = {"pdf_filename": "F6.pdf", "field_values": {"AccountHolderName": "Jane Q"}}
+
+
+def scrape(client, name):
+    """{label text: value} for metric `name` in a /metrics scrape."""
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.content_type == metrics.PROMETHEUS_CONTENT_TYPE
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith(name + "{"):
+            labels, value = line[len(name):].rsplit(" ", 1)
+            samples[labels] = float(value)
+    return samples
+
+
+def fill_bytes(client, template):
+    return scrape(client, "pdf_fill_bytes_total").get(f'{{template="{template}"}}', 0)
+
+
+@pytest.fixture()
+def result_cache(pdf_app, monkeypatch):
+    cache = fill_cache.FillResultCache(8 << 20, 60)
+    monkeypatch.setattr(pdf_app, "fill_result_cache", cache)
+    return cache
+
+
+def test_streamed_fill_bytes_are_counted(client):
+    before = fill_bytes(client, "F6.pdf")
+    response = client.post("/fill", json=FILL)
+    assert response.status_code == 200
+    sent = len(response.data) # streamed: counted as the body is read
+    assert fill_bytes(client, "F6.pdf") - before == sent
+    assert scrape(client, "pdf_fills_total")['{template="F6.pdf",mode="viewer"}'] >= 1
+    assert scrape(client, "http_requests_total")['{route="/fill",method="POST",status="200"}'] >= 1
+
+
+def test_cached_fills_count_every_download(client, result_cache):
+    before = fill_bytes(client, "F6.pdf")
+    first = client.post("/fill", json=FILL)
+    hit = client.post("/fill", json=FILL)
+    again = client.get(first.headers["Content-Location"])
+    assert first.status_code == hit.status_code == again.status_code == 200
+    assert result_cache.stats()["hits"] == 2
+    assert fill_bytes(client, "F6.pdf") - before == 3 * len(first.data)
+    etag = {"If-None-Match": first.headers["ETag"]}
+    assert client.post("/fill", json=FILL, headers=etag).status_code == 412 # no body, nothing counted
+    assert client.get(first.headers["Content-Location"], headers=etag).status_code == 304
+    assert fill_bytes(client, "F6.pdf") - before == 3 * len(first.data)
+
+
+def test_batch_bytes_are_counted(pdf_app, client):
+    before = fill_bytes(client, "EP1.pdf")
+    response = client.post("/fill_batch", json={"pdfs": ["F6.pdf", "EP1.pdf"], "field_values": {}})
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive: entry = archive.getinfo("filled_EP1.pdf")
+    assert fill_bytes(client, "EP1.pdf") - before == entry.file_size
+
+    before = fill_bytes(client, pdf_app.MERGED_TEMPLATE_LABEL)
+    response = client.post("/fill_batch", json={"pdfs": ["F6.pdf", "EP1.pdf"], "field_values": {}, "output": "pdf"})
+    assert response.status_code == 200
+    sent = len(response.data)
+    assert fill_bytes(client, pdf_app.MERGED_TEMPLATE_LABEL) - before == sent
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_server_timing_header(pdf_app, client, monkeypatch, enabled):
+    monkeypatch.setattr(pdf_app, "SERVER_TIMING_ENABLED", enabled)
+    pdf_app.template_cache.invalidate() # so the fill parses
+    response = client.post("/fill", json=FILL)
+    assert response.status_code == 200
+    if not enabled:
+        assert "Server-Timing" not in response.headers
+        return
+    phases = dict(entry.split(";dur=") for entry in response.headers["Server-Timing"].split(", "))
+    assert {"parse", "update", "total"} <= set(phases)
+    assert all(float(ms) >= 0 for ms in phases.values())
@@ -0,0 +1,90 @@
+"""
+pdf_fields helpers checked against pypdf itself on the bundled templates.
+"""
+import io
+import os
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import NameObject
+
+from conftest import FILES_FOLDER
+import pdf_fields
+
+TEMPLATES = sorted(name for name in os.listdir(FILES_FOLDER) if name.lower().endswith(".pdf"))
+PROBE_STATE = NameObject("/WidgetMapProbe")
+
+
+def _parent(annot):
+    return annot if "/T" in annot and "/FT" in annot else annot["/Parent"].get_object() if "/Parent" in annot else None
+
+
+def _matched_by_pypdf(writer, page_index, names):
+    """
+    Positions on the page that update_page_form_field_values() writes for each of `names`, as
+    {(page_index, annot_index): last name that matched}. Every name gets its own sentinel value;
+    text-like parents report it in /V, buttons only change /AS, so they start from a probe state.
+    """
+    page = writer.pages[page_index]
+    annots = [ref.get_object() for ref in page.get("/Annots", ())]
+    for annot in annots:
+        if annot.get("/Subtype") == "/Widget": annot[NameObject("/AS")] = PROBE_STATE
+    matched = {}
+    for name_index, name in enumerate(names):
+        sentinel = f"wm-{page_index}-{name_index}" # unique per call: fields can have widgets on several pages
+        before = [(annot.get("/AS"), _parent(annot) and _parent(annot).get("/V")) for annot in annots]
+        writer.update_page_form_field_values(page, {name: sentinel}, auto_regenerate=False)
+        for annot_index, annot in enumerate(annots):
+            parent = _parent(annot)
+            if annot.get("/Subtype") != "/Widget" or parent is None: continue
+            if (annot.get("/AS"), parent.get("/V")) != before[annot_index]:
+                matched[(page_index, annot_index)] = name
+        for annot in annots:
+            if annot.get("/Subtype") == "/Widget": annot[NameObject("/AS")] = PROBE_STATE
+    return matched
+
+
+@pytest.mark.parametrize("pdf_name", TEMPLATES)
+def test_widget_map_matches_update_page_form_field_values(pdf_name):
+    reader = PdfReader(os.path.join(FILES_FOLDER, pdf_name))
+    widget_map = pdf_fields.WidgetMap(reader)
+    writer = PdfWriter(clone_from=reader)
+    for page_index in range(len(writer.pages)):
+        names = [name for name, positions in widget_map.widgets.items() if any(p == page_index for p, _ in positions)]
+        expected = {}
+        for name in names:
+            for position in widget_map.widgets[name]:
+                if position[0] == page_index: expected.setdefault(position, set()).add(name)
+        matched = _matched_by_pypdf(writer, page_index, names)
+        assert set(matched) == set(expected), (pdf_name, page_index)
+        for position, name in matched.items():
+            assert name in expected[position], (pdf_name, position, name)
+
+
+def test_pages_for_is_sorted_and_unique():
+    widget_map = pdf_fields.WidgetMap(PdfReader(os.path.join(FILES_FOLDER, "F6.pdf")))
+    for name in widget_map.widgets:
+        pages = widget_map.pages_for(name)
+        assert pages == sorted(set(pages))
+    assert widget_map.pages_for("no such field") == []
+
+
+@pytest.mark.parametrize("render_mode", ["server", "flatten"])
+def test_incremental_write_appends_to_the_template(render_mode):
+    """Incremental output swaps pypdf's reader for a stub; the template bytes must come out untouched, followed by the update."""
+    path = os.path.join(FILES_FOLDER, "F6.pdf")
+    with open(path, "rb") as fh: template_bytes = fh.read()
+    reader = PdfReader(path)
+    writer = pdf_fields.clone_for_fill(reader, template_bytes, "incremental")
+    fields = pdf_fields.extract_fields_with_details(path)
+    values = {field["name"]: "Jane Q" for field in fields if field["type"] == "text"}
+    pdf_fields.fill_form(writer, pdf_fields.WidgetMap(reader), pdf_fields.FillPlan(fields), values, render_mode)
+    pdf_fields.prepare_for_write(writer, "incremental")
+    output = io.BytesIO(); writer.write(output)
+    assert output.getvalue().startswith(template_bytes) and len(output.getvalue()) > len(template_bytes)
+    assert len(PdfReader(output).pages) == len(reader.pages)
+
+
+def test_missing_pypdf_internal_fails_loudly():
+    with pytest.raises(RuntimeError, match="Requirements.txt"):
+        pdf_fields._pypdf_internal(PdfWriter(), "_no_such_attribute")
@@ -0,0 +1,36 @@
+"""
+`python app.py serve` binds loopback unless a public bind is asked for explicitly.
+"""
+import pytest
+import waitress
+
+
+@pytest.fixture()
+def bound(monkeypatch):
+    """Hosts waitress was asked to bind; nothing is actually served."""
+    hosts = []
+    monkeypatch.setattr(waitress, "serve", lambda app, host, **kwargs: hosts.append(host))
+    return hosts
+
+
+@pytest.mark.parametrize("host, loopback", [("127.0.0.1", True), ("::1", True), ("[::1]", True), ("localhost", True), ("LOCALHOST", True),
+                                            ("0.0.0.0", False), ("::", False), ("", False), ("*", False), ("192.168.1.5", False),
+                                            ("pdf.example.com", False)])
+def test_is_loopback_host(pdf_app, host, loopback):
+    assert pdf_app.is_loopback_host(host) is loopback
+
+
+def test_serve_defaults_to_loopback(pdf_app, bound):
+    assert pdf_app.SERVE_HOST == "127.0.0.1"
+    assert pdf_app.main(["serve"]) == 0
+    assert bound == ["127.0.0.1"]
+
+
+def test_public_bind_needs_opt_in(pdf_app, bound, capsys):
+    with pytest.raises(SystemExit) as exited:
+        pdf_app.main(["serve", "--host", "0.0.0.0"])
+    assert exited.value.code == 2 and "--public" in capsys.readouterr().err
+    assert bound == []
+
+    assert pdf_app.main(["serve", "--host", "0.0.0.0", "--public"]) == 0
+    assert bound == ["0.0.0.0"]
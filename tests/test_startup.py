@@ -0,0 +1,27 @@
+"""
+Importing app from a script whose spawned index workers re-run that script (and so import app again).
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+from conftest import FILES_FOLDER, REPO_ROOT
+
+SCRIPT = """
+import sys
+sys.path.insert(0, {repo_root!r})
+import app
+if __name__ == "__main__": print("templates", len(app.pdf_data), app.in_worker_process())
+"""
+
+
+def test_top_level_import_with_an_index_pool(tmp_path):
+    files = tmp_path / "files"; files.mkdir()
+    for name in ("F6.pdf", "EP1.pdf"): shutil.copyfile(os.path.join(FILES_FOLDER, name), files / name)
+    script = tmp_path / "script.py"; script.write_text(SCRIPT.format(repo_root=REPO_ROOT))
+    env = dict(os.environ, FILES_FOLDER=str(files), FIELD_INDEX="0", PDF_INDEX_MODE="eager", PDF_INDEX_WORKERS="2")
+    completed = subprocess.run([sys.executable, str(script)], env=env, cwd=tmp_path, capture_output=True, text=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr[-2000:]
+    assert completed.stdout.strip().splitlines()[-1] == "templates 2 False"
+    assert "using 2 worker(s)" in completed.stderr
@@ -0,0 +1,97 @@
+"""
+TemplateCache accounting and freshness on the bundled templates.
+"""
+import gc
+import os
+import tracemalloc
+
+import pytest
+
+from conftest import FILES_FOLDER
+import pdf_fields
+
+TEMPLATES = sorted(name for name in os.listdir(FILES_FOLDER) if name.lower().endswith(".pdf"))
+
+
+@pytest.mark.parametrize("pdf_name", TEMPLATES)
+def test_entry_size_tracks_retained_memory(pdf_app, pdf_name):
+    """The budget must count the parsed object graph, not just the file: compare with tracemalloc after a fill's clone."""
+    with open(os.path.join(FILES_FOLDER, pdf_name), "rb") as fh: data = fh.read()
+    gc.collect(); tracemalloc.start()
+    try:
+        entry = pdf_app._TemplateEntry((0, 0), data)
+        pdf_fields.clone_for_fill(entry.reader, entry.data) # resolves every object into the reader's cache
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] + len(data)
+    finally:
+        tracemalloc.stop()
+    assert retained / 2 <= entry.size <= retained * 2, (entry.size, retained)
+
+
+def test_budget_evicts_by_estimated_size(pdf_app):
+    paths = [os.path.join(FILES_FOLDER, name) for name in TEMPLATES[:3]]
+    cache = pdf_app.TemplateCache(max_bytes=1)
+    for path in paths: cache.clone_template(path)
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["evictions"] == 2
+    assert stats["bytes"] == cache._entries[paths[-1]].size > os.path.getsize(paths[-1])
+
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def test_clone_follows_the_snapshot_signature(pdf_app, tmp_path):
+    path = str(tmp_path / "form.pdf")
+    with open(os.path.join(FILES_FOLDER, "F6.pdf"), "rb") as fh: old_bytes = fh.read()
+    with open(path, "wb") as fh: fh.write(old_bytes)
+    old_signature = _signature(path)
+    cache = pdf_app.TemplateCache()
+    old_widgets = cache.clone_template(path, signature=old_signature)[1].widgets
+
+    with open(os.path.join(FILES_FOLDER, "EP1.pdf"), "rb") as fh: new_bytes = fh.read()
+    with open(path, "wb") as fh: fh.write(new_bytes) # replaced after the snapshot was taken
+    assert cache.clone_template(path, signature=old_signature)[1].widgets == old_widgets # cached copy is the snapshot's
+    assert cache.clone_template(path, signature=_signature(path))[1].widgets != old_widgets
+    with pytest.raises(pdf_app.TemplateChangedError): # the new file is cached now; the old snapshot must not get it
+        cache.clone_template(path, signature=old_signature)
+    assert cache._entries[path].data == new_bytes
+
+    with open(path, "ab") as fh: fh.write(b"%% still being copied")
+    with pytest.raises(pdf_app.TemplateChangedError): # a file that matches no snapshot is neither parsed nor cached
+        cache.clone_template(path, signature=old_signature)
+    assert cache._entries[path].data == new_bytes
+
+
+@pytest.fixture()
+def stale_f6(pdf_app, monkeypatch):
+    """pdf_data whose F6.pdf entry predates the file on disk; reloads are recorded instead of run."""
+    stale = dict(pdf_app.pdf_data)
+    stale["F6.pdf"] = dict(stale["F6.pdf"], signature=(0, 0))
+    reloads = []
+    monkeypatch.setattr(pdf_app, "pdf_data", stale)
+    monkeypatch.setattr(pdf_app, "reload_pdf_data", lambda scan=None: reloads.append(scan))
+    monkeypatch.setattr(pdf_app, "_template_change_scan", None)
+    return reloads
+
+
+def _fill_f6(client):
+    return client.post("/fill", json={"pdf_filename": "F6.pdf", "field_values": {}})
+
+
+def test_stale_snapshot_reloads_once_two_scans_agree(pdf_app, client, monkeypatch, stale_f6):
+    scans = iter([{"F6.pdf": (1, 1)}, {"F6.pdf": (2, 2)}, {"F6.pdf": (2, 2)}]) # still being copied, then settled
+    monkeypatch.setattr(pdf_app, "_scan_files_folder", lambda: next(scans))
+    for expected_reloads in ([], [], [{"F6.pdf": (2, 2)}]):
+        response = _fill_f6(client)
+        assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+        assert stale_f6 == expected_reloads
+
+
+def test_stale_snapshot_with_the_watcher_running_waits_for_it(pdf_app, client, monkeypatch, stale_f6):
+    monkeypatch.setattr(pdf_app, "_files_watcher_thread", object())
+    monkeypatch.setattr(pdf_app, "PDF_WATCH_INTERVAL", 2.5)
+    response = _fill_f6(client)
+    assert response.status_code == 503 and response.headers["Retry-After"] == "5"
+    assert stale_f6 == []